@@ -25,6 +25,12 @@
 
 """ Common functions used by various parts of AlienFX """
 
+import logging
+import os
+import os.path
+import stat
+import tempfile
+
 import pkg_resources
 
 def get_version():
@@ -35,3 +41,101 @@ def get_version():
         if r.key == "alienfx":
             return r.version
     return "2.4.3"
+
+def write_file_atomic(path, data):
+    """ Write data (bytes) to the file at path, so that the file holds either
+    its previous contents or the new ones even if the program or the system
+    crashes. The data is written to a hidden temporary file in the same
+    directory, which is then renamed over the target. An existing file keeps
+    its permissions; a new file gets those allowed by the umask, as with
+    open()."""
+    tmp_path = _write_temp_file(path, data)
+    try:
+        os.replace(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    _fsync_directory(os.path.dirname(os.path.abspath(path)))
+
+
+def write_files_atomic(files):
+    """ Write many files as write_file_atomic() does, in one pass: all
+    temporary files are written and synced first, then renamed over their
+    targets, and each directory is synced once at the end. 'files' is a list
+    of (path, data) tuples. Each file is replaced atomically, but not all of
+    them together. Files that cannot be written are logged and skipped.
+    Return the list of paths written."""
+    renames = []
+    for (path, data) in files:
+        try:
+            renames.append((_write_temp_file(path, data), path))
+        except Exception as exc:
+            logging.error("Cannot write {}: {}".format(path, exc))
+    written = []
+    directories = set()
+    for (tmp_path, path) in renames:
+        try:
+            os.replace(tmp_path, path)
+        except Exception as exc:
+            logging.error("Cannot write {}: {}".format(path, exc))
+            os.remove(tmp_path)
+            continue
+        written.append(path)
+        directories.add(os.path.dirname(os.path.abspath(path)))
+    for directory in directories:
+        _fsync_directory(directory)
+    return written
+
+
+def _write_temp_file(path, data):
+    """ Write data (bytes) to a synced hidden temporary file next to the file
+    at path, with the permissions the file should have, and return the path
+    of the temporary file."""
+    (directory, filename) = os.path.split(os.path.abspath(path))
+    # mkstemp creates files that only the owner can read.
+    if os.path.exists(path):
+        mode = stat.S_IMODE(os.stat(path).st_mode)
+    else:
+        mode = 0o666 & ~_get_umask()
+    (fd, tmp_path) = tempfile.mkstemp(
+        prefix="." + filename + ".", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            os.fchmod(tmp_file.fileno(), mode)
+            tmp_file.write(data)
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    return tmp_path
+
+
+def _fsync_directory(directory):
+    """ Sync the given directory, so that renames in it are durable."""
+    try:
+        dir_fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
+
+
+def _get_umask():
+    """ Return the umask of the process. It is read from /proc where
+    possible, since reading it with os.umask() briefly changes it for every
+    thread."""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("Umask:"):
+                    return int(line.split()[1], 8)
+    except (IOError, OSError, ValueError):
+        pass
+    umask = os.umask(0o022)
+    os.umask(umask)
+    return umask
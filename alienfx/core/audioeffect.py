@@ -0,0 +1,309 @@
+#
+# audioeffect.py
+#
+# Copyright (C) 2013-2014 Ashwin Menon <ashwin.menon@gmail.com>
+# Copyright (C) 2015-2024 Track Master Steve <trackmastersteve@gmail.com>
+#
+# Alienfx is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# Alienfx is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with alienfx.    If not, write to:
+# 	The Free Software Foundation, Inc.,
+# 	51 Franklin Street, Fifth Floor
+# 	Boston, MA  02110-1301, USA.
+#
+
+""" Audio reactive lighting effect.
+
+Reads raw PCM audio (signed 16 bit little-endian samples, e.g. the output of
+"parec --format=s16le" or "arecord -f S16_LE -t raw") at a fixed frame rate.
+For every frame, the energy of a number of frequency bands is computed with
+an FFT over the most recent samples, and each band is shown on one zone as a
+colour between a "low" and a "high" colour.
+
+The sample, FFT and band buffers are allocated once. Frames are handed to an
+output thread that only keeps the most recent one, so a slow controller makes
+the effect skip frames instead of delaying the audio path.
+
+This module provides the following classes:
+AlienFXAudioEffect: shows the spectrum of an audio stream on the zones
+"""
+
+from builtins import object
+from builtins import range
+import logging
+import math
+import sys
+import threading
+import time
+
+
+class AlienFXAudioEffect(object):
+
+    """ Shows the spectrum of a PCM audio stream on the zones of a
+    controller. Call run() to process the stream until it ends or stop() is
+    called.
+    """
+
+    DEFAULT_LOW_COLOUR = [0, 0, 0]
+    DEFAULT_HIGH_COLOUR = [15, 0, 0]
+
+    # Frequency range (Hz) split into bands
+    MIN_FREQUENCY = 40.0
+    MAX_FREQUENCY = 16000.0
+
+    # Factor by which the band energy that shows as the high colour decays
+    # every frame, so that the effect adapts to the volume
+    PEAK_DECAY = 0.995
+
+    MAX_LEVEL = 15
+
+    def __init__(self, controller, source, sample_rate=44100, channels=2,
+            frame_rate=30, fft_size=512, zones=None, low_colour=None,
+            high_colour=None, realtime=False):
+        """ Create an effect reading PCM audio from 'source', a binary file
+        object. One band is shown on each of the given zones (all zones of
+        the controller if None), from low to high frequencies. If 'realtime'
+        is True, then frames are processed at the frame rate even if the
+        source can be read faster, e.g. when it is a file."""
+        if fft_size < 2 or fft_size & (fft_size - 1):
+            raise ValueError("FFT size must be a power of two")
+        self.controller = controller
+        self.source = source
+        self.channels = channels
+        self.frame_rate = frame_rate
+        self.realtime = realtime
+        if zones is None:
+            zones = sorted(controller.zone_map)
+        if not zones:
+            raise ValueError("No zones to show the audio bands on")
+        self.zones = zones
+        self.low_colour = low_colour or self.DEFAULT_LOW_COLOUR
+        self.high_colour = high_colour or self.DEFAULT_HIGH_COLOUR
+
+        # Input buffers: one frame of raw bytes, viewed as samples
+        self._samples_per_frame = max(1, sample_rate//frame_rate)
+        self._raw = bytearray(self._samples_per_frame*channels*2)
+        self._raw_view = memoryview(self._raw)
+        self._pcm = self._raw_view.cast("h")
+        self._swap_bytes = sys.byteorder == "big"
+
+        # The most recent fft_size mono samples, as a ring buffer
+        self._fft_size = fft_size
+        self._ring = [0.0]*fft_size
+        self._ring_pos = 0
+
+        # FFT buffers and tables
+        self._re = [0.0]*fft_size
+        self._im = [0.0]*fft_size
+        self._window = [
+            0.5 - 0.5*math.cos(2*math.pi*i/(fft_size - 1))
+            for i in range(fft_size)]
+        bits = fft_size.bit_length() - 1
+        self._swaps = []
+        for i in range(fft_size):
+            j = int(bin(i)[2:].zfill(bits)[::-1], 2) if bits else 0
+            if i < j:
+                self._swaps.append((i, j))
+        self._cos = [math.cos(2*math.pi*k/fft_size) for k in range(fft_size//2)]
+        self._sin = [-math.sin(2*math.pi*k/fft_size) for k in range(fft_size//2)]
+
+        # Band buffers
+        self._bands = self._make_bands(sample_rate)
+        self._energies = [0.0]*len(zones)
+        self._peak = 1e-9
+        self._levels = [0]*len(zones)
+
+        # Output
+        self._cond = threading.Condition()
+        self._pending_levels = None
+        self._stopped = False
+        self._output_thread = None
+        self.frames = 0
+        self.frames_sent = 0
+
+    def _make_bands(self, sample_rate):
+        """ Return the FFT bin ranges (start, end) of the bands, spaced
+        logarithmically between MIN_FREQUENCY and MAX_FREQUENCY."""
+        num_bins = self._fft_size//2
+        bin_width = float(sample_rate)/self._fft_size
+        high = min(self.MAX_FREQUENCY, sample_rate/2.0)
+        ratio = (high/self.MIN_FREQUENCY)**(1.0/len(self.zones))
+        bands = []
+        start = max(1, int(self.MIN_FREQUENCY/bin_width))
+        for i in range(len(self.zones)):
+            end = int(self.MIN_FREQUENCY*ratio**(i + 1)/bin_width)
+            end = min(num_bins, max(end, start + 1))
+            bands.append((start, end))
+            start = min(end, num_bins - 1)
+        return bands
+
+    def _read_frame(self):
+        """ Read one frame into the raw buffer. Return False at the end of
+        the stream."""
+        pos = 0
+        size = len(self._raw)
+        while pos < size:
+            count = self.source.readinto(self._raw_view[pos:])
+            if not count:
+                return False
+            pos += count
+        if self._swap_bytes:
+            self._raw[0::2], self._raw[1::2] = self._raw[1::2], self._raw[0::2]
+        return True
+
+    def _mix_frame(self):
+        """ Mix the frame down to mono and add it to the ring buffer."""
+        pcm = self._pcm
+        ring = self._ring
+        pos = self._ring_pos
+        channels = self.channels
+        size = self._fft_size
+        scale = 1.0/(32768*channels)
+        for i in range(0, len(pcm), channels):
+            total = 0
+            for c in range(channels):
+                total += pcm[i + c]
+            ring[pos] = total*scale
+            pos += 1
+            if pos == size:
+                pos = 0
+        self._ring_pos = pos
+
+    def _fft(self):
+        """ Compute the FFT of the windowed ring buffer, in place in the
+        real and imaginary buffers (iterative radix-2)."""
+        re = self._re
+        im = self._im
+        ring = self._ring
+        window = self._window
+        cos_table = self._cos
+        sin_table = self._sin
+        size = self._fft_size
+        pos = self._ring_pos
+        for i in range(size):
+            re[i] = ring[(pos + i) % size]*window[i]
+            im[i] = 0.0
+        for (i, j) in self._swaps:
+            re[i], re[j] = re[j], re[i]
+        length = 2
+        while length <= size:
+            half = length//2
+            step = size//length
+            for start in range(0, size, length):
+                k = 0
+                for i in range(start, start + half):
+                    j = i + half
+                    wr = cos_table[k]
+                    wi = sin_table[k]
+                    tr = re[j]*wr - im[j]*wi
+                    ti = re[j]*wi + im[j]*wr
+                    re[j] = re[i] - tr
+                    im[j] = im[i] - ti
+                    re[i] += tr
+                    im[i] += ti
+                    k += step
+            length *= 2
+
+    def _update_levels(self):
+        """ Compute the level (0 to MAX_LEVEL) of every band from the FFT.
+        Return True if any level changed."""
+        re = self._re
+        im = self._im
+        energies = self._energies
+        for (band, (start, end)) in enumerate(self._bands):
+            energy = 0.0
+            for i in range(start, end):
+                energy += re[i]*re[i] + im[i]*im[i]
+            energies[band] = energy/(end - start)
+        self._peak = max(self._peak*self.PEAK_DECAY, max(energies))
+        changed = False
+        for (band, energy) in enumerate(energies):
+            level = int(round(self.MAX_LEVEL*math.sqrt(energy/self._peak)))
+            if level != self._levels[band]:
+                self._levels[band] = level
+                changed = True
+        return changed
+
+    def get_colour(self, level):
+        """ Return the colour showing the given band level."""
+        return [
+            int(round(low + (high - low)*float(level)/self.MAX_LEVEL))
+            for (low, high) in zip(self.low_colour, self.high_colour)]
+
+    def process_frame(self):
+        """ Read and process one frame. Return False at the end of the
+        stream."""
+        if not self._read_frame():
+            return False
+        self._mix_frame()
+        self._fft()
+        if self._update_levels() or self.frames == 0:
+            with self._cond:
+                self._pending_levels = tuple(self._levels)
+                self._cond.notify_all()
+        self.frames += 1
+        return True
+
+    def _run_output(self):
+        """ Send the most recent levels to the controller whenever they
+        change. Levels that arrive while the controller is busy replace each
+        other."""
+        try:
+            self.controller.begin_realtime()
+        except Exception as exc:
+            logging.error("Cannot show audio frames: {}".format(exc))
+        while True:
+            with self._cond:
+                while self._pending_levels is None and not self._stopped:
+                    self._cond.wait()
+                levels = self._pending_levels
+                self._pending_levels = None
+                if levels is None:
+                    return
+            try:
+                self.controller.set_realtime_colours(dict(
+                    (zone, self.get_colour(level))
+                    for (zone, level) in zip(self.zones, levels)))
+                self.frames_sent += 1
+            except Exception as exc:
+                logging.error("Cannot show audio frame: {}".format(exc))
+
+    def run(self):
+        """ Process the stream until it ends or stop() is called."""
+        self._stopped = False
+        self._output_thread = threading.Thread(
+            target=self._run_output, name="alienfx-audio-output")
+        self._output_thread.daemon = True
+        self._output_thread.start()
+        frame_time = 1.0/self.frame_rate
+        deadline = time.monotonic()
+        try:
+            while not self._stopped and self.process_frame():
+                if self.realtime:
+                    deadline += frame_time
+                    delay = deadline - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+        finally:
+            self.stop()
+
+    def stop(self):
+        """ Stop processing. Levels already computed are still sent."""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if (self._output_thread is not None and
+                self._output_thread is not threading.current_thread()):
+            self._output_thread.join()
+            self._output_thread = None
@@ -0,0 +1,182 @@
+#
+# bulkcompile.py
+#
+# Copyright (C) 2013-2014 Ashwin Menon <ashwin.menon@gmail.com>
+# Copyright (C) 2015-2024 Track Master Steve <trackmastersteve@gmail.com>
+#
+# Alienfx is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# Alienfx is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with alienfx.    If not, write to:
+# 	The Free Software Foundation, Inc.,
+# 	51 Franklin Street, Fifth Floor
+# 	Boston, MA  02110-1301, USA.
+#
+
+""" Bulk compilation of themes for many controller models.
+
+Compiles every theme of a directory for each of a number of controller
+models, and writes the packets as compiled theme blobs (see
+AlienFXCompiledTheme.to_bytes) to an output directory:
+
+    OUTPUT_DIR/<model name>/<theme name>.afxc
+    OUTPUT_DIR/manifest.json
+
+Compiling is CPU bound pure Python, so the themes are spread over a pool of
+worker processes. Controllers are passed to the workers by their index in
+AlienFXController.supported_controllers, and every worker compiles one theme
+for all models, so that each theme is parsed only once. The theme files are
+listed directly, without the theme index, so nothing is parsed in the parent
+process and nothing is written to the theme directory. The manifest lists
+every output with its size, packet count and compile time, and every theme
+that could not be compiled.
+
+This module provides the following functions:
+compile_themes: compile a directory of themes for a set of controllers
+"""
+
+import json
+import logging
+import multiprocessing
+import os
+import os.path
+import time
+
+from alienfx.common import write_file_atomic
+import alienfx.core.prober
+from alienfx.core.controller import AlienFXController
+from alienfx.core.themefile import AlienFXThemeFile
+
+COMPILED_THEME_EXT = ".afxc"
+MANIFEST_FILE = "manifest.json"
+
+
+def _list_theme_files(theme_dir):
+    """ Return a sorted list of (theme name, file name) tuples of the theme
+    files in the given directory. Hidden files are skipped, and JSON files
+    take precedence over binary files of the same name, as when loading
+    themes."""
+    files = {}
+    for theme_format in [
+            AlienFXThemeFile.FORMAT_BINARY, AlienFXThemeFile.FORMAT_JSON]:
+        ext = AlienFXThemeFile.THEME_FILE_EXTS[theme_format]
+        for filename in os.listdir(theme_dir):
+            if not filename.startswith(".") and filename.endswith(ext):
+                files[filename[:-len(ext)]] = filename
+    return sorted(files.items())
+
+
+def _compile_theme(job):
+    """ Compile one theme for the controllers with the given indexes and
+    write the blobs. This runs in a worker process. Return a list of
+    manifest entries."""
+    (theme_dir, theme_name, filename, controller_indexes, output_dir) = job
+    controllers = [
+        AlienFXController.supported_controllers[index]
+        for index in controller_indexes]
+    themefile = AlienFXThemeFile(controllers[0], theme_dir)
+    try:
+        # Load the file itself rather than by name, which would go through
+        # the theme index of the directory.
+        themefile._load_from_file(os.path.join(theme_dir, filename))
+        themefile._resolve_base()
+        loaded = (themefile.theme_name == theme_name and
+            not themefile.validate())
+    except Exception as exc:
+        logging.error(exc)
+        loaded = False
+    theme = themefile.theme
+    entries = []
+    for controller in controllers:
+        entry = {"theme": theme_name, "model": controller.name}
+        entries.append(entry)
+        if not loaded:
+            entry["error"] = "cannot load theme"
+            continue
+        start_time = time.perf_counter()
+        try:
+            themefile.controller = controller
+            themefile.theme = theme
+            compiled = controller.compiler.compile(themefile)
+            data = compiled.to_bytes()
+            path = os.path.join(
+                output_dir, controller.name, theme_name + COMPILED_THEME_EXT)
+            write_file_atomic(path, data)
+            entry["file"] = os.path.relpath(path, output_dir)
+            entry["bytes"] = len(data)
+            entry["packets"] = len(compiled.get_cmds())
+        except Exception as exc:
+            entry["error"] = str(exc)
+        finally:
+            entry["seconds"] = round(time.perf_counter() - start_time, 6)
+    return entries
+
+
+def compile_themes(theme_dir, output_dir, controllers=None, processes=None):
+    """ Compile every theme in theme_dir (the themes directory of
+    AlienFXThemeFile if None) for each of the given controllers (all
+    supported controllers if None) into output_dir, using a pool of
+    'processes' worker processes (one per CPU if None). Write the manifest
+    and return it as a dict."""
+    if controllers is None:
+        controllers = AlienFXController.supported_controllers
+    controller_indexes = [
+        AlienFXController.supported_controllers.index(c) for c in controllers]
+    theme_dir = AlienFXThemeFile(controllers[0], theme_dir)._theme_dir
+    theme_files = _list_theme_files(theme_dir)
+    theme_names = [theme_name for (theme_name, filename) in theme_files]
+    for controller in controllers:
+        path = os.path.join(output_dir, controller.name)
+        if not os.path.exists(path):
+            os.makedirs(path)
+    jobs = [
+        (theme_dir, theme_name, filename, controller_indexes, output_dir)
+        for (theme_name, filename) in theme_files]
+
+    start_time = time.perf_counter()
+    if processes is None:
+        processes = os.cpu_count() or 1
+    processes = max(1, min(processes, len(jobs)))
+    if processes == 1:
+        results = [_compile_theme(job) for job in jobs]
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(_compile_theme, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    elapsed = time.perf_counter() - start_time
+
+    outputs = []
+    errors = []
+    for entries in results:
+        for entry in entries:
+            if "error" in entry:
+                logging.error("Cannot compile theme {} for {}: {}".format(
+                    entry["theme"], entry["model"], entry["error"]))
+                errors.append(entry)
+            else:
+                outputs.append(entry)
+    manifest = {
+        "models": [c.name for c in controllers],
+        "themes": theme_names,
+        "processes": processes,
+        "seconds": round(elapsed, 6),
+        "outputs": outputs,
+        "errors": errors
+    }
+    write_file_atomic(
+        os.path.join(output_dir, MANIFEST_FILE),
+        json.dumps(manifest, indent=4, separators=(',', ': ')).encode("utf-8"))
+    return manifest
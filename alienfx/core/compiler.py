@@ -0,0 +1,469 @@
+#
+# compiler.py
+#
+# Copyright (C) 2013-2014 Ashwin Menon <ashwin.menon@gmail.com>
+# Copyright (C) 2015-2024 Track Master Steve <trackmastersteve@gmail.com>
+#
+# Alienfx is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# Alienfx is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with alienfx.    If not, write to:
+# 	The Free Software Foundation, Inc.,
+# 	51 Franklin Street, Fifth Floor
+# 	Boston, MA  02110-1301, USA.
+#
+
+""" Theme compiler for AlienFX controllers.
+
+A theme is compiled in three steps. It is first translated into an
+intermediate representation (IR) made of states, which contain loop blocks,
+which contain actions; every block carries the zone mask it applies to. A
+list of optimisation passes is then run over the IR, and the result is
+lowered to command packets. A second list of passes, empty by default, is
+finally run over the packets of each state.
+
+Passes are plain callables and can be added to or removed from the
+ir_passes and packet_passes lists of a compiler instance:
+    IR pass:     pass(ir_theme, controller) -> None, modifies ir_theme
+    Packet pass: pass(cmds, cmd_packet) -> new list of commands
+
+This module provides the following classes:
+AlienFXIRAction: a single loop action
+AlienFXIRBlock: a loop block of actions applied to a zone mask
+AlienFXIRState: the loop blocks of a power state
+AlienFXIRTheme: the complete IR of a theme
+AlienFXCompiledTheme: the command packets of a compiled theme
+AlienFXThemeCompiler: translates, optimises and lowers themes
+"""
+
+from builtins import object
+import logging
+import struct
+
+import alienfx.core.themefile as alienfx_themefile
+
+_U8 = struct.Struct(">B")
+_U16 = struct.Struct(">H")
+_U32 = struct.Struct(">I")
+
+
+class AlienFXIRAction(object):
+
+    """ A single loop action: an action type and its colours. Colours are
+    stored as tuples so that actions can be compared and hashed.
+    """
+
+    def __init__(self, action_type, colours):
+        self.action_type = action_type
+        self.colours = tuple(tuple(colour) for colour in colours)
+
+    def _key(self):
+        return (self.action_type, self.colours)
+
+    def __eq__(self, other):
+        return isinstance(other, AlienFXIRAction) and self._key() == other._key()
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self._key())
+
+
+class AlienFXIRBlock(object):
+
+    """ A loop block: a sequence of actions applied to the zones in a zone
+    mask.
+    """
+
+    def __init__(self, zones, actions):
+        self.zones = zones
+        self.actions = actions
+
+    def get_actions_key(self):
+        """ Return a hashable key for the action sequence of this block."""
+        return tuple(self.actions)
+
+    def _key(self):
+        return (self.zones, self.get_actions_key())
+
+    def __eq__(self, other):
+        return isinstance(other, AlienFXIRBlock) and self._key() == other._key()
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self._key())
+
+
+class AlienFXIRState(object):
+
+    """ The loop blocks of a single power state.
+
+    If 'save' is True, then every command of the state is preceded by a
+    SAVE_NEXT command and the state ends with a SAVE command. If
+    'blank_hidden_zones' is True, then the state ends with a block setting
+    all zones not in the controller's zone map to black. These two flags
+    express the special handling of the boot state.
+
+    If 'folded_into' is set to another state, then this state has the same
+    blocks as that state and is lowered from the commands already generated
+    for it.
+    """
+
+    def __init__(self, name, code, blocks, save=True, blank_hidden_zones=False):
+        self.name = name
+        self.code = code
+        self.blocks = blocks
+        self.save = save
+        self.blank_hidden_zones = blank_hidden_zones
+        self.folded_into = None
+
+    def count_packets(self):
+        """ Return the number of packets this state will be lowered to."""
+        count = 0
+        for block in self.blocks:
+            if not block.actions:
+                continue
+            if self.save:
+                count += 2*len(block.actions) + 2
+            else:
+                count += len(block.actions) + 1
+        if count and self.save:
+            count += 1
+        if self.blank_hidden_zones:
+            count += 2
+        return count
+
+
+class AlienFXIRTheme(object):
+
+    """ The IR of a complete theme: the states in the order they are sent,
+    the boot state replayed after the speed command, and the speed.
+    """
+
+    def __init__(self, states, boot_state, speed):
+        self.states = states
+        self.boot_state = boot_state
+        self.speed = speed
+
+    def get_all_states(self):
+        """ Return all states, including the replayed boot state."""
+        states = list(self.states)
+        if self.boot_state is not None:
+            states.append(self.boot_state)
+        return states
+
+
+class AlienFXCompiledTheme(object):
+
+    """ The command packets of a compiled theme, ready to be sent to the
+    controller after it has been reset.
+
+    state_cmds is a list of (state name, commands) tuples, speed_cmd is the
+    "set speed" command and boot_cmds are the boot commands sent again
+    without SAVE_NEXT commands before the final "transmit execute".
+    """
+
+    def __init__(self, state_cmds, speed_cmd, boot_cmds, execute_cmd):
+        self.state_cmds = state_cmds
+        self.speed_cmd = speed_cmd
+        self.boot_cmds = boot_cmds
+        self.execute_cmd = execute_cmd
+
+    def get_cmds(self):
+        """ Return all commands of the theme, in the order they are sent."""
+        cmds = []
+        for (state_name, state_cmds) in self.state_cmds:
+            cmds.extend(state_cmds)
+        cmds.append(self.speed_cmd)
+        cmds.extend(self.boot_cmds)
+        cmds.append(self.execute_cmd)
+        return cmds
+
+    @staticmethod
+    def _pack_cmds(cmds, chunks):
+        chunks.append(_U32.pack(len(cmds)))
+        for cmd in cmds:
+            chunks.append(_U8.pack(len(cmd)))
+            chunks.append(bytes(bytearray(cmd)))
+
+    @staticmethod
+    def _unpack_cmds(data, pos):
+        (count,) = _U32.unpack_from(data, pos)
+        pos += _U32.size
+        cmds = []
+        for i in range(count):
+            (length,) = _U8.unpack_from(data, pos)
+            pos += _U8.size
+            cmds.append(bytes(data[pos:pos + length]))
+            pos += length
+        return (cmds, pos)
+
+    def to_bytes(self):
+        """ Serialise the compiled theme and return the resulting bytes.
+        All integers are big-endian; a list of commands is a count (u32)
+        followed by each command as a length (u8) and its bytes:
+            state count (u16), then for each state:
+                name length (u16), utf-8 name, commands
+            speed command, boot commands, execute command (as lists of one)
+        """
+        chunks = [_U16.pack(len(self.state_cmds))]
+        for (state_name, cmds) in self.state_cmds:
+            encoded = state_name.encode("utf-8")
+            chunks.append(_U16.pack(len(encoded)))
+            chunks.append(encoded)
+            self._pack_cmds(cmds, chunks)
+        self._pack_cmds([self.speed_cmd], chunks)
+        self._pack_cmds(self.boot_cmds, chunks)
+        self._pack_cmds([self.execute_cmd], chunks)
+        return b"".join(chunks)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """ Return the compiled theme serialised in data (bytes or a
+        memoryview) by to_bytes. Commands are returned as bytes."""
+        try:
+            (num_states,) = _U16.unpack_from(data, 0)
+            pos = _U16.size
+            state_cmds = []
+            for i in range(num_states):
+                (length,) = _U16.unpack_from(data, pos)
+                pos += _U16.size
+                state_name = bytes(data[pos:pos + length]).decode("utf-8")
+                pos += length
+                (cmds, pos) = cls._unpack_cmds(data, pos)
+                state_cmds.append((state_name, cmds))
+            (speed_cmds, pos) = cls._unpack_cmds(data, pos)
+            (boot_cmds, pos) = cls._unpack_cmds(data, pos)
+            (execute_cmds, pos) = cls._unpack_cmds(data, pos)
+            return cls(state_cmds, speed_cmds[0], boot_cmds, execute_cmds[0])
+        except (struct.error, IndexError) as exc:
+            raise ValueError("Corrupt compiled theme: {}".format(exc))
+
+
+def eliminate_dead_zones(ir_theme, controller):
+    """ IR pass: remove from every block the zones that the controller does
+    not have, then drop blocks that are left with no zones or no actions.
+    """
+    visible_zones = controller._get_zone_codes(controller.zone_map)
+    for state in ir_theme.get_all_states():
+        blocks = []
+        for block in state.blocks:
+            block.zones &= visible_zones
+            if block.zones and block.actions:
+                blocks.append(block)
+        state.blocks = blocks
+
+
+def coalesce_zones(ir_theme, controller):
+    """ IR pass: merge the blocks of a state that have identical action
+    sequences into a single block with an OR-ed zone mask. Blocks keep the
+    order in which each action sequence first appears.
+    """
+    for state in ir_theme.get_all_states():
+        blocks = []
+        block_index = {}
+        for block in state.blocks:
+            key = block.get_actions_key()
+            if key in block_index:
+                merged = blocks[block_index[key]]
+                merged.zones |= block.zones
+            else:
+                block_index[key] = len(blocks)
+                blocks.append(AlienFXIRBlock(block.zones, block.actions))
+        state.blocks = blocks
+
+
+def fold_duplicate_states(ir_theme, controller):
+    """ IR pass: mark saved states whose blocks are identical to those of an
+    earlier saved state, so that they are lowered from the commands of that
+    state instead of being generated again.
+    """
+    seen = {}
+    for state in ir_theme.states:
+        if not state.save or not state.blocks:
+            continue
+        key = tuple(state.blocks)
+        if key in seen:
+            state.folded_into = seen[key]
+        else:
+            seen[key] = state
+
+
+class AlienFXThemeCompiler(object):
+
+    """ Compiles themes into command packets for a given controller."""
+
+    def __init__(self, controller):
+        self.controller = controller
+        self.ir_passes = [
+            eliminate_dead_zones,
+            coalesce_zones,
+            fold_duplicate_states
+        ]
+        self.packet_passes = []
+
+    def _build_action(self, themefile, item):
+        """ Given a loop item from the theme file, return an IR action, or
+        None if the item is not a valid action.
+        """
+        item_type = themefile.get_action_type(item)
+        item_colours = themefile.get_action_colours(item)
+        if item_type in [
+                themefile.KW_ACTION_TYPE_FIXED,
+                themefile.KW_ACTION_TYPE_BLINK]:
+            if len(item_colours) != 1:
+                logging.warning(
+                    "{} must have exactly one colour value".format(item_type))
+                return None
+        elif item_type == themefile.KW_ACTION_TYPE_MORPH:
+            if len(item_colours) != 2:
+                logging.warning("morph must have exactly two colour values")
+                return None
+        else:
+            logging.warning("unknown loop item type: {}".format(item_type))
+            return None
+        return AlienFXIRAction(item_type, item_colours)
+
+    def build_state(self, themefile, state_name, boot=False):
+        """ Translate a state of the given theme file into an IR state. If
+        'boot' is True, then the state is built the way the boot state is
+        replayed at the end of a theme.
+        """
+        blocks = []
+        for item in themefile.get_state_items(state_name):
+            zones = self.controller._get_zone_codes(
+                themefile.get_zone_names(item))
+            actions = []
+            for loop_item in themefile.get_loop_items(item):
+                action = self._build_action(themefile, loop_item)
+                if action is not None:
+                    actions.append(action)
+            blocks.append(AlienFXIRBlock(zones, actions))
+        return AlienFXIRState(
+            state_name, self.controller.state_map[state_name], blocks,
+            save=not boot, blank_hidden_zones=boot)
+
+    def build(self, themefile):
+        """ Translate the given theme file into an IR theme."""
+        states = []
+        boot_state = None
+        for state_name in self.controller.state_map:
+            states.append(self.build_state(themefile, state_name))
+            if state_name == self.controller.STATE_BOOT:
+                boot_state = self.build_state(themefile, state_name, boot=True)
+        return AlienFXIRTheme(states, boot_state, themefile.get_speed())
+
+    def optimise(self, ir_theme):
+        """ Run the IR passes over the given IR theme."""
+        for ir_pass in self.ir_passes:
+            ir_pass(ir_theme, self.controller)
+
+    def _lower_action(self, block, zones, action):
+        """ Return the command packet for a single IR action."""
+        pkt = self.controller.cmd_packet
+        colours = action.colours
+        themefile_class = alienfx_themefile.AlienFXThemeFile
+        if action.action_type == themefile_class.KW_ACTION_TYPE_FIXED:
+            return pkt.make_cmd_set_colour(block, zones, colours[0])
+        elif action.action_type == themefile_class.KW_ACTION_TYPE_BLINK:
+            return pkt.make_cmd_set_blink_colour(block, zones, colours[0])
+        else:
+            return pkt.make_cmd_set_morph_colour(
+                block, zones, colours[0], colours[1])
+
+    def lower_state(self, ir_state, lowered=None):
+        """ Lower an IR state to a list of command packets. 'lowered' maps
+        states that were already lowered to their commands; it is used to
+        lower folded states.
+        """
+        pkt = self.controller.cmd_packet
+        if lowered is not None and ir_state.folded_into in lowered:
+            cmds = []
+            for cmd in lowered[ir_state.folded_into]:
+                if cmd[1] == pkt.CMD_SAVE_NEXT:
+                    cmd = pkt.make_cmd_save_next(ir_state.code)
+                cmds.append(cmd)
+            return cmds
+        cmds = []
+        block = 1
+        for ir_block in ir_state.blocks:
+            if not ir_block.actions:
+                continue
+            for action in ir_block.actions:
+                if ir_state.save:
+                    cmds.append(pkt.make_cmd_save_next(ir_state.code))
+                cmds.append(self._lower_action(block, ir_block.zones, action))
+            if ir_state.save:
+                cmds.append(pkt.make_cmd_save_next(ir_state.code))
+            cmds.append(pkt.make_cmd_loop_block_end())
+            block += 1
+        if cmds and ir_state.save:
+            cmds.append(pkt.make_cmd_save())
+        if ir_state.blank_hidden_zones:
+            cmds.append(
+                pkt.make_cmd_set_colour(
+                    block, self.controller._get_no_zone_code(), (0,0,0)))
+            cmds.append(pkt.make_cmd_loop_block_end())
+        for packet_pass in self.packet_passes:
+            cmds = packet_pass(cmds, pkt)
+        if lowered is not None:
+            lowered[ir_state] = cmds
+        return cmds
+
+    def lower(self, ir_theme):
+        """ Lower an IR theme to an AlienFXCompiledTheme instance."""
+        pkt = self.controller.cmd_packet
+        lowered = {}
+        state_cmds = []
+        for ir_state in ir_theme.states:
+            state_cmds.append(
+                (ir_state.name, self.lower_state(ir_state, lowered)))
+        boot_cmds = []
+        if ir_theme.boot_state is not None:
+            boot_cmds = self.lower_state(ir_theme.boot_state)
+        return AlienFXCompiledTheme(
+            state_cmds, pkt.make_cmd_set_speed(ir_theme.speed), boot_cmds,
+            pkt.make_cmd_transmit_execute())
+
+    def _log_packet_counts(self, ir_states, counts_before):
+        for (ir_state, count_before) in zip(ir_states, counts_before):
+            logging.debug("{}{}: {} packets, {} before optimisation".format(
+                ir_state.name, "" if ir_state.save else " (boot replay)",
+                ir_state.count_packets(), count_before))
+
+    def compile(self, themefile):
+        """ Compile the given theme file and return an AlienFXCompiledTheme
+        instance.
+        """
+        ir_theme = self.build(themefile)
+        counts_before = [s.count_packets() for s in ir_theme.get_all_states()]
+        self.optimise(ir_theme)
+        self._log_packet_counts(ir_theme.get_all_states(), counts_before)
+        return self.lower(ir_theme)
+
+    def compile_state(self, themefile, state_name, boot=False):
+        """ Compile a single state of the given theme file and return its
+        list of command packets.
+        """
+        ir_state = self.build_state(themefile, state_name, boot)
+        count_before = ir_state.count_packets()
+        if boot:
+            ir_theme = AlienFXIRTheme([], ir_state, themefile.get_speed())
+        else:
+            ir_theme = AlienFXIRTheme([ir_state], None, themefile.get_speed())
+        self.optimise(ir_theme)
+        self._log_packet_counts([ir_state], [count_before])
+        return self.lower_state(ir_state)
@@ -33,10 +33,13 @@ AlienFXController: base class for AlienFX controller chips
 from builtins import hex
 from builtins import object
 import logging
+import threading
 
 import alienfx.core.usbdriver as alienfx_usbdriver
 import alienfx.core.cmdpacket as alienfx_cmdpacket
-from alienfx.core.themefile import AlienFXThemeFile
+from alienfx.core.compiler import AlienFXCompiledTheme
+from alienfx.core.compiler import AlienFXThemeCompiler
+from alienfx.core.estimator import AlienFXThemeEstimate
 from functools import reduce
 
 class AlienFXController(object):
@@ -79,6 +82,13 @@ class AlienFXController(object):
     STATE_BATTERY_CRITICAL = "Battery Critical"
 
     ALIENFX_CONTROLLER_TYPE = "old"  # Default controllertype=old. Note that modern controllers are using 8 bits per color. older ones just 4
+
+    # Timing profile, used to estimate how long it takes to send a theme to
+    # the controller. All values are in seconds. These are conservative
+    # defaults; controllers that are known to be faster or slower may
+    # override them.
+    TIMING_PACKET_WRITE = 0.004  # one control transfer of PACKET_LENGTH bytes
+    TIMING_RESET = 0.1  # ping, reset and wait until the controller is ready
     
     def __init__(self, conrev=1):  # conrev defaulting to 1 to maintain compatibility with old definitions
         # conrev=1  -> old controllers (DEFAULT)
@@ -93,6 +103,13 @@ class AlienFXController(object):
         self.cmd_packet = alienfx_cmdpacket.AlienFXCmdPacket(conrev)  # Loads the cmdpacket.
 
         self._driver = alienfx_usbdriver.AlienFXUSBDriver(self)
+        # Serialises access to the controller, so that themes and realtime
+        # colours sent from different threads do not interleave.
+        self._lock = threading.RLock()
+        # True while the controller is reset for realtime colours, i.e. no
+        # theme has been sent since the last reset.
+        self._realtime_ready = False
+        self.compiler = AlienFXThemeCompiler(self)
 
 
 
@@ -192,38 +209,6 @@ class AlienFXController(object):
         logging.warning("Unknown reset type: {}".format(reset_name))
         return 0
         
-    def _make_loop_cmds(self, themefile, zones, block, loop_items):
-        """ Given loop-items from the theme file, return a list of loop
-        commands.
-        """
-        loop_cmds = []
-        pkt = self.cmd_packet
-        for item in loop_items:
-            item_type = themefile.get_action_type(item)
-            item_colours = themefile.get_action_colours(item)
-            if item_type == AlienFXThemeFile.KW_ACTION_TYPE_FIXED:
-                if len(item_colours) != 1:
-                    logging.warning("fixed must have exactly one colour value")
-                    continue
-                loop_cmds.append(
-                    pkt.make_cmd_set_colour(block, zones, item_colours[0]))
-            elif item_type == AlienFXThemeFile.KW_ACTION_TYPE_BLINK:
-                if len(item_colours) != 1:
-                    logging.warning("blink must have exactly one colour value")
-                    continue
-                loop_cmds.append(
-                    pkt.make_cmd_set_blink_colour(block, zones, item_colours[0]))
-            elif item_type == AlienFXThemeFile.KW_ACTION_TYPE_MORPH:
-                if len(item_colours) != 2:
-                    logging.warning("morph must have exactly two colour values")
-                    continue
-                loop_cmds.append(
-                    pkt.make_cmd_set_morph_colour(
-                        block, zones, item_colours[0], item_colours[1]))
-            else:
-                logging.warning("unknown loop item type: {}".format(item_type))
-        return loop_cmds
-        
     def _make_zone_cmds(self, themefile, state_name, boot=False):
         """ Given a theme file, return a list of zone commands.
         
@@ -231,34 +216,7 @@ class AlienFXController(object):
         SAVE_NEXT commands. Also, the final command is one to set the colour
         of all non-visible zones to black.
         """
-        zone_cmds = []
-        block = 1
-        pkt = self.cmd_packet
-        state = self.state_map[state_name]
-        state_items = themefile.get_state_items(state_name)
-        for item in state_items:
-            zone_codes = self._get_zone_codes(themefile.get_zone_names(item))
-            loop_items = themefile.get_loop_items(item)
-            loop_cmds = self._make_loop_cmds(
-                themefile, zone_codes, block, loop_items)
-            if (loop_cmds):
-                block += 1
-                for loop_cmd in loop_cmds:
-                    if not boot:
-                        zone_cmds.append(pkt.make_cmd_save_next(state))
-                    zone_cmds.append(loop_cmd)
-                if not boot:
-                    zone_cmds.append(pkt.make_cmd_save_next(state))
-                zone_cmds.append(pkt.make_cmd_loop_block_end())
-        if zone_cmds:
-            if not boot:
-                zone_cmds.append(pkt.make_cmd_save())
-        if boot:
-            zone_cmds.append(
-                pkt.make_cmd_set_colour(
-                    block, self._get_no_zone_code(), (0,0,0)))
-            zone_cmds.append(pkt.make_cmd_loop_block_end())
-        return zone_cmds
+        return self.compiler.compile_state(themefile, state_name, boot)
         
     def _send_cmds(self, cmds):
         """ Send the given commands to the controller. """
@@ -266,35 +224,157 @@ class AlienFXController(object):
             logging.debug("SENDING: {}".format(self.pkt_to_string(cmd)))
             self._driver.write_packet(cmd)
 
-    def set_theme(self, themefile):
-        """ Send the given theme settings to the controller. This should result
-        in the lights changing to the theme settings immediately.
+    def set_compiled_theme(self, compiled_theme, progress_cb=None, cancel=None):
+        """ Send the given compiled theme (an AlienFXCompiledTheme instance)
+        to the controller. If 'progress_cb' is given, then it is called as
+        progress_cb(state_name, done, total) after each state is sent, and
+        with a state name of None once the theme is executed. If 'cancel' (a
+        threading.Event) is set while the theme is being sent, then sending
+        stops before the next state; states already sent stay saved on the
+        controller. Return True if the whole theme was sent, False if it was
+        cancelled.
         """
-        try:
-            self._driver.acquire()
-            cmds_boot = []
-            pkt = self.cmd_packet
+        total = len(compiled_theme.state_cmds) + 1
+        with self._lock:
+            try:
+                self._driver.acquire()
             
-            # prepare the controller
-            self._ping()
-            self._reset("all-lights-on")
-            self._wait_controller_ready()
+                # prepare the controller
+                self._ping()
+                self._reset("all-lights-on")
+                self._wait_controller_ready()
+                self._realtime_ready = False
             
-            for state_name in self.state_map:
-                cmds = []
-                cmds = self._make_zone_cmds(themefile, state_name)
-                # Boot block commands are saved for sending again later.
-                # The second time, they are sent without SAVE_NEXT commands.
-                if (state_name == self.STATE_BOOT):
-                    cmds_boot = self._make_zone_cmds(
-                        themefile, state_name, boot=True)
+                for (done, (state_name, cmds)) in enumerate(
+                        compiled_theme.state_cmds, 1):
+                    if cancel is not None and cancel.is_set():
+                        return False
+                    self._send_cmds(cmds)
+                    if progress_cb is not None:
+                        progress_cb(state_name, done, total)
+                if cancel is not None and cancel.is_set():
+                    return False
+                self._send_cmds([compiled_theme.speed_cmd])
+                # send the boot block commands again
+                self._send_cmds(compiled_theme.boot_cmds)
+                self._send_cmds([compiled_theme.execute_cmd])
+                if progress_cb is not None:
+                    progress_cb(None, total, total)
+                return True
+            finally:
+                self._driver.release()
+
+    def set_theme_streaming(self, themefile, theme_name, progress_cb=None,
+            cancel=None):
+        """ Load the named theme into the given theme file and send it to the
+        controller. Each state is validated and compiled as soon as it has
+        been parsed, while later states are still being read from disk; the
+        compiled theme is then sent with set_compiled_theme(), so that the
+        packets are the same as those of set_theme(). If any state is
+        invalid, then False is returned without talking to the controller.
+        'progress_cb' and 'cancel' are as for set_compiled_theme(). Return
+        True on success, False otherwise.
+        """
+        compiled = {}
+        for key in themefile.iter_load(theme_name):
+            errors = themefile.validate_entry(key)
+            if errors:
+                self._log_rejected_theme(themefile, errors)
+                return False
+            if key in self.state_map:
+                compiled[key] = self._make_zone_cmds(themefile, key)
+        if themefile.theme_name != theme_name:
+            return False
+        # States missing from the file are compiled like set_theme() does,
+        # and all states are sent in the order of the state map.
+        state_cmds = []
+        for state_name in self.state_map:
+            if state_name not in compiled:
+                compiled[state_name] = self._make_zone_cmds(
+                    themefile, state_name)
+            state_cmds.append((state_name, compiled[state_name]))
+        boot_cmds = []
+        if self.STATE_BOOT in self.state_map:
+            boot_cmds = self._make_zone_cmds(
+                themefile, self.STATE_BOOT, boot=True)
+        pkt = self.cmd_packet
+        compiled_theme = AlienFXCompiledTheme(
+            state_cmds, pkt.make_cmd_set_speed(themefile.get_speed()),
+            boot_cmds, pkt.make_cmd_transmit_execute())
+        return self.set_compiled_theme(compiled_theme, progress_cb, cancel)
+
+    def begin_realtime(self):
+        """ Reset the controller for realtime colours. Later calls to
+        set_realtime_colours() send only their colour packets, until a theme
+        is sent. Effects call this once when they start.
+        """
+        with self._lock:
+            try:
+                self._driver.acquire()
+                self._reset("all-lights-on")
+                self._wait_controller_ready()
+                self._realtime_ready = True
+            finally:
+                self._driver.release()
+
+    def set_realtime_colours(self, zone_colours):
+        """ Set the given zones to fixed colours immediately, without saving
+        anything to the controller's power states. 'zone_colours' maps zone
+        names to colours ([r, g, b], 0-15 each); zones with the same colour
+        share one command packet. The colours are shown until the next theme
+        is applied or the controller switches power state. The controller is
+        reset first only if begin_realtime() has not been called since the
+        last theme was sent.
+        """
+        zones_by_colour = {}
+        for zone in zone_colours:
+            colour = tuple(zone_colours[zone])
+            zones_by_colour[colour] = (
+                zones_by_colour.get(colour, 0) | self._get_zone_codes([zone]))
+        pkt = self.cmd_packet
+        cmds = [
+            pkt.make_cmd_set_colour(1, zones, list(colour))
+            for (colour, zones) in sorted(zones_by_colour.items()) if zones]
+        if not cmds:
+            return
+        cmds.append(pkt.make_cmd_loop_block_end())
+        cmds.append(pkt.make_cmd_transmit_execute())
+        with self._lock:
+            try:
+                self._driver.acquire()
+                if not self._realtime_ready:
+                    self._reset("all-lights-on")
+                    self._wait_controller_ready()
+                    self._realtime_ready = True
                 self._send_cmds(cmds)
-            cmd = pkt.make_cmd_set_speed(themefile.get_speed())
-            self._send_cmds([cmd])
-            # send the boot block commands again
-            self._send_cmds(cmds_boot)
-            cmd = pkt.make_cmd_transmit_execute()
-            self._send_cmds([cmd])
-        finally:
-            self._driver.release()
+            finally:
+                self._driver.release()
 
+    def estimate_theme(self, themefile):
+        """ Compile the given theme without sending it and return an
+        AlienFXThemeEstimate instance describing the cost of applying it.
+        """
+        return AlienFXThemeEstimate(self, self.compiler.compile(themefile))
+
+    def _log_rejected_theme(self, themefile, errors):
+        """ Log why a theme is not sent; the errors themselves were logged
+        when the theme was validated."""
+        logging.error("Not applying theme {}: {} error{} found".format(
+            themefile.theme_name or "(unnamed)", len(errors),
+            "" if len(errors) == 1 else "s"))
+
+    def set_theme(self, themefile, progress_cb=None, cancel=None):
+        """ Send the given theme settings to the controller. This should result
+        in the lights changing to the theme settings immediately. Themes
+        written for older versions of alienfx are migrated first; invalid
+        themes are rejected, with their errors logged, before anything is
+        sent. 'progress_cb' and 'cancel' are as for set_compiled_theme().
+        Return True on success, False otherwise.
+        """
+        themefile.migrate()
+        errors = themefile.validate()
+        if errors:
+            self._log_rejected_theme(themefile, errors)
+            return False
+        return self.set_compiled_theme(
+            self.compiler.compile(themefile), progress_cb, cancel)
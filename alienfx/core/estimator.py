@@ -0,0 +1,68 @@
+#
+# estimator.py
+#
+# Copyright (C) 2013-2014 Ashwin Menon <ashwin.menon@gmail.com>
+# Copyright (C) 2015-2024 Track Master Steve <trackmastersteve@gmail.com>
+#
+# Alienfx is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# Alienfx is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with alienfx.    If not, write to:
+# 	The Free Software Foundation, Inc.,
+# 	51 Franklin Street, Fifth Floor
+# 	Boston, MA  02110-1301, USA.
+#
+
+""" Estimates the cost of applying a theme, without touching USB.
+
+This module provides the following classes:
+AlienFXThemeEstimate: packet counts, bytes and wire time of a compiled theme
+"""
+
+from builtins import object
+
+
+class AlienFXThemeEstimate(object):
+
+    """ Packet counts, total bytes and estimated wire time of a compiled
+    theme (an AlienFXCompiledTheme instance) on the given controller. The
+    wire time is computed from the controller's timing profile.
+    """
+
+    def __init__(self, controller, compiled_theme):
+        self.controller_name = getattr(controller, "name", "")
+        self.state_packets = [
+            (state_name, len(cmds))
+            for (state_name, cmds) in compiled_theme.state_cmds]
+        self.boot_packets = len(compiled_theme.boot_cmds)
+        # Packets sent to prepare the controller are not part of the compiled
+        # theme: a ping and a reset. Polling the status until the controller
+        # is ready is accounted for by TIMING_RESET.
+        self.prepare_packets = 2
+        self.total_packets = len(compiled_theme.get_cmds()) + self.prepare_packets
+        self.total_bytes = (
+            self.total_packets * controller.cmd_packet.PACKET_LENGTH)
+        self.wire_time = (
+            controller.TIMING_RESET +
+            self.total_packets * controller.TIMING_PACKET_WRITE)
+
+    def to_string(self):
+        """ Return a human readable report of the estimate."""
+        lines = []
+        for (state_name, count) in self.state_packets:
+            lines.append("{}: {} packets".format(state_name, count))
+        lines.append("Boot (replayed): {} packets".format(self.boot_packets))
+        lines.append("Total: {} packets, {} bytes".format(
+            self.total_packets, self.total_bytes))
+        lines.append("Estimated wire time: {:.3f} s".format(self.wire_time))
+        return "\n".join(lines)
@@ -0,0 +1,192 @@
+#
+# metriceffect.py
+#
+# Copyright (C) 2013-2014 Ashwin Menon <ashwin.menon@gmail.com>
+# Copyright (C) 2015-2024 Track Master Steve <trackmastersteve@gmail.com>
+#
+# Alienfx is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# Alienfx is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with alienfx.    If not, write to:
+# 	The Free Software Foundation, Inc.,
+# 	51 Franklin Street, Fifth Floor
+# 	Boston, MA  02110-1301, USA.
+#
+
+""" System metric lighting effect.
+
+Samples a system metric (CPU utilisation, temperature or load average) at a
+fixed rate and shows it as a colour between a "low" and a "high" colour on
+some or all zones. Colours have 16 levels per component, so most samples map
+to the colour already shown; the controller is only updated when the colour
+changes. Between samples the effect sleeps, and a sample is a single read of
+a small /proc or /sys file.
+
+This module provides the following classes:
+AlienFXMetricEffect: shows a system metric on the zones of a controller
+"""
+
+from builtins import object
+import glob
+import logging
+import os
+import os.path
+import threading
+
+
+class AlienFXMetricEffect(object):
+
+    """ Shows a system metric as zone colours. Call start() to run the effect
+    in a background thread, or run() to run it in the calling thread until
+    stop() is called.
+    """
+
+    METRIC_CPU = "cpu"
+    METRIC_TEMPERATURE = "temperature"
+    METRIC_LOAD = "load"
+    METRICS = [METRIC_CPU, METRIC_TEMPERATURE, METRIC_LOAD]
+
+    # Temperatures (degrees Celsius) shown as the low and the high colour
+    TEMPERATURE_LOW = 40.0
+    TEMPERATURE_HIGH = 95.0
+
+    DEFAULT_LOW_COLOUR = [0, 15, 0]
+    DEFAULT_HIGH_COLOUR = [15, 0, 0]
+
+    def __init__(self, controller, metric, zones=None, rate=1.0,
+            low_colour=None, high_colour=None, proc_root="/proc",
+            sysfs_root="/sys"):
+        """ Create an effect showing the given metric (one of METRICS) on the
+        given zones (all zones of the controller if None), sampled 'rate'
+        times per second. 'proc_root' and 'sysfs_root' are the directories
+        the metrics are read from."""
+        if metric not in self.METRICS:
+            raise ValueError("Unknown metric: {}".format(metric))
+        if not rate > 0:
+            raise ValueError("Invalid sampling rate: {}".format(rate))
+        self.controller = controller
+        self.metric = metric
+        if zones is None:
+            zones = list(controller.zone_map)
+        self.zones = zones
+        self.interval = 1.0/rate
+        self.low_colour = low_colour or self.DEFAULT_LOW_COLOUR
+        self.high_colour = high_colour or self.DEFAULT_HIGH_COLOUR
+        self.proc_root = proc_root
+        self.sysfs_root = sysfs_root
+        self.colour = None
+        self._cpu_times = None
+        self._thermal_paths = None
+        self._num_cpus = os.cpu_count() or 1
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def _read_file(self, path):
+        with open(path) as mfile:
+            return mfile.read()
+
+    def _sample_cpu(self):
+        """ Return the CPU utilisation since the previous sample, 0-1."""
+        fields = self._read_file(
+            os.path.join(self.proc_root, "stat")).split("\n", 1)[0].split()
+        # user, nice, system, idle, iowait, irq, softirq and steal; guest
+        # and guest_nice are already counted in user and nice.
+        times = [int(f) for f in fields[1:9]]
+        # idle and iowait
+        idle = times[3] + (times[4] if len(times) > 4 else 0)
+        total = sum(times)
+        previous = self._cpu_times
+        self._cpu_times = (idle, total)
+        if previous is None or total == previous[1]:
+            return 0.0
+        return 1.0 - float(idle - previous[0])/(total - previous[1])
+
+    def _sample_temperature(self):
+        """ Return the highest thermal zone temperature, scaled so that
+        TEMPERATURE_LOW is 0 and TEMPERATURE_HIGH is 1."""
+        if self._thermal_paths is None:
+            self._thermal_paths = glob.glob(os.path.join(
+                self.sysfs_root, "class", "thermal", "thermal_zone*", "temp"))
+        temperature = None
+        for path in self._thermal_paths:
+            try:
+                value = int(self._read_file(path))/1000.0
+            except (IOError, OSError, ValueError):
+                continue
+            if temperature is None or value > temperature:
+                temperature = value
+        if temperature is None:
+            return 0.0
+        return ((temperature - self.TEMPERATURE_LOW) /
+            (self.TEMPERATURE_HIGH - self.TEMPERATURE_LOW))
+
+    def _sample_load(self):
+        """ Return the 1 minute load average per CPU."""
+        loadavg = self._read_file(os.path.join(self.proc_root, "loadavg"))
+        return float(loadavg.split()[0])/self._num_cpus
+
+    def sample(self):
+        """ Return the current value of the metric, from 0 to 1."""
+        if self.metric == self.METRIC_CPU:
+            value = self._sample_cpu()
+        elif self.metric == self.METRIC_TEMPERATURE:
+            value = self._sample_temperature()
+        else:
+            value = self._sample_load()
+        return min(1.0, max(0.0, value))
+
+    def get_colour(self, value):
+        """ Return the colour showing the given metric value (0-1)."""
+        return [
+            int(round(low + (high - low)*value))
+            for (low, high) in zip(self.low_colour, self.high_colour)]
+
+    def update(self):
+        """ Take a sample and update the zones if their colour changed.
+        Return True if the controller was updated."""
+        colour = self.get_colour(self.sample())
+        if colour == self.colour:
+            return False
+        self.controller.set_realtime_colours(
+            dict((zone, colour) for zone in self.zones))
+        self.colour = colour
+        return True
+
+    def run(self):
+        """ Update the zones at the sampling rate until stop() is called."""
+        try:
+            self.controller.begin_realtime()
+        except Exception as exc:
+            logging.error("Cannot show {}: {}".format(self.metric, exc))
+        while not self._stop_event.is_set():
+            try:
+                self.update()
+            except Exception as exc:
+                logging.error("Cannot show {}: {}".format(self.metric, exc))
+            self._stop_event.wait(self.interval)
+
+    def start(self):
+        """ Run the effect in a background thread."""
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self.run, name="alienfx-metric-effect")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """ Stop the effect."""
+        self._stop_event.set()
+        if (self._thread is not None and
+                self._thread is not threading.current_thread()):
+            self._thread.join()
+            self._thread = None
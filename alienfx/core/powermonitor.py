@@ -0,0 +1,310 @@
+#
+# powermonitor.py
+#
+# Copyright (C) 2013-2014 Ashwin Menon <ashwin.menon@gmail.com>
+# Copyright (C) 2015-2024 Track Master Steve <trackmastersteve@gmail.com>
+#
+# Alienfx is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# Alienfx is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with alienfx.    If not, write to:
+# 	The Free Software Foundation, Inc.,
+# 	51 Franklin Street, Fifth Floor
+# 	Boston, MA  02110-1301, USA.
+#
+
+""" Power state monitor.
+
+Watches the power supplies in /sys/class/power_supply and maps them to one of
+the controller power states (AC Charging, AC Charged, Battery On, Battery
+Critical). When the power state changes, the colours of that state in the
+loaded theme are pushed to the controller as realtime colours, and any
+listeners are called with the new state name.
+
+The monitor blocks in select() until something changes, so it costs nothing
+while idle. The kernel sends a uevent over netlink when a power supply
+changes; sysfs attributes themselves do not support inotify. A power supply
+tree elsewhere (e.g. a fake tree used for testing) is watched with inotify
+instead. If neither is available, the tree is read every POLL_INTERVAL
+seconds.
+
+This module provides the following classes:
+AlienFXPowerMonitor: watches the power supplies and reports state changes
+"""
+
+from builtins import object
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import os.path
+import select
+import socket
+import threading
+
+
+class AlienFXPowerMonitor(object):
+
+    """ Watches the power supplies in a sysfs power_supply directory. Call
+    start() to run the monitor in a background thread, or run() to run it in
+    the calling thread until stop() is called.
+    """
+
+    SYSFS_POWER_SUPPLY = "/sys/class/power_supply"
+
+    # Battery capacity (percent) at or below which the battery is critical,
+    # for batteries that do not report a capacity level
+    CRITICAL_CAPACITY = 5
+
+    # Seconds between reads when no change notifications are available
+    POLL_INTERVAL = 30
+
+    # Netlink protocol and multicast group of kernel uevents
+    NETLINK_KOBJECT_UEVENT = 15
+    UEVENT_GROUP_KERNEL = 1
+
+    # inotify flags
+    IN_MODIFY = 0x2
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+
+    def __init__(self, controller, themefile=None, sysfs_root=None):
+        """ Create a monitor for the given controller. If 'themefile' (an
+        AlienFXThemeFile instance) is given, then the colours of its state
+        matching the power state are pushed to the controller on changes.
+        'sysfs_root' is the power_supply directory to watch."""
+        self.controller = controller
+        self.themefile = themefile
+        if sysfs_root is None:
+            sysfs_root = self.SYSFS_POWER_SUPPLY
+        self.sysfs_root = sysfs_root
+        self.power_state = None
+        self._listeners = []
+        self._thread = None
+        self._libc = None
+        # Pipe used by stop() to wake run(); it only exists while run() is
+        # running.
+        self._wake_lock = threading.Lock()
+        self._wake_read = None
+        self._wake_write = None
+        self._stopped = False
+
+    def add_listener(self, listener):
+        """ Call listener(state_name) whenever the power state changes."""
+        self._listeners.append(listener)
+
+    def _read_attr(self, supply, attr):
+        try:
+            with open(os.path.join(self.sysfs_root, supply, attr)) as afile:
+                return afile.read().strip()
+        except (IOError, OSError):
+            return None
+
+    def _get_supplies(self):
+        try:
+            return sorted(os.listdir(self.sysfs_root))
+        except OSError as exc:
+            logging.error(exc)
+            return []
+
+    def read_power_state(self):
+        """ Read the power supplies and return the matching controller power
+        state name."""
+        on_ac = False
+        has_battery = False
+        charging = False
+        critical = False
+        for supply in self._get_supplies():
+            supply_type = self._read_attr(supply, "type")
+            if supply_type == "Mains":
+                on_ac = on_ac or self._read_attr(supply, "online") == "1"
+            elif supply_type == "Battery":
+                has_battery = True
+                status = self._read_attr(supply, "status")
+                charging = charging or status == "Charging"
+                level = self._read_attr(supply, "capacity_level")
+                capacity = self._read_attr(supply, "capacity")
+                if level is not None:
+                    critical = critical or level == "Critical"
+                elif capacity is not None and capacity.isdigit():
+                    critical = critical or (
+                        int(capacity) <= self.CRITICAL_CAPACITY)
+        if on_ac or not has_battery:
+            if charging:
+                return self.controller.STATE_AC_CHARGING
+            return self.controller.STATE_AC_CHARGED
+        if critical:
+            return self.controller.STATE_BATTERY_CRITICAL
+        return self.controller.STATE_BATTERY_ON
+
+    def _get_state_colours(self, state):
+        """ Return the zone colours of the given state in the theme: the
+        first colour of the first action of every zone."""
+        zone_colours = {}
+        for zone in self.controller.zone_map:
+            actions = self.themefile.get_zone_actions(state, zone)
+            if actions:
+                colours = self.themefile.get_action_colours(actions[0])
+                if colours:
+                    zone_colours[zone] = colours[0]
+        return zone_colours
+
+    def check(self):
+        """ Read the power state and act on it if it changed. Return True if
+        it changed."""
+        state = self.read_power_state()
+        if state == self.power_state:
+            return False
+        logging.info("Power state: {}".format(state))
+        self.power_state = state
+        if self.themefile is not None:
+            try:
+                # The controller has switched to its saved state colours.
+                self.controller.begin_realtime()
+                self.controller.set_realtime_colours(
+                    self._get_state_colours(state))
+            except Exception as exc:
+                logging.error("Cannot set colours for {}: {}".format(
+                    state, exc))
+        for listener in self._listeners:
+            listener(state)
+        return True
+
+    def _open_netlink(self):
+        """ Return a socket receiving kernel uevents, or None."""
+        try:
+            sock = socket.socket(
+                socket.AF_NETLINK, socket.SOCK_DGRAM,
+                self.NETLINK_KOBJECT_UEVENT)
+            sock.bind((0, self.UEVENT_GROUP_KERNEL))
+            return sock
+        except (AttributeError, OSError) as exc:
+            logging.warning("Cannot receive uevents: {}".format(exc))
+            return None
+
+    def _open_inotify(self):
+        """ Return an inotify file descriptor watching the power supply tree,
+        or None."""
+        try:
+            self._libc = ctypes.CDLL(
+                ctypes.util.find_library("c"), use_errno=True)
+            fd = self._libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        except (AttributeError, OSError) as exc:
+            logging.warning("Cannot use inotify: {}".format(exc))
+            return None
+        if fd < 0:
+            logging.warning("Cannot use inotify: {}".format(
+                os.strerror(ctypes.get_errno())))
+            return None
+        self._add_watches(fd)
+        return fd
+
+    def _add_watches(self, fd):
+        """ Watch the power supply directory and every supply in it. Adding
+        a watch again for the same directory is harmless, so this is also
+        done whenever the tree changes, to pick up new supplies."""
+        mask = (self.IN_MODIFY | self.IN_CLOSE_WRITE | self.IN_MOVED_TO |
+            self.IN_CREATE | self.IN_DELETE)
+        paths = [self.sysfs_root]
+        paths.extend(
+            os.path.join(self.sysfs_root, supply)
+            for supply in self._get_supplies())
+        for path in paths:
+            if self._libc.inotify_add_watch(
+                    fd, path.encode("utf-8"), mask) < 0:
+                logging.warning("Cannot watch {}: {}".format(
+                    path, os.strerror(ctypes.get_errno())))
+
+    def _drain(self, fd):
+        """ Read and discard everything available on a non-blocking file
+        descriptor."""
+        while True:
+            try:
+                if not os.read(fd, 4096):
+                    return
+            except OSError as exc:
+                if exc.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                raise
+
+    def _is_power_supply_uevent(self, data):
+        return b"SUBSYSTEM=power_supply" in data.split(b"\0")
+
+    def run(self):
+        """ Act on the current power state, then on every change until
+        stop() is called."""
+        sock = None
+        inotify_fd = None
+        with self._wake_lock:
+            (self._wake_read, self._wake_write) = os.pipe()
+        if os.path.realpath(self.sysfs_root) == os.path.realpath(
+                self.SYSFS_POWER_SUPPLY):
+            sock = self._open_netlink()
+        else:
+            inotify_fd = self._open_inotify()
+        try:
+            self.check()
+            while not self._stopped:
+                fds = [self._wake_read]
+                if sock is not None:
+                    fds.append(sock)
+                if inotify_fd is not None:
+                    fds.append(inotify_fd)
+                timeout = None
+                if sock is None and inotify_fd is None:
+                    timeout = self.POLL_INTERVAL
+                (readable, w, x) = select.select(fds, [], [], timeout)
+                if self._stopped:
+                    return
+                changed = not readable
+                if sock is not None and sock in readable:
+                    changed = self._is_power_supply_uevent(sock.recv(65536))
+                if inotify_fd is not None and inotify_fd in readable:
+                    self._drain(inotify_fd)
+                    self._add_watches(inotify_fd)
+                    changed = True
+                if changed:
+                    self.check()
+        finally:
+            if sock is not None:
+                sock.close()
+            if inotify_fd is not None:
+                os.close(inotify_fd)
+            with self._wake_lock:
+                os.close(self._wake_read)
+                os.close(self._wake_write)
+                self._wake_read = None
+                self._wake_write = None
+
+    def start(self):
+        """ Run the monitor in a background thread."""
+        self._thread = threading.Thread(
+            target=self.run, name="alienfx-power-monitor")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """ Stop the monitor. Its wake pipe is closed when run() returns."""
+        with self._wake_lock:
+            self._stopped = True
+            if self._wake_write is not None:
+                os.write(self._wake_write, b"x")
+        if (self._thread is not None and
+                self._thread is not threading.current_thread()):
+            self._thread.join()
+            self._thread = None
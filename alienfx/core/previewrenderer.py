@@ -0,0 +1,252 @@
+#
+# previewrenderer.py
+#
+# Copyright (C) 2013-2014 Ashwin Menon <ashwin.menon@gmail.com>
+# Copyright (C) 2015-2024 Track Master Steve <trackmastersteve@gmail.com>
+#
+# Alienfx is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# Alienfx is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with alienfx.    If not, write to:
+# 	The Free Software Foundation, Inc.,
+# 	51 Franklin Street, Fifth Floor
+# 	Boston, MA  02110-1301, USA.
+#
+
+""" Offscreen rendering of theme previews, without a controller.
+
+Simulates the actions of a theme state on the zones of a controller model
+and writes the result as PNG images:
+
+- a timeline, with one row per zone and time running from left to right
+  over the longest action loop, TIMELINE_ACTION_WIDTH pixels per action,
+  which shows every action at a glance and makes a compact thumbnail;
+- a frame sequence, with one image per frame showing every zone as a tile.
+
+Actions are simulated with the colour semantics of the GTK action renderer:
+a fixed action shows its colour, a blink action shows its colour for the
+first half of the action and black for the second half, and a morph action
+fades linearly from its first colour to its second.
+
+The controllers do not document how long an action lasts; their speed is
+only known to be slower the higher it is, with DEFAULT_SPEED as the usual
+tempo and MIN_SPEED as the fastest that works. Action durations are therefore
+nominal: DEFAULT_ACTION_TIME at the controller's DEFAULT_SPEED and
+MIN_ACTION_TIME at its MIN_SPEED, interpolated linearly in between and
+beyond. This keeps the previews of themes made for different controllers
+comparable, even though their speed ranges differ.
+
+The PNG files are written by a small encoder using only zlib and struct.
+
+This module provides the following classes and functions:
+AlienFXPreviewRenderer: renders the previews of the loaded theme
+write_png: write RGB pixel rows to a PNG file
+"""
+
+from builtins import object
+from builtins import range
+import os
+import os.path
+import struct
+import zlib
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def _png_chunk(chunk_type, data):
+    return (struct.pack(">I", len(data)) + chunk_type + data +
+        struct.pack(">I", zlib.crc32(chunk_type + data) & 0xffffffff))
+
+
+def write_png(path, width, height, rows):
+    """ Write an 8 bit RGB image to a PNG file. 'rows' is a list of 'height'
+    bytes objects holding the 3*'width' bytes of each pixel row."""
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    # Every row starts with filter type 0 (none).
+    raw = b"".join(b"\0" + row for row in rows)
+    with open(path, "wb") as png_file:
+        png_file.write(_PNG_SIGNATURE)
+        png_file.write(_png_chunk(b"IHDR", header))
+        png_file.write(_png_chunk(b"IDAT", zlib.compress(raw, 6)))
+        png_file.write(_png_chunk(b"IEND", b""))
+
+
+class AlienFXPreviewRenderer(object):
+
+    """ Renders previews of the theme loaded in an AlienFXThemeFile instance,
+    on the zones of the controller of that theme file.
+    """
+
+    # Nominal seconds an action lasts at the controller's DEFAULT_SPEED and
+    # at its MIN_SPEED. At the default frame rate, the fastest actions still
+    # span a few frames, so blinks and morphs show up in frame sequences.
+    DEFAULT_ACTION_TIME = 1.0
+    MIN_ACTION_TIME = 0.4
+
+    # Timeline size: pixels per action and per zone, and maximum width
+    TIMELINE_ACTION_WIDTH = 40
+    TIMELINE_ROW_HEIGHT = 8
+    TIMELINE_MAX_WIDTH = 1200
+
+    # Frame sequence tiles
+    TILE_SIZE = 16
+    TILE_SPACING = 2
+    TILE_COLUMNS = 8
+
+    def __init__(self, themefile, state=None, max_colour_val=0xf):
+        """ Create a renderer for the given theme state (the boot state if
+        None). Colour components of the theme range from 0 to
+        max_colour_val."""
+        self.themefile = themefile
+        self.controller = themefile.controller
+        if state is None:
+            state = self.controller.STATE_BOOT
+        self.state = state
+        self.max_colour_val = max_colour_val
+        self.zones = list(self.controller.zone_map)
+        self._loops = None
+
+    def _get_loops(self):
+        """ Return, for every zone, its actions as a list of (type, colours)
+        tuples, with colours scaled to 0-255."""
+        if self._loops is None:
+            tf = self.themefile
+            scale = 255.0/self.max_colour_val
+            self._loops = []
+            for zone in self.zones:
+                loop = []
+                for action in tf.get_zone_actions(self.state, zone):
+                    colours = [
+                        [int(round(c*scale)) for c in colour]
+                        for colour in tf.get_action_colours(action)]
+                    if colours:
+                        loop.append((tf.get_action_type(action), colours))
+                self._loops.append(loop)
+        return self._loops
+
+    def get_action_time(self):
+        """ Return the simulated duration of one action, in seconds. Speeds
+        below the controller's MIN_SPEED behave as MIN_SPEED."""
+        min_speed = self.controller.MIN_SPEED
+        default_speed = self.controller.DEFAULT_SPEED
+        speed = max(min_speed, self.themefile.get_speed())
+        if default_speed <= min_speed:
+            return self.DEFAULT_ACTION_TIME
+        return self.MIN_ACTION_TIME + (
+            self.DEFAULT_ACTION_TIME - self.MIN_ACTION_TIME)*(
+            float(speed - min_speed)/(default_speed - min_speed))
+
+    def get_period(self):
+        """ Return the duration of the longest action loop, in seconds."""
+        longest = max([len(loop) for loop in self._get_loops()] + [1])
+        return longest*self.get_action_time()
+
+    def _get_colour(self, loop, t, action_time):
+        """ Return the colour (r, g, b) shown at time t by a loop."""
+        if not loop:
+            return (0, 0, 0)
+        position = t/action_time
+        index = int(position) % len(loop)
+        fraction = position - int(position)
+        (action_type, colours) = loop[index]
+        tf = self.themefile
+        if action_type == tf.KW_ACTION_TYPE_BLINK:
+            if fraction >= 0.5:
+                return (0, 0, 0)
+        elif action_type == tf.KW_ACTION_TYPE_MORPH and len(colours) > 1:
+            return tuple(
+                int(round(c1 + (c2 - c1)*fraction))
+                for (c1, c2) in zip(colours[0], colours[1]))
+        return tuple(colours[0])
+
+    def get_zone_colours(self, t):
+        """ Return the colours (r, g, b, 0-255) of all zones, in the order of
+        self.zones, at time t seconds after the theme starts."""
+        action_time = self.get_action_time()
+        return [
+            self._get_colour(loop, t, action_time)
+            for loop in self._get_loops()]
+
+    def render_timeline(self, path):
+        """ Write the timeline of the theme state to a PNG file. Return the
+        size (width, height) of the image."""
+        period = self.get_period()
+        action_time = self.get_action_time()
+        width = int(min(self.TIMELINE_MAX_WIDTH, round(
+            period/action_time)*self.TIMELINE_ACTION_WIDTH))
+        rows = []
+        for loop in self._get_loops():
+            row = b"".join(
+                bytes(bytearray(self._get_colour(
+                    loop, period*x/width, action_time)))
+                for x in range(width))
+            rows.extend([row]*self.TIMELINE_ROW_HEIGHT)
+        if not rows:
+            rows = [b"\0\0\0"*width]
+        write_png(path, width, len(rows), rows)
+        return (width, len(rows))
+
+    def render_frame(self, path, t):
+        """ Write the zone tiles at time t to a PNG file. Return the size
+        (width, height) of the image."""
+        colours = self.get_zone_colours(t)
+        columns = max(1, min(self.TILE_COLUMNS, len(colours)))
+        tile_rows = max(1, (len(colours) + columns - 1)//columns)
+        pitch = self.TILE_SIZE + self.TILE_SPACING
+        width = columns*pitch + self.TILE_SPACING
+        gap = b"\0\0\0"*self.TILE_SPACING
+        blank = b"\0\0\0"*width
+        rows = [blank]*self.TILE_SPACING
+        for tile_row in range(tile_rows):
+            tiles = colours[tile_row*columns:(tile_row + 1)*columns]
+            tiles += [(0, 0, 0)]*(columns - len(tiles))
+            row = gap + b"".join(
+                bytes(bytearray(colour))*self.TILE_SIZE + gap
+                for colour in tiles)
+            rows.extend([row]*self.TILE_SIZE)
+            rows.extend([blank]*self.TILE_SPACING)
+        write_png(path, width, len(rows), rows)
+        return (width, len(rows))
+
+    def render_frames(self, directory, frame_rate=10, duration=None):
+        """ Write the frames of the theme state, 'frame_rate' per second for
+        'duration' seconds (one loop period if None), to PNG files named
+        frame_NNNN.png in the given directory. Return the number of
+        frames."""
+        if duration is None:
+            duration = self.get_period()
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        num_frames = max(1, int(round(duration*frame_rate)))
+        for frame in range(num_frames):
+            self.render_frame(
+                os.path.join(directory, "frame_{:04d}.png".format(frame)),
+                float(frame)/frame_rate)
+        return num_frames
+
+    @classmethod
+    def render_themes(cls, themefile, theme_names, output_dir, state=None):
+        """ Load each of the named themes into the given theme file and
+        write its timeline to OUTPUT_DIR/<theme name>.png. Return the names
+        of the themes rendered."""
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+        rendered = []
+        for theme_name in theme_names:
+            themefile.load(theme_name)
+            if themefile.theme_name != theme_name:
+                continue
+            cls(themefile, state).render_timeline(
+                os.path.join(output_dir, theme_name + ".png"))
+            rendered.append(theme_name)
+        return rendered
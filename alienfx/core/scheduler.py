@@ -0,0 +1,251 @@
+#
+# scheduler.py
+#
+# Copyright (C) 2013-2014 Ashwin Menon <ashwin.menon@gmail.com>
+# Copyright (C) 2015-2024 Track Master Steve <trackmastersteve@gmail.com>
+#
+# Alienfx is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# Alienfx is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with alienfx.    If not, write to:
+# 	The Free Software Foundation, Inc.,
+# 	51 Franklin Street, Fifth Floor
+# 	Boston, MA  02110-1301, USA.
+#
+
+""" Theme playlist scheduler.
+
+A playlist is a JSON file listing themes and what triggers each of them:
+
+    {
+        "interval": 600,
+        "themes": [
+            {"theme": "day"},
+            {"theme": "day-alt"},
+            {"theme": "night", "at": "22:30"},
+            {"theme": "unplugged", "event": "Battery On"}
+        ]
+    }
+
+Themes with neither "at" nor "event" are rotated every "interval" seconds.
+A theme with "at" is applied every day at that local time, and a theme with
+"event" is applied whenever that event is triggered. The events triggered by
+the power monitor are the power states of the controller ("AC Charging",
+"AC Charged", "Battery On" or "Battery Critical"). Every theme is compiled
+once when the scheduler starts and is then applied from its compiled form;
+themes that cannot be compiled up front are loaded and applied the usual way
+when they are due. Applied themes are saved as the last theme, as with any
+other apply.
+
+This module provides the following classes:
+AlienFXScheduler: applies the themes of a playlist when they are due
+"""
+
+from builtins import object
+import copy
+import datetime
+import json
+import logging
+import threading
+import time
+
+
+class AlienFXScheduler(object):
+
+    """ Applies the themes of a playlist to a controller when they are due.
+    Call start() to run the scheduler in a background thread, or run() to
+    run it in the calling thread until stop() is called.
+    """
+
+    # Playlist keywords
+    KW_INTERVAL = "interval"
+    KW_THEMES = "themes"
+    KW_THEME = "theme"
+    KW_AT = "at"
+    KW_EVENT = "event"
+
+    def __init__(self, controller, themefile, playlist):
+        """ Create a scheduler for the given playlist (a dict, see the module
+        documentation). 'themefile' is the AlienFXThemeFile instance used to
+        load the themes."""
+        self.controller = controller
+        self.themefile = themefile
+        self.interval = playlist.get(self.KW_INTERVAL)
+        self.current_theme = None
+        self._rotation = []
+        self._timed = []
+        self._events = {}
+        for entry in playlist.get(self.KW_THEMES, []):
+            theme_name = entry[self.KW_THEME]
+            if self.KW_AT in entry:
+                at = datetime.datetime.strptime(entry[self.KW_AT], "%H:%M")
+                self._timed.append((at.time(), theme_name))
+            elif self.KW_EVENT in entry:
+                self._events[entry[self.KW_EVENT]] = theme_name
+            else:
+                self._rotation.append(theme_name)
+        self._timed.sort()
+        self._compiled = {}
+        self._cond = threading.Condition()
+        self._pending_events = []
+        self._stopped = False
+        self._thread = None
+
+    @classmethod
+    def from_file(cls, controller, themefile, playlist_path):
+        """ Create a scheduler for the playlist in the given JSON file."""
+        with open(playlist_path) as pfile:
+            return cls(controller, themefile, json.load(pfile))
+
+    def get_theme_names(self):
+        """ Return the names of all themes in the playlist."""
+        names = list(self._rotation)
+        names.extend(theme_name for (at, theme_name) in self._timed)
+        names.extend(self._events.values())
+        return names
+
+    def precompile(self):
+        """ Compile every theme of the playlist for the controller."""
+        for theme_name in self.get_theme_names():
+            if theme_name in self._compiled:
+                continue
+            try:
+                self.themefile.load(theme_name)
+                if (self.themefile.theme_name != theme_name or
+                        self.themefile.validate()):
+                    logging.warning(
+                        "Cannot compile theme {}".format(theme_name))
+                    continue
+                self._compiled[theme_name] = (
+                    self.controller.compiler.compile(self.themefile),
+                    copy.deepcopy(self.themefile.theme))
+            except Exception as exc:
+                logging.error("Cannot compile theme {}: {}".format(
+                    theme_name, exc))
+
+    def apply_theme(self, theme_name):
+        """ Apply the named theme, from its compiled form if it was compiled.
+        Return True on success, False otherwise."""
+        logging.info("Applying theme {}".format(theme_name))
+        try:
+            if theme_name in self._compiled:
+                (compiled_theme, theme) = self._compiled[theme_name]
+                if not self.controller.set_compiled_theme(compiled_theme):
+                    return False
+                self.themefile.theme = theme
+                self.themefile.theme_name = theme_name
+            else:
+                self.themefile.load(theme_name)
+                if self.themefile.theme_name != theme_name:
+                    return False
+                if not self.controller.set_theme(self.themefile):
+                    return False
+            self.themefile.applied()
+            self.current_theme = theme_name
+            return True
+        except Exception as exc:
+            logging.error("Cannot apply theme {}: {}".format(theme_name, exc))
+            return False
+
+    def _get_timed_theme(self, now):
+        """ Return the timed theme in effect at the given datetime, i.e. the
+        one with the latest time not after now (wrapping around midnight), or
+        None if there are no timed themes."""
+        if not self._timed:
+            return None
+        theme_name = self._timed[-1][1]
+        for (at, name) in self._timed:
+            if at <= now.time():
+                theme_name = name
+        return theme_name
+
+    def _get_next_timed_switch(self, now):
+        """ Return the datetime of the first timed theme after now, and that
+        theme, or (None, None) if there are no timed themes."""
+        if not self._timed:
+            return (None, None)
+        for (at, theme_name) in self._timed:
+            switch = datetime.datetime.combine(now.date(), at)
+            if switch > now:
+                return (switch, theme_name)
+        (at, theme_name) = self._timed[0]
+        switch = datetime.datetime.combine(
+            now.date() + datetime.timedelta(days=1), at)
+        return (switch, theme_name)
+
+    def trigger_event(self, event):
+        """ Apply the theme of the given event, if the playlist has one. The
+        theme is applied by the scheduler thread."""
+        if event not in self._events:
+            return
+        with self._cond:
+            self._pending_events.append(event)
+            self._cond.notify_all()
+
+    def stop(self):
+        """ Stop the scheduler."""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if (self._thread is not None and
+                self._thread is not threading.current_thread()):
+            self._thread.join()
+            self._thread = None
+
+    def start(self):
+        """ Run the scheduler in a background thread."""
+        self._thread = threading.Thread(
+            target=self.run, name="alienfx-scheduler")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def run(self):
+        """ Compile the playlist and apply its themes when they are due,
+        until stop() is called. The thread sleeps until the next theme is
+        due or an event is triggered."""
+        self.precompile()
+        rotation_index = 0
+        next_rotation = None
+        initial_theme = self._get_timed_theme(datetime.datetime.now())
+        if initial_theme is None and self._rotation:
+            initial_theme = self._rotation[0]
+        if initial_theme is not None:
+            self.apply_theme(initial_theme)
+        if self.interval and len(self._rotation) > 1:
+            next_rotation = time.monotonic() + self.interval
+
+        while True:
+            now = datetime.datetime.now()
+            (next_switch, timed_theme) = self._get_next_timed_switch(now)
+            timeouts = []
+            if next_rotation is not None:
+                timeouts.append(next_rotation - time.monotonic())
+            if next_switch is not None:
+                timeouts.append((next_switch - now).total_seconds())
+            with self._cond:
+                if not self._stopped and not self._pending_events:
+                    self._cond.wait(
+                        max(0, min(timeouts)) if timeouts else None)
+                if self._stopped:
+                    return
+                events = self._pending_events
+                self._pending_events = []
+
+            for event in events:
+                self.apply_theme(self._events[event])
+            if next_switch is not None and datetime.datetime.now() >= next_switch:
+                self.apply_theme(timed_theme)
+            if next_rotation is not None and time.monotonic() >= next_rotation:
+                rotation_index = (rotation_index + 1) % len(self._rotation)
+                self.apply_theme(self._rotation[rotation_index])
+                next_rotation = time.monotonic() + self.interval
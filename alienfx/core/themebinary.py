@@ -0,0 +1,243 @@
+#
+# themebinary.py
+#
+# Copyright (C) 2013-2014 Ashwin Menon <ashwin.menon@gmail.com>
+# Copyright (C) 2015-2024 Track Master Steve <trackmastersteve@gmail.com>
+#
+# Alienfx is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# Alienfx is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with alienfx.    If not, write to:
+# 	The Free Software Foundation, Inc.,
+# 	51 Franklin Street, Fifth Floor
+# 	Boston, MA  02110-1301, USA.
+#
+
+""" Compact binary encoding of AlienFX themes.
+
+Themes are normally stored as JSON, which repeats the same keys and zone
+names for every state item. The binary encoding stores zone and state names
+once in a string table and packs every colour into two bytes (4 bits per
+component, the range used by theme files). All integers are big-endian.
+
+    header:   "AFXT", version (u8), flags (u8), speed (u16)
+    strings:  count (u16), then for each: length (u16), utf-8 bytes
+    states:   count (u16), then for each:
+                name (u16 string index), item count (u32), then per item:
+                zone count (u16), zone string indices (u16 each),
+                action count (u32), then per action:
+                  type (u8), colour count (u8), colours (u16 each)
+    extras:   length (u32), utf-8 JSON object
+
+Top-level entries that do not have the shape of a state (e.g. unknown keys,
+items with extra keys or colours out of range) are stored unchanged in the
+JSON "extras" object, so that the encoding is lossless for any theme.
+
+This module provides the following functions:
+is_binary_theme: check whether data starts with the binary theme magic
+dumps: encode a theme dict to bytes
+loads: decode bytes to a theme dict
+"""
+
+import json
+import struct
+
+MAGIC = b"AFXT"
+VERSION = 1
+
+# Header flags
+FLAG_HAS_SPEED = 0x1
+
+# Theme keywords. These are part of the encoding and must match the theme
+# file keywords of AlienFXThemeFile.
+KW_SPEED = "speed"
+KW_ZONES = "zones"
+KW_LOOP = "loop"
+KW_ACTION_TYPE = "type"
+KW_ACTION_COLOURS = "colours"
+
+# Action types, stored as their index in this list
+ACTION_TYPES = ["fixed", "blink", "morph"]
+
+_HEADER = struct.Struct(">4sBBH")
+_U16 = struct.Struct(">H")
+_U32 = struct.Struct(">I")
+_ACTION = struct.Struct(">BB")
+
+
+def is_binary_theme(data):
+    """ Return True if data (bytes) starts with the binary theme magic."""
+    return data[:len(MAGIC)] == MAGIC
+
+
+def _is_packable_colour(colour):
+    return (isinstance(colour, list) and len(colour) == 3 and
+        all(isinstance(c, int) and not isinstance(c, bool) and 0 <= c <= 0xf
+            for c in colour))
+
+
+def _is_packable_state(items):
+    """ Return True if the given top-level value is a list of state items
+    that the binary encoding can represent exactly."""
+    if not isinstance(items, list):
+        return False
+    for item in items:
+        if not isinstance(item, dict):
+            return False
+        if set(item) != set([KW_ZONES, KW_LOOP]):
+            return False
+        zones = item[KW_ZONES]
+        loop = item[KW_LOOP]
+        if not isinstance(zones, list) or not isinstance(loop, list):
+            return False
+        if not all(isinstance(zone, str) for zone in zones):
+            return False
+        for action in loop:
+            if not isinstance(action, dict):
+                return False
+            if set(action) != set([
+                    KW_ACTION_TYPE,
+                    KW_ACTION_COLOURS]):
+                return False
+            if action[KW_ACTION_TYPE] not in ACTION_TYPES:
+                return False
+            colours = action[KW_ACTION_COLOURS]
+            if not isinstance(colours, list) or len(colours) > 0xff:
+                return False
+            if not all(_is_packable_colour(colour) for colour in colours):
+                return False
+    return True
+
+
+def dumps(theme):
+    """ Encode the given theme dict and return the resulting bytes."""
+    strings = []
+    string_index = {}
+
+    def intern(name):
+        if name not in string_index:
+            string_index[name] = len(strings)
+            strings.append(name)
+        return string_index[name]
+
+    flags = 0
+    speed = 0
+    extras = {}
+    state_chunks = []
+    num_states = 0
+    for key in theme:
+        value = theme[key]
+        if key == KW_SPEED and isinstance(value, int) and (
+                0 <= value <= 0xffff):
+            flags |= FLAG_HAS_SPEED
+            speed = value
+            continue
+        if not _is_packable_state(value):
+            extras[key] = value
+            continue
+        num_states += 1
+        state_chunks.append(_U16.pack(intern(key)))
+        state_chunks.append(_U32.pack(len(value)))
+        for item in value:
+            zones = item[KW_ZONES]
+            loop = item[KW_LOOP]
+            state_chunks.append(_U16.pack(len(zones)))
+            state_chunks.extend(_U16.pack(intern(zone)) for zone in zones)
+            state_chunks.append(_U32.pack(len(loop)))
+            for action in loop:
+                colours = action[KW_ACTION_COLOURS]
+                state_chunks.append(_ACTION.pack(
+                    ACTION_TYPES.index(action[KW_ACTION_TYPE]),
+                    len(colours)))
+                state_chunks.extend(
+                    _U16.pack((r << 8) | (g << 4) | b) for (r, g, b) in colours)
+
+    chunks = [_HEADER.pack(MAGIC, VERSION, flags, speed)]
+    chunks.append(_U16.pack(len(strings)))
+    for name in strings:
+        encoded = name.encode("utf-8")
+        chunks.append(_U16.pack(len(encoded)))
+        chunks.append(encoded)
+    chunks.append(_U16.pack(num_states))
+    chunks.extend(state_chunks)
+    encoded_extras = json.dumps(extras, separators=(',', ':')).encode("utf-8")
+    chunks.append(_U32.pack(len(encoded_extras)))
+    chunks.append(encoded_extras)
+    return b"".join(chunks)
+
+
+def loads(data):
+    """ Decode the given bytes and return the theme dict. Raise ValueError if
+    the data is not a valid binary theme."""
+    try:
+        (magic, version, flags, speed) = _HEADER.unpack_from(data, 0)
+        if magic != MAGIC:
+            raise ValueError("Not a binary theme file")
+        if version != VERSION:
+            raise ValueError(
+                "Unsupported binary theme version: {}".format(version))
+        pos = _HEADER.size
+        theme = {}
+        if flags & FLAG_HAS_SPEED:
+            theme[KW_SPEED] = speed
+
+        (num_strings,) = _U16.unpack_from(data, pos)
+        pos += _U16.size
+        strings = []
+        for i in range(num_strings):
+            (length,) = _U16.unpack_from(data, pos)
+            pos += _U16.size
+            strings.append(bytes(data[pos:pos + length]).decode("utf-8"))
+            pos += length
+
+        (num_states,) = _U16.unpack_from(data, pos)
+        pos += _U16.size
+        for i in range(num_states):
+            (name_index, num_items) = (
+                _U16.unpack_from(data, pos)[0],
+                _U32.unpack_from(data, pos + _U16.size)[0])
+            pos += _U16.size + _U32.size
+            items = []
+            for j in range(num_items):
+                (num_zones,) = _U16.unpack_from(data, pos)
+                pos += _U16.size
+                zones = [
+                    strings[_U16.unpack_from(data, pos + k*_U16.size)[0]]
+                    for k in range(num_zones)]
+                pos += num_zones*_U16.size
+                (num_actions,) = _U32.unpack_from(data, pos)
+                pos += _U32.size
+                loop = []
+                for k in range(num_actions):
+                    (type_code, num_colours) = _ACTION.unpack_from(data, pos)
+                    pos += _ACTION.size
+                    colours = []
+                    for m in range(num_colours):
+                        (packed,) = _U16.unpack_from(data, pos)
+                        pos += _U16.size
+                        colours.append(
+                            [(packed >> 8) & 0xf, (packed >> 4) & 0xf, packed & 0xf])
+                    loop.append({
+                        KW_ACTION_TYPE: ACTION_TYPES[type_code],
+                        KW_ACTION_COLOURS: colours})
+                items.append({
+                    KW_ZONES: zones,
+                    KW_LOOP: loop})
+            theme[strings[name_index]] = items
+
+        (length,) = _U32.unpack_from(data, pos)
+        pos += _U32.size
+        theme.update(json.loads(bytes(data[pos:pos + length]).decode("utf-8")))
+        return theme
+    except (struct.error, IndexError) as exc:
+        raise ValueError("Corrupt binary theme: {}".format(exc))
@@ -0,0 +1,169 @@
+#
+# themebuilder.py
+#
+# Copyright (C) 2013-2014 Ashwin Menon <ashwin.menon@gmail.com>
+# Copyright (C) 2015-2024 Track Master Steve <trackmastersteve@gmail.com>
+#
+# Alienfx is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# Alienfx is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with alienfx.    If not, write to:
+# 	The Free Software Foundation, Inc.,
+# 	51 Franklin Street, Fifth Floor
+# 	Boston, MA  02110-1301, USA.
+#
+
+""" Headless theme building.
+
+Themes can be generated from scripts without a controller, a GUI or any
+disk I/O, and then saved together in one pass. For instance, with the zone
+names of the M17xR3:
+
+    batch = AlienFXThemeBatch()
+    for (name, colour) in machines:
+        batch.new_theme(name, speed=200).fixed(
+            "Boot", ["Left Keyboard", "Right Keyboard"], colour).blink(
+            "Battery Critical", ["Power Button"], [15, 0, 0])
+    batch.save(AlienFXThemeFile(controller))
+
+This module provides the following classes:
+AlienFXThemeBuilder: builds a theme dict
+AlienFXThemeBatch: a set of built themes that are saved together
+"""
+
+from builtins import object
+import logging
+
+from alienfx.core.themefile import AlienFXThemeFile
+import alienfx.core.themevalidator as alienfx_themevalidator
+
+
+class AlienFXThemeBuilder(object):
+
+    """ Builds a theme dict. The methods that add to the theme return the
+    builder, so that calls can be chained.
+    """
+
+    def __init__(self, speed=None, base=None):
+        """ Create a builder for an empty theme, with the given speed and
+        base theme name, if any."""
+        self.theme = {}
+        if speed is not None:
+            self.set_speed(speed)
+        if base is not None:
+            self.set_base(base)
+
+    def set_speed(self, speed):
+        """ Set the speed of the theme."""
+        self.theme[AlienFXThemeFile.KW_SPEED] = speed
+        return self
+
+    def set_base(self, base):
+        """ Set the name of the base theme."""
+        self.theme[AlienFXThemeFile.KW_BASE] = base
+        return self
+
+    def add_zones(self, state, zones, actions):
+        """ Add a state item running the given actions (made with
+        AlienFXThemeFile.make_zone_action) on the given zones, in the given
+        state."""
+        self.theme.setdefault(state, []).append({
+            AlienFXThemeFile.KW_ZONES: list(zones),
+            AlienFXThemeFile.KW_LOOP: list(actions)})
+        return self
+
+    @staticmethod
+    def _make_action(action_type, colours):
+        return AlienFXThemeFile.make_zone_action(
+            action_type, [list(colour) for colour in colours])
+
+    def fixed(self, state, zones, colour):
+        """ Show a fixed colour on the given zones, in the given state."""
+        return self.add_zones(state, zones, [self._make_action(
+            AlienFXThemeFile.KW_ACTION_TYPE_FIXED, [colour])])
+
+    def blink(self, state, zones, colour):
+        """ Blink a colour on the given zones, in the given state."""
+        return self.add_zones(state, zones, [self._make_action(
+            AlienFXThemeFile.KW_ACTION_TYPE_BLINK, [colour])])
+
+    def morph(self, state, zones, colour1, colour2):
+        """ Morph from one colour to another on the given zones, in the given
+        state."""
+        return self.add_zones(state, zones, [self._make_action(
+            AlienFXThemeFile.KW_ACTION_TYPE_MORPH, [colour1, colour2])])
+
+    def loop(self, state, zones, actions):
+        """ Run a loop of actions, given as (type, colours) tuples, on the
+        given zones, in the given state."""
+        return self.add_zones(state, zones, [
+            self._make_action(action_type, colours)
+            for (action_type, colours) in actions])
+
+    def validate(self):
+        """ Return the list of errors of the theme; the list is empty if the
+        theme is valid."""
+        return alienfx_themevalidator.validate(self.theme)
+
+    def build(self):
+        """ Return the theme dict."""
+        return self.theme
+
+
+class AlienFXThemeBatch(object):
+
+    """ A set of named themes that are built in memory and saved to the
+    themes directory together.
+    """
+
+    def __init__(self):
+        self._themes = []
+
+    def new_theme(self, theme_name, speed=None, base=None):
+        """ Add a new theme with the given name and return its builder."""
+        builder = AlienFXThemeBuilder(speed, base)
+        self._themes.append((theme_name, builder))
+        return builder
+
+    def add(self, theme_name, theme):
+        """ Add a theme dict with the given name."""
+        self._themes.append((theme_name, theme))
+
+    def get_themes(self):
+        """ Return the themes of the batch, as (name, theme dict) tuples."""
+        return [
+            (theme_name,
+                theme.build() if isinstance(theme, AlienFXThemeBuilder)
+                else theme)
+            for (theme_name, theme) in self._themes]
+
+    def validate(self):
+        """ Return a dict mapping the names of the invalid themes of the
+        batch to their errors."""
+        invalid = {}
+        for (theme_name, theme) in self.get_themes():
+            errors = alienfx_themevalidator.validate(theme)
+            if errors:
+                invalid[theme_name] = errors
+        return invalid
+
+    def save(self, themefile, theme_format=None):
+        """ Save all themes of the batch to the themes directory of the
+        given AlienFXThemeFile instance, in one pass. Invalid themes are
+        logged and skipped. Return the names of the themes saved."""
+        themes = self.get_themes()
+        saved = themefile.save_themes(themes, theme_format)
+        if len(saved) != len(themes):
+            logging.warning("Saved {} of {} themes".format(
+                len(saved), len(themes)))
+        return saved
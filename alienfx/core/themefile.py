@@ -26,13 +26,16 @@
 """ Classes for handling AlienFX theme files.
 
 This module only deals with the mechanisms of loading and saving theme files
-to disk.
+to disk. Theme files are stored either as JSON or in the compact binary
+format of the themebinary module; the format is detected when loading.
 
 This module provides the following classes:
 AlienFXThemeFile: theme file abstraction
 """
 
 from builtins import object
+import collections
+import copy
 import json
 import logging
 import os
@@ -40,6 +43,94 @@ import os.path
 
 import pkg_resources
 
+from alienfx.common import write_file_atomic, write_files_atomic
+import alienfx.core.themebinary as alienfx_themebinary
+from alienfx.core.themeindex import AlienFXThemeIndex
+import alienfx.core.themestore as alienfx_themestore
+import alienfx.core.themevalidator as alienfx_themevalidator
+from alienfx.core.writebehind import AlienFXWriteBehind
+
+class _AlienFXThemeStream(object):
+
+    """ Incremental parser for the top-level object of a JSON theme file.
+    The file is read in chunks, and each top-level entry is decoded as soon
+    as it is complete.
+    """
+
+    def __init__(self, tfile, chunk_size):
+        self._tfile = tfile
+        self._chunk_size = chunk_size
+        self._decoder = json.JSONDecoder()
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+
+    def _read_more(self):
+        """ Drop the consumed part of the buffer and read more of the file.
+        At least as much as is already buffered is read, so that a long value
+        only needs to be decoded a logarithmic number of times."""
+        self._buf = self._buf[self._pos:]
+        self._pos = 0
+        data = self._tfile.read(max(self._chunk_size, len(self._buf)))
+        self._buf += data
+        self._eof = (data == "")
+
+    def _skip_whitespace(self):
+        """ Skip whitespace, reading more of the file as needed."""
+        while True:
+            while (self._pos < len(self._buf) and
+                    self._buf[self._pos] in " \t\n\r"):
+                self._pos += 1
+            if self._pos < len(self._buf) or self._eof:
+                return
+            self._read_more()
+
+    def _expect(self, chars):
+        """ Check that the next non-whitespace character is one of chars,
+        consume it and return it."""
+        self._skip_whitespace()
+        if self._pos == len(self._buf):
+            raise ValueError("Unexpected end of theme file")
+        char = self._buf[self._pos]
+        if char not in chars:
+            raise ValueError("Expected one of '{}' in theme file at '{}'".format(
+                chars, self._buf[self._pos:self._pos + 20]))
+        self._pos += 1
+        return char
+
+    def _decode(self):
+        """ Decode the next JSON value, reading more of the file until it is
+        complete."""
+        while True:
+            self._skip_whitespace()
+            try:
+                (value, end) = self._decoder.raw_decode(self._buf, self._pos)
+                # A value ending exactly at the end of the buffer may have
+                # been truncated, e.g. a number.
+                if end < len(self._buf) or self._eof:
+                    self._pos = end
+                    return value
+            except ValueError:
+                if self._eof:
+                    raise
+            self._read_more()
+
+    def iter_items(self):
+        """ Yield the (key, value) entries of the top-level object."""
+        self._expect("{")
+        self._skip_whitespace()
+        if self._buf[self._pos:self._pos + 1] == "}":
+            return
+        while True:
+            key = self._decode()
+            if not isinstance(key, str):
+                raise ValueError("Expected a key in theme file")
+            self._expect(":")
+            value = self._decode()
+            yield (key, value)
+            if self._expect(",}") == "}":
+                return
+
 class AlienFXThemeFile(object):
     
     """ Provides facilities to read and write AlienFX theme files. The theme
@@ -48,6 +139,11 @@ class AlienFXThemeFile(object):
     directory is created if it does not exist.
     
     The theme is stored in the "theme" public member as a dict.
+
+    A theme may name a base theme with the "base" keyword and override only
+    some of its states, or some zones of a state, and the speed. Such a
+    theme is flattened when it is loaded: "theme" then holds the complete
+    theme, and saving it writes the complete theme.
     """
     
     # Theme file keywords
@@ -66,24 +162,96 @@ class AlienFXThemeFile(object):
     KW_LOOP = "loop"
     KW_ACTION_TYPE = "type"
     KW_ACTION_COLOURS = "colours"
+    KW_BASE = "base"
+
+    # Maximum length of a chain of base themes
+    MAX_BASE_DEPTH = 16
+
+    # Flattened themes, keyed by the names, sizes and modification times of
+    # the theme files in their chain of base themes, most recently used last
+    FLAT_THEME_CACHE_SIZE = 32
+    _flat_themes = collections.OrderedDict()
     
     # The name of the last applied theme file
     LAST_THEME_FILE = ".last_theme.json"
+
+    # Number of characters read at a time when streaming a theme file
+    STREAM_CHUNK_SIZE = 65536
+
+    # Theme file formats and their filename extensions. When a theme exists
+    # in both formats, the JSON file is used.
+    FORMAT_JSON = "json"
+    FORMAT_BINARY = "binary"
+    THEME_FILE_EXTS = {
+        FORMAT_JSON: ".json",
+        FORMAT_BINARY: ".afx"
+    }
+
+    # The theme store in the themes directory. Themes in the store are used
+    # when there is no theme file of the same name.
+    STORE_FILE = "themes.afxs"
     
-    def __init__(self, controller):
+    def __init__(self, controller, theme_dir=None):
+        """ Create a theme file for the given controller, using the themes
+        in the given directory, or in the user's alienfx configuration
+        directory if None."""
         try:
-            if not "XDG_CONFIG_HOME" in os.environ:
+            if theme_dir is not None:
+                self._theme_dir = theme_dir
+            elif not "XDG_CONFIG_HOME" in os.environ:
                 self._theme_dir = os.path.expanduser("~/.config/alienfx")
             else:
                 self._theme_dir = os.path.join(
-                    os.environ("XDG_CONFIG_HOME"), "alienfx")
+                    os.environ["XDG_CONFIG_HOME"], "alienfx")
             if not os.path.exists(self._theme_dir):
                 os.makedirs(self._theme_dir)
         except Exception as exc:
             logging.error(exc)
+        self._zone_actions = None
         self.theme = {}
         self.theme_name = ""
+        self.theme_format = self.FORMAT_JSON
         self.controller = controller
+
+    @property
+    def theme(self):
+        """ The theme contents, as a dict. """
+        return self._theme
+
+    @theme.setter
+    def theme(self, theme):
+        self._theme = theme
+        self._zone_actions = None
+
+    def _get_zone_actions_index(self):
+        """ Return the index mapping (state, zone) tuples to the actions of
+        the first state item containing the zone, building it if needed. The
+        index is rebuilt when the theme is replaced; changes made directly to
+        the theme dict, other than to the actions themselves, must be followed
+        by a call to invalidate_zone_actions(). """
+        if self._zone_actions is None:
+            index = {}
+            for state in self._theme:
+                items = self._theme[state]
+                if state == self.KW_SPEED or not isinstance(items, list):
+                    continue
+                for item in items:
+                    if (not isinstance(item, dict) or
+                            self.KW_ZONES not in item or
+                            self.KW_LOOP not in item):
+                        continue
+                    for zone in item[self.KW_ZONES]:
+                        try:
+                            index.setdefault((state, zone), item[self.KW_LOOP])
+                        except TypeError:
+                            logging.warning(
+                                "Invalid zone name: {}".format(zone))
+            self._zone_actions = index
+        return self._zone_actions
+
+    def invalidate_zone_actions(self):
+        """ Discard the (state, zone) actions index. """
+        self._zone_actions = None
         
     def delete_theme_from_disk(self):
         """ Delete the currently loaded theme file from disk, and set contents
@@ -93,8 +261,8 @@ class AlienFXThemeFile(object):
                 (self.theme_name == os.path.splitext(self.LAST_THEME_FILE)[0])):
             return
                 
-        theme_file_path = os.path.join(self._theme_dir, 
-            self.theme_name +  ".json")
+        theme_file_path = self._get_theme_file_path(
+            self.theme_name, self.theme_format)
         try:
             if os.path.exists(theme_file_path):
                 os.remove(theme_file_path)
@@ -104,18 +272,67 @@ class AlienFXThemeFile(object):
             logging.error(exc)
         return False
         
+    def migrate(self):
+        """ Update theme contents written for an older version of alienfx,
+        logging a warning for each change. Return the list of changes."""
+        changes = alienfx_themevalidator.migrate(self.theme)
+        self._log_changes(changes)
+        return changes
+
+    def migrate_entry(self, key):
+        """ Update a single top-level entry of the theme contents, as
+        migrate()."""
+        changes = alienfx_themevalidator.migrate_entry(key, self.theme[key])
+        self._log_changes(changes)
+        return changes
+
+    def _log_changes(self, changes):
+        for change in changes:
+            logging.warning("Migrated theme {}: {}".format(
+                self.theme_name or "(unnamed)", change))
+
+    def validate(self):
+        """ Check the theme contents. Return the list of errors found, each
+        with the JSON path of the offending value; the errors are also
+        logged. """
+        errors = alienfx_themevalidator.validate(self.theme)
+        self._log_errors(errors)
+        return errors
+
+    def validate_entry(self, key):
+        """ Check a single top-level entry (a state or the speed) of the
+        theme contents, as validate(). """
+        errors = alienfx_themevalidator.validate_entry(key, self.theme[key])
+        self._log_errors(errors)
+        return errors
+
+    def _log_errors(self, errors):
+        for error in errors:
+            logging.error("Invalid theme {}: {}".format(
+                self.theme_name or "(unnamed)", error))
+
+    def get_index(self):
+        """ Return the AlienFXThemeIndex of the themes directory."""
+        return AlienFXThemeIndex.get(self)
+
+    def get_store_path(self):
+        """ Return the path of the theme store in the themes directory."""
+        return os.path.join(self._theme_dir, self.STORE_FILE)
+
+    def get_store(self):
+        """ Return the AlienFXThemeStore of the themes directory, or None if
+        there is none."""
+        return alienfx_themestore.AlienFXThemeStore.get(self.get_store_path())
+
     def get_themes(self):
         """ Return a list of all theme file names (minus the filename extension)
-        in the themes directory. """
-        theme_dir_files = os.listdir(self._theme_dir)
-        files_and_exts = [os.path.splitext(x) for x in theme_dir_files]
-        theme_names = []
-        for file_ext in files_and_exts:
-            if file_ext[1] == ".json":
-                if file_ext[0] != os.path.splitext(self.LAST_THEME_FILE)[0]:
-                    theme_names.append(file_ext[0])
-        theme_names = sorted(theme_names)
-        return theme_names
+        in the themes directory, together with the names of the themes in the
+        theme store. """
+        themes = self.get_index().get_themes()
+        store = self.get_store()
+        if store is not None:
+            themes = sorted(set(themes).union(store.get_names()))
+        return themes
 
     def set_speed(self, speed):
         """ Set the speed. """
@@ -146,6 +363,9 @@ class AlienFXThemeFile(object):
         if not state in self.theme:
             self.theme[state] = []
         self.theme[state].append(state_item)
+        if self._zone_actions is not None:
+            for zone in zones:
+                self._zone_actions.setdefault((state, zone), actions)
        
     def get_loop_items(self, state_item):
         """ Given a state item, return the loop items it contains. """
@@ -160,17 +380,7 @@ class AlienFXThemeFile(object):
         """
         if self.theme is None:
             return []
-        if state not in self.theme:
-            return []
-        for item in self.theme[state]:
-            if self.KW_ZONES not in item:
-                continue
-            if zone not in item[self.KW_ZONES]:
-                continue
-            if self.KW_LOOP not in item:
-                continue
-            return item[self.KW_LOOP]
-        return []
+        return self._get_zone_actions_index().get((state, zone), [])
         
     @classmethod
     def make_zone_action(cls, type, colours):
@@ -182,14 +392,19 @@ class AlienFXThemeFile(object):
         
     def applied(self):
         """ Notify the theme file that it has been applied on the computer.
-        This will make it save itself to self.LAST_THEME_FILE"""
+        This will make it save itself to self.LAST_THEME_FILE. The file is
+        written in the background; rapid successive applies only write the
+        last theme."""
         last_theme_file = os.path.join(self._theme_dir, self.LAST_THEME_FILE)
-        self._save_to_file(last_theme_file)
+        theme = copy.deepcopy(self.theme)
+        AlienFXWriteBehind.get().submit(
+            last_theme_file, lambda: self._dump_theme(theme, self.FORMAT_JSON))
         
     def load_last_theme(self):
         """ Loads the last theme applied and return True. If no theme was 
         applied previously, then load the default theme and return False."""
         last_theme_file = os.path.join(self._theme_dir, self.LAST_THEME_FILE)
+        AlienFXWriteBehind.get().flush(last_theme_file)
         if os.path.exists(last_theme_file):
             self._load_from_file(last_theme_file)
             return True
@@ -204,52 +419,400 @@ class AlienFXThemeFile(object):
         self._load_from_file(default_themefile)
         self.theme_name = ""
         
+    def _get_theme_file_path(self, theme_name, theme_format=None):
+        """ Return the path of the theme file with the given name. If no
+        format is given, then return the path of the existing file in either
+        format, or of the JSON file if there is none."""
+        if theme_format is None:
+            theme_format = self.FORMAT_JSON
+            for fmt in [self.FORMAT_JSON, self.FORMAT_BINARY]:
+                if os.path.exists(os.path.join(
+                        self._theme_dir, theme_name + self.THEME_FILE_EXTS[fmt])):
+                    theme_format = fmt
+                    break
+        return os.path.join(
+            self._theme_dir, theme_name + self.THEME_FILE_EXTS[theme_format])
+
+    @classmethod
+    def _get_file_format(cls, theme_file_path):
+        """ Return the theme format to use for a file, from its extension."""
+        if theme_file_path.endswith(cls.THEME_FILE_EXTS[cls.FORMAT_BINARY]):
+            return cls.FORMAT_BINARY
+        return cls.FORMAT_JSON
+
+    @classmethod
+    def _parse_theme_data(cls, data):
+        """ Parse the contents of a theme file (bytes) in either format and
+        return a (theme, format) tuple."""
+        if alienfx_themebinary.is_binary_theme(data):
+            return (alienfx_themebinary.loads(data), cls.FORMAT_BINARY)
+        return (json.loads(data.decode("utf-8")), cls.FORMAT_JSON)
+
     def _load_from_file(self, theme_file_path):
-        """ Load a theme from a file."""
+        """ Load a theme from a file. The format of the file is detected from
+        its contents."""
         try:
-            with open(theme_file_path) as tfile:
-                self.theme = json.load(tfile)
+            with open(theme_file_path, "rb") as tfile:
+                data = tfile.read()
+            (self.theme, self.theme_format) = self._parse_theme_data(data)
             theme_name = os.path.splitext(
                 os.path.basename(theme_file_path))[0]
             if theme_name != os.path.splitext(self.LAST_THEME_FILE)[0]:
                 self.theme_name = theme_name
             else:
                 self.theme_name = ""
+            self.migrate()
+            self.validate()
         except Exception as exc:
             logging.error(exc)
             self.theme = {}
             self.theme_name = ""
         
+    def _iter_load_from_file(self, theme_file_path):
+        """ Load a theme from a file one top-level entry at a time. This is a
+        generator: each entry is added to self.theme as soon as it has been
+        parsed, and its key (a state name or "speed") is then yielded.
+        Unlike _load_from_file, errors are logged and then raised, since the
+        caller may already have acted on the entries yielded so far.
+        """
+        self.theme = {}
+        self.theme_name = ""
+        try:
+            with open(theme_file_path, "rb") as tfile:
+                is_binary = alienfx_themebinary.is_binary_theme(
+                    tfile.read(len(alienfx_themebinary.MAGIC)))
+            if is_binary:
+                # Binary themes are small and fast to decode in one go.
+                with open(theme_file_path, "rb") as tfile:
+                    theme = alienfx_themebinary.loads(tfile.read())
+                self.theme_format = self.FORMAT_BINARY
+                for key in theme:
+                    self.theme[key] = theme[key]
+                    self.invalidate_zone_actions()
+                    self.migrate_entry(key)
+                    yield key
+            else:
+                self.theme_format = self.FORMAT_JSON
+                with open(theme_file_path) as tfile:
+                    stream = _AlienFXThemeStream(tfile, self.STREAM_CHUNK_SIZE)
+                    for (key, value) in stream.iter_items():
+                        self.theme[key] = value
+                        self.invalidate_zone_actions()
+                        self.migrate_entry(key)
+                        yield key
+            theme_name = os.path.splitext(
+                os.path.basename(theme_file_path))[0]
+            if theme_name != os.path.splitext(self.LAST_THEME_FILE)[0]:
+                self.theme_name = theme_name
+        except Exception as exc:
+            logging.error(exc)
+            self.theme = {}
+            self.theme_name = ""
+            raise
+
+    @classmethod
+    def _dump_theme(cls, theme, theme_format):
+        """ Return the contents of a theme file (bytes) in the given format
+        for the given theme."""
+        if theme_format == cls.FORMAT_BINARY:
+            return alienfx_themebinary.dumps(theme)
+        return json.dumps(
+            theme, indent=4, separators=(',', ': ')).encode("utf-8")
+
     def _save_to_file(self, theme_file_path):
-        """ Save theme contents to a file."""
+        """ Save theme contents to a file. The format is chosen from the
+        filename extension. The file is replaced atomically, so that it is
+        never left half-written. Invalid themes are not saved. Return the
+        list of errors that prevented saving; it is empty on success."""
+        errors = self.validate()
+        if errors:
+            return errors
         try:
-            with open(theme_file_path, "w") as tfile:
-                json.dump(self.theme, tfile, indent=4, separators=(',', ': '))
+            theme_format = self._get_file_format(theme_file_path)
+            write_file_atomic(
+                theme_file_path, self._dump_theme(self.theme, theme_format))
             theme_name = os.path.splitext(
                 os.path.basename(theme_file_path))[0]
             if theme_name != os.path.splitext(self.LAST_THEME_FILE)[0]:
                 self.theme_name = theme_name
+                self.theme_format = theme_format
         except Exception as exc:
             logging.error(exc)
+            return [str(exc)]
+        return []
             
+    def is_stored_theme(self, theme_name):
+        """ Return True if the theme with the given name is loaded from the
+        theme store, i.e. it is in the store and there is no theme file of
+        that name."""
+        if os.path.exists(self._get_theme_file_path(theme_name)):
+            return False
+        store = self.get_store()
+        return store is not None and theme_name in store
+
+    def load_from_store(self, theme_name):
+        """ Load a theme from the theme store given its name. Return True on
+        success, False otherwise."""
+        try:
+            store = self.get_store()
+            theme = None if store is None else store.get_theme(theme_name)
+        except Exception as exc:
+            logging.error(exc)
+            theme = None
+        if theme is None:
+            self.theme = {}
+            self.theme_name = ""
+            return False
+        self.theme = theme
+        self.theme_name = theme_name
+        self.theme_format = self.FORMAT_BINARY
+        self.migrate()
+        self.validate()
+        return True
+
+    def _read_theme(self, theme_name):
+        """ Return the theme with the given name as stored, i.e. without
+        resolving its base theme. Raise ValueError if there is no such
+        theme."""
+        theme_file_path = self._get_theme_file_path(theme_name)
+        if os.path.exists(theme_file_path):
+            with open(theme_file_path, "rb") as tfile:
+                return self._parse_theme_data(tfile.read())[0]
+        store = self.get_store()
+        if store is not None and theme_name in store:
+            return store.get_theme(theme_name)
+        raise ValueError("Theme {} not found".format(theme_name))
+
+    @classmethod
+    def _merge_themes(cls, base, overlay):
+        """ Return the theme resulting from applying the given overlay theme
+        to the given (flat) base theme. States of the overlay replace those of
+        the base zone by zone: zones of a base state that the overlay does not
+        mention are kept."""
+        theme = {}
+        for key in base:
+            if key != cls.KW_BASE:
+                theme[key] = base[key]
+        for key in overlay:
+            if key == cls.KW_BASE:
+                continue
+            items = overlay[key]
+            if (key == cls.KW_SPEED or key not in theme or
+                    not isinstance(items, list) or
+                    not isinstance(theme[key], list)):
+                theme[key] = items
+                continue
+            overridden = set()
+            for item in items:
+                overridden.update(item.get(cls.KW_ZONES, []))
+            merged = []
+            for item in theme[key]:
+                zones = [
+                    zone for zone in item.get(cls.KW_ZONES, [])
+                    if zone not in overridden]
+                if zones:
+                    item = dict(item)
+                    item[cls.KW_ZONES] = zones
+                    merged.append(item)
+            theme[key] = merged + items
+        return theme
+
+    def _flatten_theme(self, theme, theme_name):
+        """ Return the given theme with its chain of base themes resolved.
+        Raise ValueError if a base theme is missing or the chain is too long
+        or circular."""
+        chain = [(theme_name, theme)]
+        names = set([theme_name])
+        while self.KW_BASE in theme:
+            base_name = theme[self.KW_BASE]
+            if base_name in names or len(chain) > self.MAX_BASE_DEPTH:
+                raise ValueError(
+                    "Circular or too long base theme chain: {}".format(
+                        " -> ".join([name for (name, t) in chain] +
+                            [base_name])))
+            theme = self._read_theme(base_name)
+            chain.append((base_name, theme))
+            names.add(base_name)
+        flat = chain.pop()[1]
+        while chain:
+            flat = self._merge_themes(flat, chain.pop()[1])
+        return flat
+
+    def _get_base_name(self, theme_name, theme_file_path, stat):
+        """ Return the name of the base theme of the named theme, stored in
+        the given theme file with the given stat result, or None if it has
+        none. The base is taken from the theme index, without refreshing it,
+        if the entry matches the file, and read from the file otherwise."""
+        index = self.get_index()
+        entry = index._get_entry(theme_name)
+        if (entry is not None and
+                entry[index.KW_FILE] == os.path.basename(theme_file_path)
+                and entry[index.KW_SIZE] == stat.st_size
+                and entry[index.KW_MTIME] == stat.st_mtime_ns):
+            return entry.get(index.KW_BASE)
+        return self._read_theme(theme_name).get(self.KW_BASE)
+
+    def _get_flat_theme_key(self, theme_name):
+        """ Return the flattened theme cache key of the named theme: the
+        names, sizes and modification times of the theme files in its chain
+        of base themes, so that a file replaced or edited in place gives a
+        new key. Return None if the theme has no base or a theme in the
+        chain is not a file."""
+        key = []
+        while theme_name is not None:
+            if len(key) > self.MAX_BASE_DEPTH:
+                return None
+            theme_file_path = self._get_theme_file_path(theme_name)
+            try:
+                stat = os.stat(theme_file_path)
+            except OSError:
+                return None
+            key.append((theme_name, stat.st_size, stat.st_mtime_ns))
+            try:
+                theme_name = self._get_base_name(
+                    theme_name, theme_file_path, stat)
+            except Exception:
+                return None
+        if len(key) < 2:
+            return None
+        return tuple(key)
+
+    def _resolve_base(self, cache_key=None):
+        """ Flatten the loaded theme if it has a base theme, and store the
+        result in the flattened theme cache under the given key."""
+        if self.KW_BASE not in self.theme:
+            return
+        try:
+            self.theme = self._flatten_theme(self.theme, self.theme_name)
+        except Exception as exc:
+            logging.error("Cannot resolve base theme of {}: {}".format(
+                self.theme_name, exc))
+            self.theme = {}
+            self.theme_name = ""
+            return
+        # The base themes have not been migrated yet.
+        self.migrate()
+        if cache_key is not None:
+            flat_themes = AlienFXThemeFile._flat_themes
+            flat_themes[cache_key] = copy.deepcopy(self.theme)
+            while len(flat_themes) > self.FLAT_THEME_CACHE_SIZE:
+                flat_themes.popitem(last=False)
+
+    def _load_from_cache(self, theme_name, cache_key):
+        """ Load the flattened theme with the given cache key from the cache.
+        Return True on success, False if it is not cached."""
+        flat_themes = AlienFXThemeFile._flat_themes
+        if cache_key not in flat_themes:
+            return False
+        theme = flat_themes.pop(cache_key)
+        flat_themes[cache_key] = theme
+        self.theme = copy.deepcopy(theme)
+        self.theme_name = theme_name
+        self.theme_format = self._get_file_format(
+            self._get_theme_file_path(theme_name))
+        return True
+
     def load(self, theme_name):
-        """ Load a theme given its name. """
-        theme_file = theme_name + ".json"
-        theme_file_path = os.path.join(self._theme_dir, theme_file)
-        self._load_from_file(theme_file_path)
+        """ Load a theme given its name. If it has a base theme, then the
+        flattened theme is loaded. """
+        if self.is_stored_theme(theme_name):
+            self.load_from_store(theme_name)
+            self._resolve_base()
+            return
+        cache_key = self._get_flat_theme_key(theme_name)
+        if cache_key is not None and self._load_from_cache(
+                theme_name, cache_key):
+            return
+        self._load_from_file(self._get_theme_file_path(theme_name))
+        self._resolve_base(cache_key)
         
-    def save(self, theme_name=None):
+    def iter_load(self, theme_name):
+        """ Load a theme given its name, one state at a time. This is a
+        generator that yields the keys of the theme as they are loaded; see
+        _iter_load_from_file. Stored themes and themes with a base theme are
+        loaded in one go before their keys are yielded.
+        """
+        if self.is_stored_theme(theme_name):
+            return self._iter_load_whole(theme_name)
+        theme_file_path = self._get_theme_file_path(theme_name)
+        try:
+            base_name = self._get_base_name(
+                theme_name, theme_file_path, os.stat(theme_file_path))
+        except Exception:
+            # Let the file loader report the error.
+            base_name = None
+        if base_name:
+            return self._iter_load_whole(theme_name)
+        return self._iter_load_from_file(theme_file_path)
+
+    def _iter_load_whole(self, theme_name):
+        """ Load a theme with load(), then yield its keys as iter_load."""
+        self.load(theme_name)
+        if self.theme_name == theme_name:
+            for key in list(self.theme):
+                yield key
+        
+    def save(self, theme_name=None, theme_format=None):
         """ Save the current theme with the given name.
         If the name is not given, then save it to the previously loaded
         theme file. If no such file was loaded previously, then do nothing.
+        If the format is not given, then the format of the previously loaded
+        theme file is used. Return the list of errors that prevented saving,
+        as _save_to_file.
         """
         if theme_name is None:
             if self.theme_name == "":
-                return
-        else:
-            theme_file = theme_name + ".json"
-        theme_file_path = os.path.join(self._theme_dir, theme_file)
-        self._save_to_file(theme_file_path)
+                return ["The theme has no name"]
+            theme_name = self.theme_name
+        if theme_format is None:
+            theme_format = self.theme_format
+        return self._save_to_file(
+            self._get_theme_file_path(theme_name, theme_format))
+
+    def save_themes(self, themes, theme_format=None):
+        """ Save many themes to the themes directory in one pass, with
+        write_files_atomic(). 'themes' is a list of (name, theme dict)
+        tuples. Invalid themes are not saved.
+        The theme currently loaded is not changed. Return the names of the
+        themes saved."""
+        if theme_format is None:
+            theme_format = self.FORMAT_JSON
+        files = []
+        for (theme_name, theme) in themes:
+            errors = alienfx_themevalidator.validate(theme)
+            if errors:
+                for error in errors:
+                    logging.error("Invalid theme {}: {}".format(
+                        theme_name, error))
+                continue
+            files.append((theme_name, self._get_theme_file_path(
+                theme_name, theme_format), self._dump_theme(theme, theme_format)))
+        written = set(write_files_atomic(
+            [(theme_file_path, data) for (n, theme_file_path, data) in files]))
+        return [
+            theme_name for (theme_name, theme_file_path, data) in files
+            if theme_file_path in written]
+
+    def convert(self, theme_name, theme_format):
+        """ Convert the theme with the given name to the given format: load
+        it, save it in that format and remove the file in the other format.
+        Return True on success, False otherwise."""
+        self.load(theme_name)
+        if self.theme_name == "":
+            return False
+        old_theme_file_path = self._get_theme_file_path(
+            theme_name, self.theme_format)
+        new_theme_file_path = self._get_theme_file_path(
+            theme_name, theme_format)
+        if self._save_to_file(new_theme_file_path):
+            return False
+        try:
+            if old_theme_file_path != new_theme_file_path:
+                os.remove(old_theme_file_path)
+        except (IOError, OSError) as exc:
+            logging.error(exc)
+            return False
+        return True
     
     @classmethod
     def get_action_type(cls, action):
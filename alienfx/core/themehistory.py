@@ -0,0 +1,139 @@
+#
+# themehistory.py
+#
+# Copyright (C) 2013-2014 Ashwin Menon <ashwin.menon@gmail.com>
+# Copyright (C) 2015-2024 Track Master Steve <trackmastersteve@gmail.com>
+#
+# Alienfx is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# Alienfx is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with alienfx.    If not, write to:
+# 	The Free Software Foundation, Inc.,
+# 	51 Franklin Street, Fifth Floor
+# 	Boston, MA  02110-1301, USA.
+#
+
+""" Undo/redo history of theme edits.
+
+Edits made through the history never change a theme in place. Instead, an
+edit copies the path from the theme dict down to the changed loop (the theme
+dict, the list of items of the state, the item and its loop) and shares
+everything else with the previous version of the theme. Every version is
+therefore a cheap, unchanging snapshot, and undoing or redoing an edit only
+swaps the theme of the AlienFXThemeFile instance.
+
+This module provides the following classes:
+AlienFXThemeHistory: edits the theme of a theme file, with undo and redo
+"""
+
+from builtins import object
+
+
+class AlienFXThemeHistory(object):
+
+    """ Edits the zone actions of the theme of an AlienFXThemeFile instance,
+    keeping the previous versions of the theme for undo and redo. Themes
+    edited through the history must not be changed in place by other code.
+    """
+
+    # Maximum number of edits that can be undone
+    MAX_UNDO = 10000
+
+    def __init__(self, themefile):
+        self.themefile = themefile
+        self._undo = []
+        self._redo = []
+
+    def reset(self):
+        """ Forget all edits, e.g. after a new theme is loaded."""
+        self._undo = []
+        self._redo = []
+
+    def can_undo(self):
+        return len(self._undo) > 0
+
+    def can_redo(self):
+        return len(self._redo) > 0
+
+    def _copy_path(self, state, zone):
+        """ Return a copy of the theme in which the item holding the given
+        zone in the given state, and its loop, are new objects; everything
+        else is shared with the current theme. Also return that loop. If the
+        zone has no item in the state, then a new item is added for it."""
+        tf = self.themefile
+        theme = dict(tf.theme)
+        items = list(theme.get(state, []))
+        theme[state] = items
+        for (i, item) in enumerate(items):
+            if zone in item.get(tf.KW_ZONES, []):
+                item = dict(item)
+                items[i] = item
+                break
+        else:
+            item = {tf.KW_ZONES: [zone]}
+            items.append(item)
+        loop = list(item.get(tf.KW_LOOP, []))
+        item[tf.KW_LOOP] = loop
+        return (theme, loop)
+
+    def _commit(self, theme, state, zone):
+        """ Make the given theme current, recording the current one for undo."""
+        self._undo.append((self.themefile.theme, state, zone))
+        if len(self._undo) > self.MAX_UNDO:
+            del self._undo[0]
+        self._redo = []
+        self.themefile.theme = theme
+
+    def set_action(self, state, zone, index, action):
+        """ Replace the action at the given index of the loop of a zone."""
+        (theme, loop) = self._copy_path(state, zone)
+        loop[index] = action
+        self._commit(theme, state, zone)
+
+    def insert_action(self, state, zone, index, action):
+        """ Insert an action at the given index of the loop of a zone."""
+        (theme, loop) = self._copy_path(state, zone)
+        loop.insert(index, action)
+        self._commit(theme, state, zone)
+
+    def delete_action(self, state, zone, index):
+        """ Delete the action at the given index of the loop of a zone."""
+        (theme, loop) = self._copy_path(state, zone)
+        del loop[index]
+        self._commit(theme, state, zone)
+
+    def set_zone_actions(self, state, zone, actions):
+        """ Replace the loop of a zone with the given actions."""
+        (theme, loop) = self._copy_path(state, zone)
+        loop[:] = actions
+        self._commit(theme, state, zone)
+
+    def undo(self):
+        """ Undo the last edit. Return the (state, zone) it changed, or None
+        if there is nothing to undo."""
+        if not self._undo:
+            return None
+        (theme, state, zone) = self._undo.pop()
+        self._redo.append((self.themefile.theme, state, zone))
+        self.themefile.theme = theme
+        return (state, zone)
+
+    def redo(self):
+        """ Redo the last undone edit. Return the (state, zone) it changed,
+        or None if there is nothing to redo."""
+        if not self._redo:
+            return None
+        (theme, state, zone) = self._redo.pop()
+        self._undo.append((self.themefile.theme, state, zone))
+        self.themefile.theme = theme
+        return (state, zone)
@@ -0,0 +1,328 @@
+#
+# themeindex.py
+#
+# Copyright (C) 2013-2014 Ashwin Menon <ashwin.menon@gmail.com>
+# Copyright (C) 2015-2024 Track Master Steve <trackmastersteve@gmail.com>
+#
+# Alienfx is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# Alienfx is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with alienfx.    If not, write to:
+# 	The Free Software Foundation, Inc.,
+# 	51 Franklin Street, Fifth Floor
+# 	Boston, MA  02110-1301, USA.
+#
+
+""" Index of the theme files in the theme directory.
+
+The index is stored in the theme directory and holds, for every theme file,
+its size, modification time, content hash and summary metadata: its base
+theme, the zones and states it uses and an estimate of its packet count per
+controller model. The zones, states and packet counts of a theme with a base
+theme are those of the flattened theme when the entry was made. Files that
+cannot be parsed keep an entry holding the error and no metadata, so that
+they are still listed.
+
+The directory is only scanned again when its modification time changes,
+which happens whenever a theme file is added, removed or replaced
+(AlienFXThemeFile saves files by renaming a temporary file over them), so
+that listing themes costs a single stat. A scan checks the size and
+modification time of each theme file, and only reads again the files where
+they changed. A theme file edited in place by another program does not
+change the directory; it is picked up by refresh(force=True). Loading a
+theme does not rely on the index being fresh: AlienFXThemeFile checks the
+entries it uses against the theme files themselves.
+
+This module provides the following classes:
+AlienFXThemeIndex: index of the theme files in a theme directory
+"""
+
+from builtins import object
+import hashlib
+import json
+import logging
+import os
+import os.path
+
+from alienfx.common import write_file_atomic
+
+
+class AlienFXThemeIndex(object):
+
+    """ Index of the theme files in the directory of an AlienFXThemeFile
+    instance. Use AlienFXThemeIndex.get() to share one index per directory.
+    """
+
+    INDEX_FILE = ".theme_index.json"
+    INDEX_VERSION = 4
+
+    # Entry keys
+    KW_FILE = "file"
+    KW_SIZE = "size"
+    KW_MTIME = "mtime"
+    KW_HASH = "hash"
+    KW_ZONES = "zones"
+    KW_STATES = "states"
+    KW_PACKETS = "packets"
+    KW_BASE = "base"
+    KW_ERROR = "error"
+
+    # Shared indexes, by theme directory
+    _indexes = {}
+
+    @classmethod
+    def get(cls, themefile):
+        """ Return the index of the theme directory of the given
+        AlienFXThemeFile instance, creating it if needed."""
+        theme_dir = themefile._theme_dir
+        if theme_dir not in cls._indexes:
+            cls._indexes[theme_dir] = cls(themefile)
+        index = cls._indexes[theme_dir]
+        index.controller = themefile.controller
+        return index
+
+    def __init__(self, themefile):
+        self._themefile_class = type(themefile)
+        self._theme_dir = themefile._theme_dir
+        self._index_path = os.path.join(self._theme_dir, self.INDEX_FILE)
+        self.controller = themefile.controller
+        self._dir_mtime = None
+        self._entries = {}
+        self._theme_names = []
+        # Controller models for which every entry has a packet estimate
+        self._estimated_for = set()
+        self._load()
+
+    def _load(self):
+        """ Load the index file, if there is a valid one."""
+        try:
+            if not os.path.exists(self._index_path):
+                return
+            with open(self._index_path) as ifile:
+                index = json.load(ifile)
+            if index.get("version") != self.INDEX_VERSION:
+                return
+            self._dir_mtime = index["dir_mtime"]
+            self._entries = index["entries"]
+            self._update_theme_names()
+        except Exception as exc:
+            logging.error("Ignoring theme index: {}".format(exc))
+            self._dir_mtime = None
+            self._entries = {}
+
+    def _save(self):
+        """ Save the index file."""
+        index = {
+            "version": self.INDEX_VERSION,
+            "dir_mtime": self._dir_mtime,
+            "entries": self._entries
+        }
+        try:
+            write_file_atomic(
+                self._index_path,
+                json.dumps(index, separators=(',', ':')).encode("utf-8"))
+            # Replacing the index file changes the directory mtime, so read
+            # it again.
+            self._dir_mtime = os.stat(self._theme_dir).st_mtime_ns
+        except Exception as exc:
+            logging.error(exc)
+
+    def _get_controller_name(self):
+        return getattr(self.controller, "name", None)
+
+    def _is_theme_file(self, filename):
+        """ Return True if the given file name is a theme file. Hidden files,
+        such as the last applied theme and the index, are not themes."""
+        if filename.startswith("."):
+            return False
+        ext = os.path.splitext(filename)[1]
+        return ext in self._themefile_class.THEME_FILE_EXTS.values()
+
+    def _make_themefile(self, filename, theme):
+        """ Return a theme file instance holding the given theme, read from
+        the given file, migrated and with its base theme resolved."""
+        themefile = self._themefile_class(self.controller, self._theme_dir)
+        themefile.theme = theme
+        themefile.theme_name = os.path.splitext(filename)[0]
+        themefile.migrate()
+        themefile._resolve_base()
+        return themefile
+
+    def _summarise(self, data, entry):
+        """ Fill in the summary metadata of an entry from the file data."""
+        theme = self._themefile_class._parse_theme_data(data)[0]
+        entry[self.KW_BASE] = theme.get(self._themefile_class.KW_BASE)
+        themefile = self._make_themefile(entry[self.KW_FILE], theme)
+        zones = set()
+        states = []
+        for key in themefile.theme:
+            if key == themefile.KW_SPEED:
+                continue
+            states.append(key)
+            for item in themefile.get_state_items(key):
+                if isinstance(item, dict):
+                    zones.update(item.get(themefile.KW_ZONES, []))
+        entry[self.KW_ZONES] = sorted(zones)
+        entry[self.KW_STATES] = states
+        entry[self.KW_PACKETS] = {}
+        self._estimate(themefile, entry)
+
+    def _estimate(self, themefile, entry):
+        """ Add the packet estimate for the current controller to an entry.
+        The estimate is None if the theme cannot be compiled."""
+        controller_name = self._get_controller_name()
+        if controller_name is None:
+            return
+        try:
+            estimate = self.controller.estimate_theme(themefile)
+            entry[self.KW_PACKETS][controller_name] = estimate.total_packets
+        except Exception as exc:
+            entry[self.KW_PACKETS][controller_name] = None
+            logging.error("Cannot estimate theme {}: {}".format(
+                entry[self.KW_FILE], exc))
+
+    def _update_entry(self, filename, stat, entry):
+        """ Return an up to date entry for the given theme file, reusing the
+        given previous entry (which may be None) where possible."""
+        if (entry is not None and entry[self.KW_SIZE] == stat.st_size and
+                entry[self.KW_MTIME] == stat.st_mtime_ns):
+            return entry
+        theme_file_path = os.path.join(self._theme_dir, filename)
+        with open(theme_file_path, "rb") as tfile:
+            data = tfile.read()
+        content_hash = hashlib.sha1(data).hexdigest()
+        if entry is None or entry[self.KW_HASH] != content_hash:
+            entry = {self.KW_FILE: filename, self.KW_HASH: content_hash}
+            try:
+                self._summarise(data, entry)
+            except Exception as exc:
+                logging.error("Cannot index {}: {}".format(filename, exc))
+                entry.update({
+                    self.KW_BASE: None,
+                    self.KW_ZONES: [],
+                    self.KW_STATES: [],
+                    self.KW_PACKETS: {},
+                    self.KW_ERROR: str(exc)
+                })
+        entry[self.KW_SIZE] = stat.st_size
+        entry[self.KW_MTIME] = stat.st_mtime_ns
+        return entry
+
+    def _update_theme_names(self):
+        names = set(os.path.splitext(f)[0] for f in self._entries)
+        self._theme_names = sorted(names)
+
+    def refresh(self, force=False):
+        """ Bring the index up to date with the theme directory. Unless
+        'force' is True, nothing is done if the directory has not changed
+        since the last scan. A scan reads again the theme files whose size or
+        modification time changed, or every file if 'force' is True. The index
+        file is saved only if an entry changed."""
+        try:
+            dir_mtime = os.stat(self._theme_dir).st_mtime_ns
+        except OSError as exc:
+            logging.error(exc)
+            return
+        controller_name = self._get_controller_name()
+        if not force and dir_mtime == self._dir_mtime:
+            if (controller_name is None or
+                    controller_name in self._estimated_for):
+                return
+        entries = {}
+        changed = False
+        try:
+            dir_entries = list(os.scandir(self._theme_dir))
+        except OSError as exc:
+            logging.error(exc)
+            return
+        for dir_entry in dir_entries:
+            if not self._is_theme_file(dir_entry.name):
+                continue
+            try:
+                previous = None if force else self._entries.get(dir_entry.name)
+                entry = self._update_entry(
+                    dir_entry.name, dir_entry.stat(), previous)
+                if entry is not previous:
+                    changed = True
+                if (controller_name is not None and
+                        self.KW_ERROR not in entry and
+                        controller_name not in entry[self.KW_PACKETS]):
+                    # The file is unchanged but was indexed for another
+                    # controller model.
+                    with open(dir_entry.path, "rb") as tfile:
+                        theme = self._themefile_class._parse_theme_data(
+                            tfile.read())[0]
+                    self._estimate(
+                        self._make_themefile(dir_entry.name, theme), entry)
+                    changed = True
+                entries[dir_entry.name] = entry
+            except Exception as exc:
+                logging.error("Cannot index {}: {}".format(dir_entry.name, exc))
+        if set(entries) != set(self._entries):
+            changed = True
+        self._entries = entries
+        self._estimated_for = set([controller_name])
+        if changed or dir_mtime != self._dir_mtime:
+            self._dir_mtime = dir_mtime
+            self._update_theme_names()
+            self._save()
+
+    def get_themes(self):
+        """ Return the sorted names of all themes in the theme directory."""
+        self.refresh()
+        return list(self._theme_names)
+
+    def get_entry(self, theme_name):
+        """ Return the index entry of the theme with the given name, or None
+        if there is no such theme. JSON files take precedence over binary
+        files, as when loading themes. The entry of a file that cannot be
+        parsed has the error under KW_ERROR."""
+        self.refresh()
+        return self._get_entry(theme_name)
+
+    def _get_entry(self, theme_name):
+        """ Return the index entry of the theme with the given name as
+        get_entry(), without refreshing the index first. The entry may be
+        out of date; callers compare its size and modification time with
+        those of the file."""
+        for theme_format in [
+                self._themefile_class.FORMAT_JSON,
+                self._themefile_class.FORMAT_BINARY]:
+            filename = (
+                theme_name + self._themefile_class.THEME_FILE_EXTS[theme_format])
+            if filename in self._entries:
+                return self._entries[filename]
+        return None
+
+    def search(self, text=None, zone=None, state=None, max_packets=None):
+        """ Return the sorted names of the themes matching all given
+        criteria: the name contains 'text' (case insensitive), the theme uses
+        'zone' and 'state', and its packet estimate for the current
+        controller is at most 'max_packets'."""
+        self.refresh()
+        controller_name = self._get_controller_name()
+        names = []
+        for theme_name in self._theme_names:
+            if text is not None and text.lower() not in theme_name.lower():
+                continue
+            entry = self._get_entry(theme_name)
+            if zone is not None and zone not in entry[self.KW_ZONES]:
+                continue
+            if state is not None and state not in entry[self.KW_STATES]:
+                continue
+            if max_packets is not None:
+                packets = entry[self.KW_PACKETS].get(controller_name)
+                if packets is None or packets > max_packets:
+                    continue
+            names.append(theme_name)
+        return names
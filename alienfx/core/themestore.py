@@ -0,0 +1,274 @@
+#
+# themestore.py
+#
+# Copyright (C) 2013-2014 Ashwin Menon <ashwin.menon@gmail.com>
+# Copyright (C) 2015-2024 Track Master Steve <trackmastersteve@gmail.com>
+#
+# Alienfx is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# Alienfx is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with alienfx.    If not, write to:
+# 	The Free Software Foundation, Inc.,
+# 	51 Franklin Street, Fifth Floor
+# 	Boston, MA  02110-1301, USA.
+#
+
+""" Memory-mapped store holding many themes in a single file.
+
+Every theme is stored in the binary theme format, optionally together with
+its compiled command packets for one or more controller models. Themes are
+migrated and validated when the store is written, and invalid themes are left
+out, so that stored themes can be applied without checking them again. The
+file is memory-mapped and an offset index is read when it is opened, so that
+fetching a theme only touches the bytes of that theme. All integers are
+big-endian:
+
+    header:   "AFXS", version (u8), index offset (u64)
+    records:  binary themes and compiled themes, back to back
+    index:    entry count (u32), then for each entry:
+                name length (u16), utf-8 name,
+                theme offset (u64), theme length (u32),
+                compiled count (u16), then for each compiled theme:
+                  model name length (u16), utf-8 model name,
+                  offset (u64), length (u32)
+
+This module provides the following classes:
+AlienFXThemeStore: read and write access to a theme store file
+"""
+
+from builtins import object
+import copy
+import logging
+import mmap
+import os
+import struct
+
+from alienfx.common import write_file_atomic
+import alienfx.core.themebinary as alienfx_themebinary
+import alienfx.core.compiler as alienfx_compiler
+import alienfx.core.themevalidator as alienfx_themevalidator
+
+_HEADER = struct.Struct(">4sBQ")
+_U16 = struct.Struct(">H")
+_U32 = struct.Struct(">I")
+_SLICE = struct.Struct(">QI")
+
+
+class AlienFXThemeStore(object):
+
+    """ A theme store file. Themes are looked up by name; the returned data
+    is read directly from the memory-mapped file.
+    """
+
+    MAGIC = b"AFXS"
+    # Version 1 stores may hold themes that were not validated.
+    VERSION = 2
+
+    # Open stores, by path: path -> (modification time, store)
+    _stores = {}
+
+    @classmethod
+    def get(cls, path):
+        """ Return the open store at the given path, opening it again if the
+        file has been replaced since it was opened. Return None if there is
+        no store file."""
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            cls._stores.pop(path, None)
+            return None
+        if path in cls._stores:
+            (store_mtime, store) = cls._stores[path]
+            if store_mtime == mtime:
+                return store
+        store = cls(path)
+        cls._stores[path] = (mtime, store)
+        return store
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._mmap = None
+        self._view = None
+        # name -> ((offset, length), {model name: (offset, length)})
+        self._entries = {}
+        self._open()
+
+    def _open(self):
+        """ Map the store file and read its index. A missing or invalid
+        file results in an empty store."""
+        try:
+            self._file = open(self.path, "rb")
+        except (IOError, OSError):
+            return
+        try:
+            self._mmap = mmap.mmap(
+                self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._view = memoryview(self._mmap)
+            (magic, version, index_offset) = _HEADER.unpack_from(self._view, 0)
+            if magic != self.MAGIC or version != self.VERSION:
+                raise ValueError("Not a theme store file")
+            self._read_index(index_offset)
+        except Exception as exc:
+            logging.error("Cannot open theme store {}: {}".format(
+                self.path, exc))
+            self.close()
+
+    def _read_string(self, pos):
+        (length,) = _U16.unpack_from(self._view, pos)
+        pos += _U16.size
+        return (bytes(self._view[pos:pos + length]).decode("utf-8"),
+            pos + length)
+
+    def _read_index(self, pos):
+        (count,) = _U32.unpack_from(self._view, pos)
+        pos += _U32.size
+        for i in range(count):
+            (name, pos) = self._read_string(pos)
+            theme_slice = _SLICE.unpack_from(self._view, pos)
+            pos += _SLICE.size
+            (num_compiled,) = _U16.unpack_from(self._view, pos)
+            pos += _U16.size
+            compiled = {}
+            for j in range(num_compiled):
+                (model, pos) = self._read_string(pos)
+                compiled[model] = _SLICE.unpack_from(self._view, pos)
+                pos += _SLICE.size
+            self._entries[name] = (theme_slice, compiled)
+
+    def close(self):
+        """ Unmap and close the store file. Theme data returned by
+        get_theme_data() must no longer be in use."""
+        try:
+            if self._view is not None:
+                self._view.release()
+                self._view = None
+            if self._mmap is not None:
+                self._mmap.close()
+                self._mmap = None
+        except BufferError as exc:
+            logging.warning("Theme store {} still in use: {}".format(
+                self.path, exc))
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._entries = {}
+
+    def get_names(self):
+        """ Return the sorted names of the themes in the store."""
+        return sorted(self._entries)
+
+    def __contains__(self, name):
+        return name in self._entries
+
+    def _get_slice(self, offset_length):
+        (offset, length) = offset_length
+        return self._view[offset:offset + length]
+
+    def get_theme_data(self, name):
+        """ Return the binary theme data of the named theme as a memoryview
+        of the mapped file, or None if there is no such theme."""
+        if name not in self._entries:
+            return None
+        return self._get_slice(self._entries[name][0])
+
+    def get_theme(self, name):
+        """ Return the named theme as a dict, or None if there is no such
+        theme."""
+        data = self.get_theme_data(name)
+        if data is None:
+            return None
+        return alienfx_themebinary.loads(data)
+
+    def get_compiled_theme(self, name, controller):
+        """ Return the named theme compiled for the given controller (an
+        AlienFXCompiledTheme instance), or None if the store does not hold
+        it."""
+        if name not in self._entries:
+            return None
+        compiled = self._entries[name][1]
+        if controller.name not in compiled:
+            return None
+        return alienfx_compiler.AlienFXCompiledTheme.from_bytes(
+            self._get_slice(compiled[controller.name]))
+
+    def apply(self, name, controller, themefile):
+        """ Send the named theme to the controller. If the store holds its
+        compiled packets for this controller, they are sent as they are, and
+        the theme itself is not even decoded; it was validated when the store
+        was written. Otherwise the theme is loaded into the given
+        AlienFXThemeFile instance and compiled. Return True if the theme was
+        found and sent, False otherwise."""
+        if name not in self._entries:
+            return False
+        compiled_theme = self.get_compiled_theme(name, controller)
+        if compiled_theme is not None:
+            return controller.set_compiled_theme(compiled_theme)
+        themefile.theme = self.get_theme(name)
+        themefile.theme_name = name
+        themefile.theme_format = themefile.FORMAT_BINARY
+        return controller.set_theme(themefile)
+
+    @classmethod
+    def write(cls, path, themes, controllers=()):
+        """ Write a store file holding the given themes, a list of (name,
+        theme dict) tuples. Every theme is migrated and validated, and also
+        compiled for each of the given controllers; invalid themes are logged
+        and left out. Return the names of the themes stored."""
+        from alienfx.core.themefile import AlienFXThemeFile
+        chunks = [_HEADER.pack(cls.MAGIC, cls.VERSION, 0)]
+        offset = _HEADER.size
+        index = []
+        scratch = [(c, AlienFXThemeFile(c)) for c in controllers]
+        for (name, theme) in themes:
+            theme = copy.deepcopy(theme)
+            for change in alienfx_themevalidator.migrate(theme):
+                logging.warning("Migrated theme {}: {}".format(name, change))
+            errors = alienfx_themevalidator.validate(theme)
+            if errors:
+                for error in errors:
+                    logging.error("Invalid theme {}: {}".format(name, error))
+                logging.error("Not storing theme {}: {} error{} found".format(
+                    name, len(errors), "" if len(errors) == 1 else "s"))
+                continue
+            data = alienfx_themebinary.dumps(theme)
+            theme_slice = (offset, len(data))
+            chunks.append(data)
+            offset += len(data)
+            compiled = []
+            for (controller, themefile) in scratch:
+                themefile.theme = theme
+                data = controller.compiler.compile(themefile).to_bytes()
+                compiled.append((controller.name, (offset, len(data))))
+                chunks.append(data)
+                offset += len(data)
+            index.append((name, theme_slice, compiled))
+
+        index_offset = offset
+        chunks.append(_U32.pack(len(index)))
+        for (name, theme_slice, compiled) in index:
+            cls._pack_string(name, chunks)
+            chunks.append(_SLICE.pack(*theme_slice))
+            chunks.append(_U16.pack(len(compiled)))
+            for (model, compiled_slice) in compiled:
+                cls._pack_string(model, chunks)
+                chunks.append(_SLICE.pack(*compiled_slice))
+        chunks[0] = _HEADER.pack(cls.MAGIC, cls.VERSION, index_offset)
+        write_file_atomic(path, b"".join(chunks))
+        return [name for (name, theme_slice, compiled) in index]
+
+    @staticmethod
+    def _pack_string(string, chunks):
+        encoded = string.encode("utf-8")
+        chunks.append(_U16.pack(len(encoded)))
+        chunks.append(encoded)
@@ -0,0 +1,247 @@
+#
+# themevalidator.py
+#
+# Copyright (C) 2013-2014 Ashwin Menon <ashwin.menon@gmail.com>
+# Copyright (C) 2015-2024 Track Master Steve <trackmastersteve@gmail.com>
+#
+# Alienfx is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# Alienfx is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with alienfx.    If not, write to:
+# 	The Free Software Foundation, Inc.,
+# 	51 Franklin Street, Fifth Floor
+# 	Boston, MA  02110-1301, USA.
+#
+
+""" Validation of AlienFX themes.
+
+The structure of a theme is described by a schema made of small check
+functions, which is put together once when this module is imported.
+Validating a theme runs these checks and returns every error found, each
+prefixed with the JSON path of the offending value, e.g.
+
+    $["AC Sleep"][0].loop[1].colours: blink needs 1 colour, found 2
+
+Keys of state items and actions that the compiler does not use are
+allowed. Whether zone and state names are supported is left to the
+controller, since a theme may be shared by several models.
+
+Themes written for older versions of alienfx may have actions with the
+wrong number of colours for their type, such as two-colour blinks. Older
+versions skipped such actions without sending anything for them. Migrating
+a theme drops them, so that such themes keep validating and show the same
+lights as before.
+
+This module provides the following functions:
+validate: return the errors of a theme
+validate_entry: return the errors of a single top-level theme entry
+migrate: update a theme written for an older version of alienfx
+migrate_entry: update a single top-level theme entry
+"""
+
+import re
+
+# Theme keywords. These must match the theme file keywords of
+# AlienFXThemeFile.
+KW_SPEED = "speed"
+KW_ZONES = "zones"
+KW_LOOP = "loop"
+KW_ACTION_TYPE = "type"
+KW_ACTION_COLOURS = "colours"
+KW_BASE = "base"
+
+# Number of colours of each action type
+ACTION_COLOUR_COUNTS = {"fixed": 1, "blink": 1, "morph": 2}
+
+MAX_SPEED = 0xffff
+MAX_COLOUR = 0xf
+
+_IDENTIFIER = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+def _key_path(path, key):
+    if _IDENTIFIER.match(key):
+        return "{}.{}".format(path, key)
+    return '{}["{}"]'.format(path, key.replace('"', '\\"'))
+
+
+def _type_name(value):
+    if isinstance(value, bool):
+        return "boolean"
+    if isinstance(value, int):
+        return "integer"
+    if isinstance(value, list):
+        return "list"
+    if isinstance(value, dict):
+        return "object"
+    if isinstance(value, str):
+        return "string"
+    if value is None:
+        return "null"
+    return type(value).__name__
+
+
+def _integer(minimum, maximum):
+    def check(value, path, errors):
+        if isinstance(value, bool) or not isinstance(value, int):
+            errors.append("{}: expected an integer, found {}".format(
+                path, _type_name(value)))
+        elif not minimum <= value <= maximum:
+            errors.append("{}: {} is out of range {}-{}".format(
+                path, value, minimum, maximum))
+    return check
+
+
+def _string():
+    def check(value, path, errors):
+        if not isinstance(value, str):
+            errors.append("{}: expected a string, found {}".format(
+                path, _type_name(value)))
+    return check
+
+
+def _one_of(values):
+    def check(value, path, errors):
+        if value not in values:
+            errors.append("{}: expected one of {}, found {!r}".format(
+                path, ", ".join(sorted(values)), value))
+    return check
+
+
+def _list_of(item_check, length=None):
+    def check(value, path, errors):
+        if not isinstance(value, list):
+            errors.append("{}: expected a list, found {}".format(
+                path, _type_name(value)))
+            return
+        if length is not None and len(value) != length:
+            errors.append("{}: expected {} items, found {}".format(
+                path, length, len(value)))
+            return
+        for (i, item) in enumerate(value):
+            item_check(item, "{}[{}]".format(path, i), errors)
+    return check
+
+
+def _object(fields, extra_check=None):
+    """ Check an object that must have all the given fields. extra_check is
+    run only if the fields themselves are valid."""
+    def check(value, path, errors):
+        if not isinstance(value, dict):
+            errors.append("{}: expected an object, found {}".format(
+                path, _type_name(value)))
+            return
+        num_errors = len(errors)
+        for (key, field_check) in fields:
+            if key not in value:
+                errors.append("{}: missing key \"{}\"".format(path, key))
+            else:
+                field_check(value[key], _key_path(path, key), errors)
+        if extra_check is not None and len(errors) == num_errors:
+            extra_check(value, path, errors)
+    return check
+
+
+def _check_colour_count(action, path, errors):
+    action_type = action[KW_ACTION_TYPE]
+    num_colours = len(action[KW_ACTION_COLOURS])
+    if num_colours != ACTION_COLOUR_COUNTS[action_type]:
+        errors.append("{}: {} needs {} colour{}, found {}".format(
+            _key_path(path, KW_ACTION_COLOURS), action_type,
+            ACTION_COLOUR_COUNTS[action_type],
+            "" if ACTION_COLOUR_COUNTS[action_type] == 1 else "s",
+            num_colours))
+
+
+# The theme schema
+_check_speed = _integer(0, MAX_SPEED)
+_check_base = _string()
+_check_colour = _list_of(_integer(0, MAX_COLOUR), length=3)
+_check_action = _object([
+    (KW_ACTION_TYPE, _one_of(set(ACTION_COLOUR_COUNTS))),
+    (KW_ACTION_COLOURS, _list_of(_check_colour))
+], extra_check=_check_colour_count)
+_check_state_item = _object([
+    (KW_ZONES, _list_of(_string())),
+    (KW_LOOP, _list_of(_check_action))
+])
+_check_state = _list_of(_check_state_item)
+
+
+def migrate_entry(key, value):
+    """ Update the top-level theme entry with the given key and value in
+    place: actions with the wrong number of colours for their type are
+    dropped, as older versions of alienfx skipped them when compiling.
+    Return the list of changes made, each prefixed with the JSON path of the
+    dropped action as errors are. Invalid parts of the entry are left for
+    validation to report."""
+    changes = []
+    if key in (KW_SPEED, KW_BASE) or not isinstance(value, list):
+        return changes
+    path = _key_path("$", key)
+    for (i, item) in enumerate(value):
+        if not isinstance(item, dict) or not isinstance(item.get(KW_LOOP), list):
+            continue
+        actions = []
+        for (j, action) in enumerate(item[KW_LOOP]):
+            if isinstance(action, dict):
+                num_colours = ACTION_COLOUR_COUNTS.get(
+                    action.get(KW_ACTION_TYPE))
+                colours = action.get(KW_ACTION_COLOURS)
+                if (num_colours is not None and isinstance(colours, list) and
+                        len(colours) != num_colours):
+                    changes.append(
+                        "{}[{}].{}[{}]: dropped {} action with {} colour{}, "
+                        "which was never sent".format(
+                            path, i, KW_LOOP, j, action[KW_ACTION_TYPE],
+                            len(colours), "" if len(colours) == 1 else "s"))
+                    continue
+            actions.append(action)
+        if len(actions) != len(item[KW_LOOP]):
+            item[KW_LOOP] = actions
+    return changes
+
+
+def migrate(theme):
+    """ Update the given theme dict in place, as migrate_entry(). Return the
+    list of changes made."""
+    changes = []
+    if isinstance(theme, dict):
+        for key in theme:
+            changes.extend(migrate_entry(key, theme[key]))
+    return changes
+
+
+def validate_entry(key, value):
+    """ Return the list of errors of the top-level theme entry with the given
+    key (a state name, "speed" or "base") and value."""
+    errors = []
+    path = _key_path("$", key)
+    if key == KW_SPEED:
+        _check_speed(value, path, errors)
+    elif key == KW_BASE:
+        _check_base(value, path, errors)
+    else:
+        _check_state(value, path, errors)
+    return errors
+
+
+def validate(theme):
+    """ Return the list of errors of the given theme dict; the list is empty
+    if the theme is valid."""
+    if not isinstance(theme, dict):
+        return ["$: expected an object, found {}".format(_type_name(theme))]
+    errors = []
+    for key in theme:
+        errors.extend(validate_entry(key, theme[key]))
+    return errors
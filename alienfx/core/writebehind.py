@@ -0,0 +1,114 @@
+#
+# writebehind.py
+#
+# Copyright (C) 2013-2014 Ashwin Menon <ashwin.menon@gmail.com>
+# Copyright (C) 2015-2024 Track Master Steve <trackmastersteve@gmail.com>
+#
+# Alienfx is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# Alienfx is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with alienfx.    If not, write to:
+# 	The Free Software Foundation, Inc.,
+# 	51 Franklin Street, Fifth Floor
+# 	Boston, MA  02110-1301, USA.
+#
+
+""" Background file writer.
+
+Files submitted for writing are written by a background thread, so that the
+caller does not wait for serialisation and disk I/O. Successive submissions
+for the same file that have not been written yet are coalesced: only the
+latest contents are written. Pending writes are flushed when the program
+exits.
+
+This module provides the following classes:
+AlienFXWriteBehind: background writer with per-file coalescing
+"""
+
+from builtins import object
+import atexit
+import logging
+import threading
+
+from alienfx.common import write_file_atomic
+
+
+class AlienFXWriteBehind(object):
+
+    """ Writes files in a background thread. Use AlienFXWriteBehind.get() to
+    get the shared instance.
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get(cls):
+        """ Return the shared writer, creating it if needed."""
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+                atexit.register(cls._instance.flush)
+            return cls._instance
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        # Pending writes: path -> callable returning the data to write. A
+        # dict keeps the submission order of the first pending write of
+        # each path.
+        self._pending = {}
+        self._writing = None
+        self._thread = threading.Thread(
+            target=self._run, name="alienfx-write-behind")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, path, make_data):
+        """ Schedule a write of the file at path. make_data is called in the
+        background thread and must return the data to write, as bytes; it
+        must only use values that the caller will not modify afterwards. A
+        pending write of the same path is replaced."""
+        with self._cond:
+            self._pending[path] = make_data
+            self._cond.notify_all()
+
+    def flush(self, path=None):
+        """ Wait until all pending writes (or only those of the given path)
+        have been written."""
+        with self._cond:
+            while self._is_busy(path):
+                self._cond.wait()
+
+    def _is_busy(self, path):
+        """ Return True if a write of the given path (or of any path, if path
+        is None) is pending or in progress. Must be called with the lock
+        held."""
+        if path is None:
+            return bool(self._pending) or self._writing is not None
+        return path in self._pending or self._writing == path
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                path = next(iter(self._pending))
+                make_data = self._pending.pop(path)
+                self._writing = path
+            try:
+                write_file_atomic(path, make_data())
+            except Exception as exc:
+                logging.error("Cannot write {}: {}".format(path, exc))
+            with self._cond:
+                self._writing = None
+                self._cond.notify_all()
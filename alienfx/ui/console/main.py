@@ -31,9 +31,18 @@ import logging
 import pkg_resources
 import alienfx.common
 from alienfx.core.prober import AlienFXProber
+from alienfx.core.controller import AlienFXController
 import alienfx.core.themefile as alienfx_themefile
+import alienfx.core.bulkcompile as alienfx_bulkcompile
+from alienfx.core.themestore import AlienFXThemeStore
+from alienfx.core.scheduler import AlienFXScheduler
+from alienfx.core.powermonitor import AlienFXPowerMonitor
+from alienfx.core.metriceffect import AlienFXMetricEffect
+from alienfx.core.audioeffect import AlienFXAudioEffect
+from alienfx.core.previewrenderer import AlienFXPreviewRenderer
 import alienfx.core.logger as alienfx_logger
 import alienfx.core.zonescanner as alienfx_zonescanner
+import os.path
 import sys
 
 
@@ -64,13 +73,285 @@ def doZonescan():
     zonescan.scan()
 
 
+def get_controller_by_name(name):
+    """ Return the supported controller with the given model name (case
+    insensitive), or None if there is no such controller."""
+    for controller in AlienFXController.supported_controllers:
+        if controller.name.lower() == name.lower():
+            return controller
+    return None
+
+
+def make_argparser():
+    """ Return the argument parser of the alienfx cli."""
+    argparser = argparse.ArgumentParser(
+        description="""AlienFX is a utility to control the lighting effects 
+            of your Alienware computer. 
+            Lighting effect configurations are stored in theme files."""
+    )
+    argparser.add_argument(
+        "-l", "--log", help="write detailed logging information to LOG"
+    )
+    argparser.add_argument(
+        "-t", "--theme",
+        help="set the lighting theme to THEME."
+    )
+    argparser.add_argument(
+        "-s", "--list", action="store_const", const=1, 
+        help="list all available lighting themes"
+    )
+    argparser.add_argument(
+        "-v", "--version", action="version", 
+        version="%(prog)s {}".format(alienfx.common.get_version())
+    )
+    argparser.add_argument(
+        "-z", "--zonescan", action="store_true", help="starts a zonescan"
+    )
+    argparser.add_argument(
+        "-n", "--dry-run", action="store_true",
+        help="""compile THEME and report its packet counts, size and estimated
+            wire time instead of sending it to the controller"""
+    )
+    argparser.add_argument(
+        "-m", "--model",
+        help="""use the controller model named MODEL instead of probing the
+            USB bus (e.g. "Alienware 17R4")"""
+    )
+    argparser.add_argument(
+        "-c", "--convert",
+        choices=[
+            alienfx_themefile.AlienFXThemeFile.FORMAT_JSON,
+            alienfx_themefile.AlienFXThemeFile.FORMAT_BINARY],
+        help="convert the theme file of THEME to the given format"
+    )
+    argparser.add_argument(
+        "--max-time", type=float,
+        help="""with --dry-run, exit with an error if the estimated wire time
+            of THEME exceeds MAX_TIME seconds"""
+    )
+    argparser.add_argument(
+        "--build-store", action="store_true",
+        help="""pack all themes into the theme store of the themes directory,
+            together with their packets compiled for the controller"""
+    )
+    argparser.add_argument(
+        "-p", "--playlist",
+        help="""apply the themes of the playlist file PLAYLIST on schedule,
+            until interrupted. Power state names (e.g. "AC Charging") can be
+            used as playlist events"""
+    )
+    argparser.add_argument(
+        "--power-monitor", action="store_true",
+        help="""watch the power supplies and show the colours of the
+            matching power state of THEME (or of the last applied theme) as
+            soon as the power state changes, until interrupted"""
+    )
+    argparser.add_argument(
+        "--metric", choices=AlienFXMetricEffect.METRICS,
+        help="""show the given system metric as a colour from green to red
+            on all zones, until interrupted"""
+    )
+    argparser.add_argument(
+        "--metric-rate", type=float, default=1.0,
+        help="with --metric, sample the metric METRIC_RATE times per second"
+    )
+    argparser.add_argument(
+        "--audio",
+        help="""show the spectrum of the raw PCM audio (signed 16 bit
+            little-endian) in the file AUDIO, or in the standard input if
+            AUDIO is -, on the zones"""
+    )
+    argparser.add_argument(
+        "--audio-rate", type=int, default=44100,
+        help="with --audio, the sample rate of the audio, in Hz"
+    )
+    argparser.add_argument(
+        "--audio-channels", type=int, default=2,
+        help="with --audio, the number of audio channels"
+    )
+    argparser.add_argument(
+        "--frame-rate", type=int, default=30,
+        help="with --audio, the number of lighting updates per second"
+    )
+    argparser.add_argument(
+        "--compile-all", metavar="OUTPUT_DIR",
+        help="""compile every theme for every supported controller model (or
+            only for MODEL) into OUTPUT_DIR, with a manifest of the outputs.
+            No controller is needed"""
+    )
+    argparser.add_argument(
+        "--theme-dir",
+        help="with --compile-all, compile the themes in THEME_DIR instead of "
+            "the themes directory"
+    )
+    argparser.add_argument(
+        "-j", "--jobs", type=int,
+        help="with --compile-all, the number of worker processes (default: "
+            "one per CPU)"
+    )
+    argparser.add_argument(
+        "--preview", metavar="OUTPUT_DIR",
+        help="""render a PNG timeline of the boot state of THEME (or of every
+            theme) on the zones of the controller into OUTPUT_DIR, without
+            changing the lights. Use --model to render for a model that is
+            not connected"""
+    )
+    argparser.add_argument(
+        "--preview-frames", action="store_true",
+        help="""with --preview, also render the frames of one loop of each
+            theme as PNG files in OUTPUT_DIR/THEME"""
+    )
+    return argparser
+
+
+def run_audio_effect(controller, args):
+    """ Show the spectrum of the audio given on the command line until it
+    ends or the user interrupts."""
+    if args.audio == "-":
+        source = sys.stdin.buffer
+    else:
+        source = open(args.audio, "rb")
+    effect = AlienFXAudioEffect(
+        controller, source, sample_rate=args.audio_rate,
+        channels=args.audio_channels, frame_rate=args.frame_rate,
+        realtime=args.audio != "-")
+    try:
+        effect.run()
+    except KeyboardInterrupt:
+        effect.stop()
+    finally:
+        if source is not sys.stdin.buffer:
+            source.close()
+
+
+def run_metric_effect(controller, metric, rate):
+    """ Show the given system metric on all zones until interrupted."""
+    effect = AlienFXMetricEffect(controller, metric, rate=rate)
+    print("Showing {}, press Ctrl+C to stop".format(metric))
+    try:
+        effect.run()
+    except KeyboardInterrupt:
+        effect.stop()
+
+
+def run_power_monitor(controller, themefile):
+    """ Push the colours of the loaded theme's power states on every power
+    state change, until interrupted."""
+    monitor = AlienFXPowerMonitor(controller, themefile)
+    print("Watching power supplies, press Ctrl+C to stop")
+    try:
+        monitor.run()
+    except KeyboardInterrupt:
+        monitor.stop()
+
+
+def run_playlist(controller, themefile, playlist_path):
+    """ Run the scheduler of the given playlist file until interrupted."""
+    scheduler = AlienFXScheduler.from_file(
+        controller, themefile, playlist_path)
+    monitor = AlienFXPowerMonitor(controller)
+    monitor.add_listener(scheduler.trigger_event)
+    monitor.start()
+    print("Running playlist {}, press Ctrl+C to stop".format(playlist_path))
+    try:
+        scheduler.run()
+    except KeyboardInterrupt:
+        scheduler.stop()
+    monitor.stop()
+
+
+def build_store(controller, themefile):
+    """ Pack all themes in the themes directory into the theme store, with
+    their packets compiled for the given controller. Return the number of
+    themes in the store."""
+    themes = []
+    for theme_name in themefile.get_themes():
+        themefile.load(theme_name)
+        if themefile.theme_name != theme_name:
+            print("Skipping theme {}".format(theme_name))
+            continue
+        themes.append((theme_name, themefile.theme))
+    return len(AlienFXThemeStore.write(
+        themefile.get_store_path(), themes, [controller]))
+
+
+def compile_all(args):
+    """ Compile all themes for the controller models given on the command
+    line and print a summary. Return False if any theme failed to compile."""
+    controllers = None
+    if args.model is not None:
+        controller = get_controller_by_name(args.model)
+        if controller is None:
+            print("Unknown controller model: {}".format(args.model))
+            return False
+        controllers = [controller]
+    manifest = alienfx_bulkcompile.compile_themes(
+        args.theme_dir, args.compile_all, controllers, args.jobs)
+    print("Compiled {} themes for {} models in {:.3f} s ({} processes)".format(
+        len(manifest["themes"]), len(manifest["models"]),
+        manifest["seconds"], manifest["processes"]))
+    print("{} outputs, {} errors".format(
+        len(manifest["outputs"]), len(manifest["errors"])))
+    return not manifest["errors"]
+
+
+def render_previews(themefile, args):
+    """ Render the previews requested on the command line."""
+    if args.theme is not None:
+        theme_names = [args.theme]
+    else:
+        theme_names = themefile.get_themes()
+    rendered = AlienFXPreviewRenderer.render_themes(
+        themefile, theme_names, args.preview)
+    if args.preview_frames:
+        for theme_name in rendered:
+            themefile.load(theme_name)
+            AlienFXPreviewRenderer(themefile).render_frames(
+                os.path.join(args.preview, theme_name))
+    print("Rendered {} of {} themes into {}".format(
+        len(rendered), len(theme_names), args.preview))
+    return len(rendered) == len(theme_names)
+
+
+def dry_run(controller, themefile, max_time=None):
+    """ Print the cost of applying the loaded theme on the given controller.
+    Return False if it exceeds max_time seconds, True otherwise."""
+    estimate = controller.estimate_theme(themefile)
+    print("Theme {} on {}:".format(themefile.theme_name, controller.name))
+    print(estimate.to_string())
+    if max_time is not None and estimate.wire_time > max_time:
+        print("Estimated wire time exceeds {:.3f} s".format(max_time))
+        return False
+    return True
+
+
 def start():
     """ Main entry point for the alienfx cli."""
     print("You are running alienfx under Python-Version: "+sys.version)
 
-    # You may switch the commenting of the following 2 lines to force zonescan-execution
-    controller = AlienFXProber.get_controller()  # DEBUG: you may comment this out for development of zonescanner
-    # controller = None  # DEBUG: you may uncomment this out for development of zonescanner
+    args = make_argparser().parse_args()
+    if args.zonescan:
+        doZonescan()
+        return True
+    if args.log is not None:
+        alienfx_logger.set_logfile(args.log)
+    if args.compile_all is not None:
+        if not compile_all(args):
+            sys.exit(1)
+        return True
+
+    if args.model is not None:
+        controller = get_controller_by_name(args.model)
+        if controller is None:
+            print("Unknown controller model: {}. Supported models:".format(
+                args.model))
+            for c in AlienFXController.supported_controllers:
+                print(("\t{}").format(c.name))
+            sys.exit(2)
+    else:
+        # You may switch the commenting of the following 2 lines to force zonescan-execution
+        controller = AlienFXProber.get_controller()  # DEBUG: you may comment this out for development of zonescanner
+        # controller = None  # DEBUG: you may uncomment this out for development of zonescanner
 
     if controller is None:
         logging.error("No Alien FX controller, defined by a supported model, found!")
@@ -90,46 +371,60 @@ def start():
         
     themefile = alienfx_themefile.AlienFXThemeFile(controller)
     try:
-        argparser = argparse.ArgumentParser(
-            description="""AlienFX is a utility to control the lighting effects 
-                of your Alienware computer. 
-                Lighting effect configurations are stored in theme files."""
-        )
-        argparser.add_argument(
-            "-l", "--log", help="write detailed logging information to LOG"
-        )
-        argparser.add_argument(
-            "-t", "--theme",
-            help="set the lighting theme to THEME."
-        )
-        argparser.add_argument(
-            "-s", "--list", action="store_const", const=1, 
-            help="list all available lighting themes"
-        )
-        argparser.add_argument(
-            "-v", "--version", action="version", 
-            version="%(prog)s {}".format(alienfx.common.get_version())
-        )
-        argparser.add_argument(
-            "-z", "--zonescan", action="store_true", help="starts a zonescan"
-        )
-        args = argparser.parse_args()
-        if args.zonescan is not None:
-            if args.zonescan:
-                doZonescan()
-                return True
-
-        if args.log is not None:
-            alienfx_logger.set_logfile(args.log)
         if args.list is not None:
             print("Available themes:")
             themes = themefile.get_themes()
             for t in themes:
                 print(("\t{}").format(t))
+        elif args.preview is not None:
+            if not render_previews(themefile, args):
+                sys.exit(1)
+        elif args.audio is not None:
+            run_audio_effect(controller, args)
+        elif args.metric is not None:
+            run_metric_effect(controller, args.metric, args.metric_rate)
+        elif args.power_monitor:
+            if args.theme is not None:
+                themefile.load(args.theme)
+            else:
+                themefile.load_last_theme()
+            run_power_monitor(controller, themefile)
+        elif args.playlist is not None:
+            run_playlist(controller, themefile, args.playlist)
+        elif args.build_store:
+            num_themes = build_store(controller, themefile)
+            print("Stored {} themes in {}".format(
+                num_themes, themefile.get_store_path()))
         elif args.theme is not None:
-            themefile.load(args.theme)
-            controller.set_theme(themefile)
-            themefile.applied()
+            if args.convert is not None:
+                if not themefile.convert(args.theme, args.convert):
+                    print("Could not convert theme {}".format(args.theme))
+                    sys.exit(1)
+            elif args.dry_run:
+                themefile.load(args.theme)
+                if themefile.theme_name != args.theme:
+                    print("Could not load theme {}".format(args.theme))
+                    sys.exit(1)
+                if themefile.validate():
+                    print("Theme {} is invalid".format(args.theme))
+                    sys.exit(1)
+                if not dry_run(controller, themefile, args.max_time):
+                    sys.exit(1)
+            elif themefile.is_stored_theme(args.theme):
+                if not themefile.get_store().apply(
+                        args.theme, controller, themefile):
+                    print("Could not set theme {}".format(args.theme))
+                    sys.exit(1)
+                # The compiled packets were sent without decoding the theme;
+                # load it now to save it as the last theme.
+                if themefile.theme_name != args.theme:
+                    themefile.load_from_store(args.theme)
+                themefile.applied()
+            else:
+                if not controller.set_theme_streaming(themefile, args.theme):
+                    print("Could not set theme {}".format(args.theme))
+                    sys.exit(1)
+                themefile.applied()
             
     except Exception as e:
         logging.error(e)
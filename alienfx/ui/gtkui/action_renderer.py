@@ -32,6 +32,8 @@ Gtk.TreeView.
 """
 
 
+import collections
+
 from past.utils import old_div
 import cairo
 
@@ -48,9 +50,25 @@ class AlienFXActions(GObject.GObject):
     class are stored in a Gtk.ListStore that is displayed by the GUI.
     """
     
-    def __init__(self):
+    def __init__(self, loader=None):
+        """ If a loader is given, then it is called to get the actions the
+        first time they are used, so that only rows that are shown need to
+        look up their actions."""
         GObject.GObject.__init__(self)
-        self.actions = []
+        self._loader = loader
+        self._actions = None if loader is not None else []
+        
+    @property
+    def actions(self):
+        if self._actions is None:
+            self._actions = self._loader()
+            self._loader = None
+        return self._actions
+        
+    @actions.setter
+    def actions(self, actions):
+        self._actions = actions
+        self._loader = None
         
 class AlienFXActionCellRenderer(Gtk.CellRenderer):
     
@@ -68,6 +86,9 @@ class AlienFXActionCellRenderer(Gtk.CellRenderer):
     border_selected_dark = (0, 0, 0, 0.8)
     border_selected_light = (1, 1, 1, 0.8)
     
+    # Maximum number of distinct rendered actions kept for reuse
+    SURFACE_CACHE_SIZE = 256
+    
     def __init__(self, treeview, max_colour_val):
         Gtk.CellRenderer.__init__(self)
         prop = GObject.Value()
@@ -78,6 +99,12 @@ class AlienFXActionCellRenderer(Gtk.CellRenderer):
         self.cell_padding += prop.get_int()
         self.selected_action = None
         self.max_colour_val = max_colour_val
+        self._surface_cache = collections.OrderedDict()
+        
+    def get_width_for_actions(self, num_actions):
+        """ Return the cell width needed to show the given number of actions."""
+        return (num_actions*(self.item_width + self.item_spacing + 
+            self.line_width) + self.cell_padding)
         
     def _convert_x_to_action_index(self, x):
         """ Convert the given x coordinate to an action index. """
@@ -105,11 +132,104 @@ class AlienFXActionCellRenderer(Gtk.CellRenderer):
         (red, green, blue) = colour
         return red*0.30 + green*0.59 + blue*0.11
         
+    def invalidate_cache(self):
+        """ Drop all cached action surfaces, e.g. when a new theme is loaded."""
+        self._surface_cache.clear()
+        
+    def _get_cache_key(self, action):
+        """ Return the key under which the rendering of an action is cached."""
+        colours = tuple(
+            tuple(colour) for colour in AlienFXThemeFile.get_action_colours(action))
+        return (AlienFXThemeFile.get_action_type(action), colours,
+            self.item_width, self.item_height, self.max_colour_val)
+            
+    def _render_action(self, target, action):
+        """ Render an action with its normal border onto a new surface similar
+        to the given target surface. Return the surface and the colour of the
+        selection border to draw over it."""
+        surface = target.create_similar(
+            cairo.CONTENT_COLOR_ALPHA, 
+            self.item_width + 2*self.line_width, 
+            self.item_height + 2*self.line_width)
+        cr = cairo.Context(surface)
+        cr.set_line_width(self.line_width)
+        start_x = self.line_width
+        start_y = self.line_width
+        border_colour = self.border_selected_light
+        action_type = AlienFXThemeFile.get_action_type(action)
+        if action_type == AlienFXThemeFile.KW_ACTION_TYPE_FIXED:
+            colours = AlienFXThemeFile.get_action_colours(action)
+            if len(colours) == 1:
+                colours_normalized = [
+                    old_div(float(x),self.max_colour_val) for x in colours[0]]
+                if self._get_intensity(colours_normalized) > 0.5:
+                    border_colour = self.border_selected_dark
+                (red, green, blue) = colours_normalized
+                cr.rectangle(
+                    start_x, start_y, self.item_width, self.item_height)
+                cr.set_source_rgb(red, green, blue)
+                cr.fill()
+        elif action_type == AlienFXThemeFile.KW_ACTION_TYPE_BLINK:
+            colours = AlienFXThemeFile.get_action_colours(action)
+            if len(colours) == 1:
+                colours_normalized = [
+                    old_div(float(x),self.max_colour_val) for x in colours[0]]
+                (red, green, blue) = colours_normalized
+                cr.rectangle(
+                    start_x, start_y, old_div(self.item_width,2), self.item_height)
+                cr.set_source_rgb(red, green, blue)
+                cr.fill()
+                cr.rectangle(
+                    start_x+ old_div(self.item_width,2), start_y, 
+                    old_div(self.item_width,2), self.item_height)
+                cr.set_source_rgb(0, 0, 0)
+                cr.fill()
+        elif action_type == AlienFXThemeFile.KW_ACTION_TYPE_MORPH:
+            colours = AlienFXThemeFile.get_action_colours(action)
+            if len(colours) == 2:
+                colours_normalized1 = [
+                    old_div(float(x),self.max_colour_val) for x in colours[0]]
+                colours_normalized2 = [
+                    old_div(float(x),self.max_colour_val) for x in colours[1]]
+                if (self._get_intensity(colours_normalized1) + 
+                        self._get_intensity(colours_normalized2)) > 1:
+                    border_colour = self.border_selected_dark
+                (red1, green1, blue1) = colours_normalized1
+                (red2, green2, blue2) = colours_normalized2
+                cr.rectangle(
+                    start_x, start_y, self.item_width, self.item_height)
+                gradient = cairo.LinearGradient(
+                    start_x, 0, start_x + self.item_width, 0)
+                gradient.add_color_stop_rgb(0, red1, green1, blue1)
+                gradient.add_color_stop_rgb(1, red2, green2, blue2)
+                cr.set_source(gradient)
+                cr.fill()
+                
+        # draw the action border.
+        (red, green, blue) = self.border_normal
+        cr.rectangle(start_x, start_y, self.item_width, self.item_height)
+        cr.set_source_rgb(red, green, blue)
+        cr.stroke()
+        surface.flush()
+        return (surface, border_colour)
+        
+    def _get_action_surface(self, target, action):
+        """ Return the rendered surface and selection border colour of an
+        action, from the cache if it has been rendered before."""
+        key = self._get_cache_key(action)
+        cached = self._surface_cache.get(key)
+        if cached is not None:
+            self._surface_cache.move_to_end(key)
+            return cached
+        cached = self._render_action(target, action)
+        self._surface_cache[key] = cached
+        if len(self._surface_cache) > self.SURFACE_CACHE_SIZE:
+            self._surface_cache.popitem(last=False)
+        return cached
+        
     def do_render(self, cr, widget, background_area, cell_area, flags):
         """ Render the actions. Implementation of Gtk.CellRenderer.render()."""
         
-        cr.set_line_width(self.line_width)
-         
         # Draw a white background.
         cr.rectangle(
             background_area.x, background_area.y, 
@@ -117,67 +237,22 @@ class AlienFXActionCellRenderer(Gtk.CellRenderer):
         cr.set_source_rgb(1, 1, 1)
         cr.fill()
         
-        # Draw the actions.
+        # Draw the actions, skipping those outside the area being redrawn.
+        target = cr.get_target()
         actions = self.get_property("actions").actions
-        start_x = cell_area.x + self.item_spacing
+        item_pitch = self.item_spacing + self.item_width + self.line_width
+        first_x = cell_area.x + self.item_spacing
+        (clip_x1, clip_y1, clip_x2, clip_y2) = cr.clip_extents()
+        first_action = max(0, int((clip_x1 - first_x)//item_pitch))
+        last_action = min(len(actions), int((clip_x2 - first_x)//item_pitch) + 1)
+        start_x = first_x + first_action*item_pitch
         start_y = cell_area.y + old_div((cell_area.height - self.item_height),2)
-        action_num = 0
-        for action in actions:
-            action_type = AlienFXThemeFile.get_action_type(action)
-            if action_type == AlienFXThemeFile.KW_ACTION_TYPE_FIXED:
-                colours = AlienFXThemeFile.get_action_colours(action)
-                if len(colours) == 1:
-                    colours_normalized = [
-                        old_div(float(x),self.max_colour_val) for x in colours[0]]
-                    if self._get_intensity(colours_normalized) > 0.5:
-                        border_colour = self.border_selected_dark
-                    else:
-                        border_colour = self.border_selected_light
-                    (red, green, blue) = colours_normalized
-                    cr.rectangle(
-                        start_x, start_y, self.item_width, self.item_height)
-                    cr.set_source_rgb(red, green, blue)
-                    cr.fill()
-            elif action_type == AlienFXThemeFile.KW_ACTION_TYPE_BLINK:
-                colours = AlienFXThemeFile.get_action_colours(action)
-                if len(colours) == 1:
-                    colours_normalized = [
-                        old_div(float(x),self.max_colour_val) for x in colours[0]]
-                    border_colour = self.border_selected_light
-                    (red, green, blue) = colours_normalized
-                    cr.rectangle(
-                        start_x, start_y, old_div(self.item_width,2), self.item_height)
-                    cr.set_source_rgb(red, green, blue)
-                    cr.fill()
-                    cr.rectangle(
-                        start_x+ old_div(self.item_width,2), start_y, 
-                        old_div(self.item_width,2), self.item_height)
-                    cr.set_source_rgb(0, 0, 0)
-                    cr.fill()
-            elif action_type == AlienFXThemeFile.KW_ACTION_TYPE_MORPH:
-                colours = AlienFXThemeFile.get_action_colours(action)
-                if len(colours) == 2:
-                    colours_normalized1 = [
-                        old_div(float(x),self.max_colour_val) for x in colours[0]]
-                    colours_normalized2 = [
-                        old_div(float(x),self.max_colour_val) for x in colours[1]]
-                    border_colours = [
-                        self.border_selected_light, self.border_selected_dark]
-                    if (self._get_intensity(colours_normalized1) + 
-                            self._get_intensity(colours_normalized2)) > 1:
-                        border_colour = self.border_selected_dark
-                    else:
-                        border_colour = self.border_selected_light
-                    (red1, green1, blue1) = colours_normalized1
-                    (red2, green2, blue2) = colours_normalized2
-                    cr.rectangle(
-                        start_x, start_y, self.item_width, self.item_height)
-                    gradient = cairo.LinearGradient(
-                        start_x, 0, start_x + self.item_width, 0)
-                    gradient.add_color_stop_rgb(0, red1, green1, blue1)
-                    gradient.add_color_stop_rgb(1, red2, green2, blue2)
-                    cr.set_source(gradient)
-                    cr.fill()
+        action_num = first_action
+        for action in actions[first_action:last_action]:
+            (surface, border_colour) = self._get_action_surface(target, action)
+            cr.set_source_surface(
+                surface, start_x - self.line_width, start_y - self.line_width)
+            cr.paint()
                     
             # Check if this action is selected.
             selected = False
@@ -185,12 +260,6 @@ class AlienFXActionCellRenderer(Gtk.CellRenderer):
                 (action_num == self.selected_action) and
                 (flags & Gtk.CellRendererState.SELECTED)):
                     selected = True
-                    
-            # draw the action border.
-            (red, green, blue) = self.border_normal
-            cr.rectangle(start_x, start_y, self.item_width, self.item_height)
-            cr.set_source_rgb(red, green, blue)
-            cr.stroke()
             
             # Draw the selection border.
             if selected:
@@ -200,7 +269,7 @@ class AlienFXActionCellRenderer(Gtk.CellRenderer):
                 cr.rectangle(start_x+3, start_y+3, self.item_width-3-3, 
                     self.item_height-3-3)
                 cr.stroke()
-            start_x += self.item_spacing + self.item_width + self.line_width
+            start_x += item_pitch
             action_num += 1
 
     def do_get_request_mode(self):
@@ -215,6 +284,5 @@ class AlienFXActionCellRenderer(Gtk.CellRenderer):
     def do_get_preferred_width(self, widget):
         """ Implementation of Gtk.CellRenderer.get_preferred_width()."""
         actions = self.get_property("actions").actions
-        preferred_width = (len(actions)*(self.item_width + self.item_spacing + 
-            self.line_width) + self.cell_padding)
+        preferred_width = self.get_width_for_actions(len(actions))
         return (preferred_width, preferred_width)
@@ -25,54 +25,109 @@
 
 """ Classes to display a colour palette to select colours for lighting zones.
 
+The colour squares of all palettes are drawn from shared atlas surfaces, one
+per set of colours and square size, holding an active and an inactive tile
+for every colour. Tiles are rendered the first time they are shown.
+
 Classes provided by this module:
+ColourPaletteAtlas: A surface holding the rendered squares of a set of colours.
 ColourPaletteSquare: A single colour of the palette.
 ColourPalette: A colour palette consisting of instances of ColourPaletteSquare.
 """
 
+from builtins import object
+
 import gi
 gi.require_version('Gtk', '3.0')
 from gi.repository import Gtk
 from gi.repository import Gdk
 import cairo
 
+class ColourPaletteAtlas(object):
+    
+    """ A surface holding the active and inactive squares of a set of
+    colours, side by side. Atlases are shared by all palettes with the same
+    colours and square size."""
+    
+    _atlases = {}
+    
+    @classmethod
+    def get(cls, colours, width, height):
+        """ Return the atlas for the given colours ((red, green, blue) tuples,
+        0-1 each) and square size."""
+        key = (tuple(colours), width, height)
+        atlas = cls._atlases.get(key)
+        if atlas is None:
+            atlas = cls(colours, width, height)
+            cls._atlases[key] = atlas
+        return atlas
+    
+    def __init__(self, colours, width, height):
+        self.colours = list(colours)
+        self.width = width
+        self.height = height
+        self._surface = None
+        self._rendered = set()
+        
+    def _render_tile(self, index, active):
+        """ Render the square of a colour into the atlas."""
+        if self._surface is None:
+            self._surface = cairo.ImageSurface(
+                cairo.FORMAT_RGB24, self.width*len(self.colours), 
+                2*self.height)
+        (red, green, blue) = self.colours[index]
+        x = index*self.width
+        y = 0 if active else self.height
+        cr = cairo.Context(self._surface)
+        cr.rectangle(x, y, self.width, self.height)
+        cr.clip()
+        if active:
+            cr.rectangle(x, y, self.width, self.height)
+            cr.set_source_rgb(red, green, blue)
+            cr.fill()
+            cr.rectangle(x, y, self.width, self.height)
+            cr.set_line_width(2)
+            cr.set_source_rgb(0x0, 0x0, 0x0)
+            cr.stroke()
+        else:
+            grey = 0.2126*red + 0.7152*green + 0.0722*blue
+            cr.rectangle(x, y, self.width, self.height)
+            cr.set_source_rgb(grey, grey, grey)
+            cr.fill()
+        self._surface.flush()
+        self._rendered.add((index, active))
+        
+    def draw_tile(self, cr, index, active):
+        """ Draw the square of a colour at the origin of the given context."""
+        if (index, active) not in self._rendered:
+            self._render_tile(index, active)
+        cr.set_source_surface(
+            self._surface, -index*self.width, 0 if active else -self.height)
+        cr.rectangle(0, 0, self.width, self.height)
+        cr.fill()
+
 class ColourPaletteSquare(Gtk.EventBox):
     
     """ A single colour square belonging to a ColourPalette instance."""
     
-    def __init__(self, rgba, width, height, max_colour_val):
+    def __init__(self, atlas, index, max_colour_val):
         Gtk.EventBox.__init__(self)
         self.max_colour_val = max_colour_val
         self.set_property("margin", 1)
         self.add_events(Gdk.EventMask.BUTTON_RELEASE_MASK)
+        self.atlas = atlas
+        self.index = index
+        self.colour = atlas.colours[index]
+        self.active = True
+        drawing_area = Gtk.DrawingArea()
+        drawing_area.set_size_request(atlas.width, atlas.height)
+        drawing_area.connect("draw", self.on_draw)
+        self.add(drawing_area)
         
-        # Draw the contents.
-        self.colour = (rgba.red, rgba.green, rgba.blue)
-        (red, green, blue) = self.colour
-        surface = cairo.ImageSurface(cairo.FORMAT_RGB24, width, height)
-        cr = cairo.Context(surface)
-        cr.rectangle(0, 0, width, height)
-        cr.set_source_rgb(red, green, blue)
-        cr.fill()
-        cr.rectangle(0, 0, width, height)
-        cr.set_line_width(2)
-        cr.set_source_rgb(0x0, 0x0, 0x0)
-        cr.stroke()
-        pb = Gdk.pixbuf_get_from_surface(surface, 0, 0, width, height)
-        self.active_image = Gtk.Image()
-        self.active_image.set_from_pixbuf(pb)
-        self.add(self.active_image)
-        
-        # Make the inactive version
-        y = 0.2126*red + 0.7152*green + 0.0722*blue
-        surface = cairo.ImageSurface(cairo.FORMAT_RGB24, width, height)
-        cr = cairo.Context(surface)
-        cr.rectangle(0, 0, width, height)
-        cr.set_source_rgb(y, y, y)
-        cr.fill()
-        pb = Gdk.pixbuf_get_from_surface(surface, 0, 0, width, height)
-        self.inactive_image = Gtk.Image()
-        self.inactive_image.set_from_pixbuf(pb)
+    def on_draw(self, widget, cr):
+        """ Draw this colour from the palette atlas."""
+        self.atlas.draw_tile(cr, self.index, self.active)
+        return True
         
     def get_colour(self):
         """ Return the colour stored in this instance."""
@@ -80,13 +135,8 @@ class ColourPaletteSquare(Gtk.EventBox):
         
     def set_active(self, active):
         """ Override Gtk.EventBox.set_active()."""
-        if active:
-            self.remove(self.inactive_image)
-            self.add(self.active_image)
-        else:
-            self.remove(self.active_image)
-            self.add(self.inactive_image)
-        self.get_child().show()
+        self.active = active
+        self.queue_draw()
             
 class ColourPalette(Gtk.Grid):
         
@@ -100,10 +150,13 @@ class ColourPalette(Gtk.Grid):
         col = 0
         (ret, width, height) = Gtk.icon_size_lookup(Gtk.IconSize.BUTTON)
         rgba = Gdk.RGBA()
+        rgb_colours = []
         for c in colours:
             rgba.parse(c)
-            colour_square = ColourPaletteSquare(
-                rgba, width, height, max_colour_val)
+            rgb_colours.append((rgba.red, rgba.green, rgba.blue))
+        atlas = ColourPaletteAtlas.get(rgb_colours, width, height)
+        for index in range(len(rgb_colours)):
+            colour_square = ColourPaletteSquare(atlas, index, max_colour_val)
             colour_square.connect("button-release-event", selected_handler)
             self.attach(colour_square, col, row, 1, 1)
             if horizontal:
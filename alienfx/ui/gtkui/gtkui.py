@@ -29,6 +29,8 @@ This module provides the following classes:
 AlienFXApp: The main GUI application.
 """
 
+import functools
+import logging
 import os
 import sys
 import threading
@@ -43,6 +45,7 @@ import pkg_resources
 from alienfx.ui.gtkui.colour_palette import ColourPalette
 from alienfx.core.prober import AlienFXProber
 from alienfx.core.themefile import AlienFXThemeFile
+from alienfx.core.themehistory import AlienFXThemeHistory
 from alienfx.ui.gtkui.action_renderer import AlienFXActionCellRenderer
 from alienfx.ui.gtkui.action_renderer import AlienFXActions
         
@@ -72,15 +75,87 @@ class AlienFXApp(Gtk.Application):
             "#009AF4"
         ]
         
+    # Time (in milliseconds) to wait after an edit before it is previewed, so
+    # that rapid edits are sent to the controller as one update.
+    PREVIEW_DELAY = 150
+
+    # Number of validation errors listed when a theme cannot be saved
+    MAX_SAVE_ERRORS = 10
+        
     def __init__(self):
         Gtk.Application.__init__(self)
         self.connect("activate", self.on_activate)
-        self.controller = AlienFXProber.get_controller()
-        self.themefile = AlienFXThemeFile(self.controller)
+        self.builder = None
+        self.controller = None
+        self.themefile = None
         self.selected_action = None
-        self.action_type = self.themefile.KW_ACTION_TYPE_FIXED
+        self.action_type = AlienFXThemeFile.KW_ACTION_TYPE_FIXED
         self.theme_edited = False
-        self.set_theme_done = True
+        self.apply_cancel = threading.Event()
+        self.applying = False
+        self.live_preview = False
+        self.preview_colours = {}
+        self.preview_timeout_id = None
+        self.preview_thread = None
+        # True while the zones show previewed colours instead of the theme
+        self.previewed = False
+        # The zone list row of each (state, zone), the measured width of each
+        # zone name and the length of the longest action loop shown
+        self.zone_rows = {}
+        self.zone_name_widths = {}
+        self.max_actions = 1
+        
+        # Scanning the USB bus is slow, so probe for the controller while the
+        # UI is being built. The zones are filled in once it is found.
+        self.probe_done = False
+        self.controller_ready = False
+        self.probe_thread = threading.Thread(target=self.probe_controller)
+        self.probe_thread.daemon = True
+        self.probe_thread.start()
+        
+    def probe_controller(self):
+        """ Probe for the controller. This runs in a worker thread."""
+        controller = AlienFXProber.get_controller()
+        GObject.idle_add(self.on_controller_probed, controller)
+        
+    def on_controller_probed(self, controller):
+        """ This idle task sets up the controller and the theme once probing
+        is done, and the UI has been built."""
+        self.controller = controller
+        self.probe_done = True
+        if self.builder is None or self.controller_ready:
+            return False
+        self.controller_ready = True
+        
+        main_window = self.builder.get_object("main_window")
+        spinner = self.builder.get_object("spinner")
+        spinner.stop()
+        spinner.hide()
+        self.builder.get_object("statusbar").pop(self.probe_context_id)
+        if self.controller is None:
+            dialog = Gtk.MessageDialog(
+                main_window, Gtk.DialogFlags.MODAL, 
+                Gtk.MessageType.ERROR, 
+                Gtk.ButtonsType.CLOSE, 
+                "No supported Alien FX controller found!")
+            dialog.run()
+            dialog.destroy()
+            self.quit()
+            return False
+            
+        self.themefile = AlienFXThemeFile(self.controller)
+        self.history = AlienFXThemeHistory(self.themefile)
+        last_theme_loaded = self.themefile.load_last_theme()
+        if last_theme_loaded:
+            self.load_theme("Current Theme")
+        else:
+            self.load_theme("New Theme")
+        self.theme_loaded_from_file = False
+        self.builder.get_object("toolbar").set_sensitive(True)
+        self.builder.get_object("buttonbox1").set_sensitive(True)
+        self.zone_list_view.set_sensitive(True)
+        self.enable_delete_theme_button(False)
+        return False
 
     def enable_delete_theme_button(self, enable):
         """ Enable or disable the "Delete Theme" button."""
@@ -105,6 +180,7 @@ class AlienFXApp(Gtk.Application):
                 return
                 
         self.themefile = AlienFXThemeFile(self.controller)
+        self.history = AlienFXThemeHistory(self.themefile)
         self.themefile.set_default_theme()
         self.load_theme("New Theme")
         self.set_theme_dirty(False)
@@ -129,11 +205,30 @@ class AlienFXApp(Gtk.Application):
         if self.themefile.theme_name == "":
             self.on_action_save_theme_as_activate(widget)
         else:
-            self.themefile.save(self.themefile.theme_name)
+            errors = self.themefile.save(self.themefile.theme_name)
+            if errors:
+                self.show_save_errors(errors)
+                return
             self.set_theme_dirty(False)
             self.theme_loaded_from_file = True
             self.enable_delete_theme_button(True)
         
+    def show_save_errors(self, errors):
+        """ Tell the user why the theme could not be saved."""
+        main_window = self.builder.get_object("main_window")
+        dialog = Gtk.MessageDialog(main_window, 
+            Gtk.DialogFlags.MODAL,
+            Gtk.MessageType.ERROR,
+            Gtk.ButtonsType.CLOSE,
+            "The theme could not be saved.")
+        shown = [str(error) for error in errors[:self.MAX_SAVE_ERRORS]]
+        if len(errors) > self.MAX_SAVE_ERRORS:
+            shown.append("... and {} more".format(
+                len(errors) - self.MAX_SAVE_ERRORS))
+        dialog.format_secondary_text("\n".join(shown))
+        dialog.run()
+        dialog.destroy()
+            
     def on_action_save_theme_as_activate(self, widget):
         """ Handler for when the "Save Theme As" action is triggered."""
         themes = self.themefile.get_themes()
@@ -169,11 +264,12 @@ class AlienFXApp(Gtk.Application):
             
         (treeiter, action_index) = self.selected_action
         model = self.zone_list_view.get_model()
-        actions = model[treeiter][1]
-        del actions.actions[action_index:action_index+1]
-        if len(actions.actions) == 1:
+        (state, zone) = self.get_state_zone_at_iter(model, treeiter)
+        self.history.delete_action(state, zone, action_index)
+        self.update_zone_row(state, zone)
+        self.update_undo_buttons()
+        if len(model[treeiter][1].actions) == 1:
             self.builder.get_object("toolbutton_delete").set_sensitive(False)
-        model[treeiter][1] = actions
         action_index -= 1
         if action_index < 0:
             action_index = 0
@@ -188,11 +284,12 @@ class AlienFXApp(Gtk.Application):
             
         (treeiter, action_index) = self.selected_action
         model = self.zone_list_view.get_model()
-        actions = model[treeiter][1]
+        (state, zone) = self.get_state_zone_at_iter(model, treeiter)
         new_action = self.themefile.make_zone_action(self.action_type, [[15, 15, 15]])
-        actions.actions.insert(action_index+1, new_action)
+        self.history.insert_action(state, zone, action_index+1, new_action)
+        self.update_zone_row(state, zone)
+        self.update_undo_buttons()
         self.builder.get_object("toolbutton_delete").set_sensitive(True)
-        model[treeiter][1] = actions
         self.set_theme_dirty(True)
         
     def set_theme_dirty(self, dirty):
@@ -210,38 +307,239 @@ class AlienFXApp(Gtk.Application):
         self.builder.get_object("main_window").set_title(title)
         
     def set_theme(self):
-        """ Set the current theme on the computer."""
-        self.controller.set_theme(self.themefile)
-        self.themefile.applied()
-        self.set_theme_done = True
+        """ Set the current theme on the computer. This runs in a worker
+        thread; progress and the result are passed to the main loop."""
+        def progress_cb(state_name, done, total):
+            GObject.idle_add(self.on_apply_progress, state_name, done, total)
+        # A preview still being sent would overwrite the theme.
+        preview_thread = self.preview_thread
+        if preview_thread is not None:
+            preview_thread.join()
+        applied = False
+        try:
+            applied = self.controller.set_theme(
+                self.themefile, progress_cb, self.apply_cancel)
+        except Exception as exc:
+            logging.error("Cannot apply theme: {}".format(exc))
+        if applied:
+            self.themefile.applied()
+            self.previewed = False
+        GObject.idle_add(self.on_apply_done, applied)
+        
+    def on_apply_progress(self, state_name, done, total):
+        """ This idle task shows the progress of applying a theme."""
+        self.apply_progress_bar.set_fraction(float(done)/total)
+        if state_name is None:
+            self.apply_progress_bar.set_text("Done")
+        else:
+            self.apply_progress_bar.set_text(state_name)
+        return False
         
-    def set_theme_done_cb(self):
+    def on_apply_done(self, applied):
         """ This idle task updates the GUI when the theme has been sent to the
-        AlienFX controller."""
-        if self.set_theme_done:
-            spinner = self.builder.get_object("spinner")
-            spinner.stop()
-            spinner.hide()
-            self.builder.get_object("statusbar").pop(self.context_id)
-            self.builder.get_object("toolbar").set_sensitive(True)
-            return False
-        else:
-            return True
+        AlienFX controller, or applying it was cancelled or failed."""
+        self.applying = False
+        self.apply_progress_bar.hide()
+        self.apply_cancel_button.hide()
+        statusbar = self.builder.get_object("statusbar")
+        statusbar.pop(self.context_id)
+        if not applied:
+            if self.apply_cancel.is_set():
+                statusbar.push(self.context_id, "Applying theme cancelled")
+            else:
+                statusbar.push(self.context_id, "Applying theme failed")
+        self.builder.get_object("toolbar").set_sensitive(True)
+        return False
+        
+    def on_apply_cancel_clicked(self, button):
+        """ Handler for when the "Cancel" button is clicked while a theme is
+        being applied."""
+        self.apply_cancel.set()
+        self.apply_cancel_button.set_sensitive(False)
         
     def on_action_apply_activate(self, widget):
         """ Handler for when the "Apply Theme" action is triggered."""
         self.builder.get_object("toolbar").set_sensitive(False)
         statusbar = self.builder.get_object("statusbar")
         self.context_id = statusbar.get_context_id("Apply")
+        statusbar.remove_all(self.context_id)
         statusbar.push(self.context_id, "Applying theme...")
-        spinner = self.builder.get_object("spinner")
-        spinner.show()
-        spinner.start()
-        self.set_theme_done = False
-        GObject.idle_add(self.set_theme_done_cb)
+        self.apply_progress_bar.set_fraction(0)
+        self.apply_progress_bar.set_text("")
+        self.apply_progress_bar.show()
+        self.apply_cancel_button.set_sensitive(True)
+        self.apply_cancel_button.show()
+        self.apply_cancel.clear()
+        # Live previews are dropped while the theme is sent.
+        self.applying = True
+        self.preview_colours = {}
         self.set_theme_thread = threading.Thread(target=self.set_theme)
         self.set_theme_thread.start()
 
+    def on_live_preview_toggled(self, button):
+        """ Handler for when the "Live Preview" button is toggled."""
+        self.live_preview = button.get_active()
+        if not self.live_preview:
+            self.preview_colours = {}
+            if self.preview_timeout_id is not None:
+                GObject.source_remove(self.preview_timeout_id)
+                self.preview_timeout_id = None
+            if self.previewed and not self.applying:
+                # The zones still show the previewed colours; send the
+                # whole theme to restore it.
+                self.on_action_apply_activate(button)
+        
+    def queue_preview(self, zone, colour):
+        """ Show a colour on a zone once no further edits have been made for
+        PREVIEW_DELAY milliseconds. Nothing is shown while a theme is being
+        applied."""
+        if self.applying:
+            return
+        self.preview_colours[zone] = colour
+        if self.preview_timeout_id is not None:
+            GObject.source_remove(self.preview_timeout_id)
+        self.preview_timeout_id = GObject.timeout_add(
+            self.PREVIEW_DELAY, self.send_preview)
+        
+    def send_preview(self):
+        """ This timeout task sends the queued preview colours to the
+        controller in a worker thread."""
+        if self.preview_thread is not None and self.preview_thread.is_alive():
+            # Wait for the previous update; edits keep being coalesced.
+            return True
+        self.preview_timeout_id = None
+        colours = self.preview_colours
+        self.preview_colours = {}
+        if colours and not self.applying:
+            self.previewed = True
+            self.preview_thread = threading.Thread(
+                target=self.preview, args=(colours,))
+            self.preview_thread.start()
+        return False
+        
+    def preview(self, zone_colours):
+        """ Show the given zone colours on the computer."""
+        try:
+            self.controller.set_realtime_colours(zone_colours)
+        except Exception as exc:
+            logging.error("Cannot preview colours: {}".format(exc))
+        
+    def get_state_zone_at_iter(self, model, treeiter):
+        """ Return the state and the name of the zone shown in the given zone
+        list row. Rows of the power zone list store them in their third and
+        fourth columns."""
+        if model == self.builder.get_object("power_zone_list_store"):
+            return (model[treeiter][2], model[treeiter][3])
+        return (self.controller.STATE_BOOT, model[treeiter][0])
+        
+    def get_power_states(self):
+        """ Return the states shown in the power zone list."""
+        return [
+            self.controller.STATE_AC_SLEEP,
+            self.controller.STATE_AC_CHARGED,
+            self.controller.STATE_AC_CHARGING,
+            self.controller.STATE_BATTERY_SLEEP,
+            self.controller.STATE_BATTERY_ON,
+            self.controller.STATE_BATTERY_CRITICAL
+        ]
+        
+    def get_power_zone_label(self, state, zone):
+        """ Return the label of the power zone list row of a state and
+        zone. The zone is only named if the controller has several power
+        zones."""
+        if len(self.controller.power_zones) > 1:
+            return "{} ({})".format(state, zone)
+        return state
+        
+    def update_zone_row(self, state, zone):
+        """ Show the current actions of a zone in its zone list row, after
+        they were edited or an edit was undone, and resize the actions column
+        if needed. Other rows are left alone."""
+        (model, treeiter) = self.zone_rows[(state, zone)]
+        old_count = len(model[treeiter][1].actions)
+        actions = self.themefile.get_zone_actions(state, zone)
+        model[treeiter][1] = AlienFXActions(functools.partial(
+            self.themefile.get_zone_actions, state, zone))
+        if len(actions) >= self.max_actions:
+            self.set_max_actions(len(actions))
+        elif old_count == self.max_actions:
+            # The longest loop may have become shorter.
+            self.set_max_actions(self.get_max_actions())
+        
+    def update_undo_buttons(self):
+        """ Enable the undo and redo buttons if there is something to undo or
+        redo."""
+        self.undo_button.set_sensitive(self.history.can_undo())
+        self.redo_button.set_sensitive(self.history.can_redo())
+        
+    def show_undone_edit(self, edit):
+        """ Update the GUI after an edit was undone or redone."""
+        if edit is None:
+            return
+        self.selected_action = None
+        self.action_cell_renderer.select_action_at_x(None)
+        self.enable_action_edit_controls(False)
+        (state, zone) = edit
+        self.update_zone_row(state, zone)
+        self.update_undo_buttons()
+        self.set_theme_dirty(True)
+        if self.live_preview:
+            actions = self.themefile.get_zone_actions(state, zone)
+            if actions:
+                colours = self.themefile.get_action_colours(actions[0])
+                if colours:
+                    self.queue_preview(zone, colours[0])
+        
+    def on_undo_clicked(self, button):
+        """ Handler for when the "Undo" button is clicked."""
+        self.show_undone_edit(self.history.undo())
+        
+    def on_redo_clicked(self, button):
+        """ Handler for when the "Redo" button is clicked."""
+        self.show_undone_edit(self.history.redo())
+        
+    def update_zone_list_widths(self):
+        """ Size the zone list columns to fit the zone names and the longest
+        action loop of the theme. The columns have fixed sizes so that the
+        zone list does not need to measure every row. Zone names are only
+        measured the first time they are shown."""
+        names = list(self.controller.zone_map)
+        for zone in self.controller.power_zones:
+            names.extend([
+                self.get_power_zone_label(state, zone)
+                for state in self.get_power_states()])
+        name_width = 0
+        for name in names:
+            if name not in self.zone_name_widths:
+                (width, height) = self.zone_list_view.create_pango_layout(
+                    name).get_pixel_size()
+                self.zone_name_widths[name] = width
+            name_width = max(name_width, self.zone_name_widths[name])
+        (xpad, ypad) = self.zone_name_renderer.get_padding()
+        self.zone_name_column.set_fixed_width(name_width + 2*xpad + 
+            self.action_cell_renderer.cell_padding)
+        self.set_max_actions(self.get_max_actions())
+        
+    def get_max_actions(self):
+        """ Return the length of the longest action loop of the theme, and at
+        least 1."""
+        max_actions = 1
+        for items in self.themefile.theme.values():
+            if isinstance(items, list):
+                for item in items:
+                    loop = item.get(self.themefile.KW_LOOP, [])
+                    max_actions = max(max_actions, len(loop))
+        return max_actions
+        
+    def set_max_actions(self, max_actions):
+        """ Size the actions column to fit the given number of actions."""
+        if (max_actions == self.max_actions and 
+                self.actions_column.get_fixed_width() > 0):
+            return
+        self.max_actions = max_actions
+        self.actions_column.set_fixed_width(
+            self.action_cell_renderer.get_width_for_actions(max_actions))
+        
     def set_window_title(self, theme_name):
         """ Set the window title from the current theme name."""
         self.builder.get_object("main_window").set_title(theme_name + " - Alien FX")
@@ -252,28 +550,34 @@ class AlienFXApp(Gtk.Application):
         theme file currently loaded."""
         normal_zone_list_store = self.builder.get_object("normal_zone_list_store")
         power_zone_list_store = self.builder.get_object("power_zone_list_store")
+        # The list stores are detached while they are filled, and the actions
+        # of a row are only looked up when the row is drawn.
+        self.zone_list_view.set_model(None)
         normal_zone_list_store.clear()
+        power_zone_list_store.clear()
+        self.action_cell_renderer.invalidate_cache()
+        self.zone_rows = {}
         zones = self.controller.zone_map
         for zone in zones:
             if zone in self.controller.power_zones:
-                power_zone_list_store.clear()
-                power_states = [
-                    self.controller.STATE_AC_SLEEP,
-                    self.controller.STATE_AC_CHARGED,
-                    self.controller.STATE_AC_CHARGING,
-                    self.controller.STATE_BATTERY_SLEEP,
-                    self.controller.STATE_BATTERY_ON,
-                    self.controller.STATE_BATTERY_CRITICAL
-                ]
-                for state in power_states:
-                    a = AlienFXActions()
-                    a.actions = self.themefile.get_zone_actions(state, zone)
-                    power_zone_list_store.append([state, a])
-            elif zone in self.controller.zone_map:  # Is elif really necessary? Aren't we already iterating self.controller.zone_map?
-                a = AlienFXActions()
-                a.actions = self.themefile.get_zone_actions(self.controller.STATE_BOOT, zone)
-                normal_zone_list_store.append([zone, a])
+                for state in self.get_power_states():
+                    a = AlienFXActions(functools.partial(
+                        self.themefile.get_zone_actions, state, zone))
+                    self.zone_rows[(state, zone)] = (
+                        power_zone_list_store, power_zone_list_store.append([
+                            self.get_power_zone_label(state, zone), a,
+                            state, zone]))
+            else:
+                a = AlienFXActions(functools.partial(
+                    self.themefile.get_zone_actions, 
+                    self.controller.STATE_BOOT, zone))
+                self.zone_rows[(self.controller.STATE_BOOT, zone)] = (
+                    normal_zone_list_store,
+                    normal_zone_list_store.append([zone, a]))
+        self.update_zone_list_widths()
         self.zone_list_view.set_model(normal_zone_list_store)
+        self.history.reset()
+        self.update_undo_buttons()
         self.builder.get_object("radiobutton_normal_zones").set_active(True)
         if theme_name is not None:
             self.set_window_title(theme_name)
@@ -319,9 +623,12 @@ class AlienFXApp(Gtk.Application):
         
     # Save-as dialog box handlers
     def do_saveas_theme(self, theme_name):
-        self.themefile.save(theme_name)
-        self.set_window_title(self.themefile.theme_name)
+        errors = self.themefile.save(theme_name)
         self.builder.get_object("saveas_theme_dialog").hide()
+        if errors:
+            self.show_save_errors(errors)
+            return
+        self.set_window_title(self.themefile.theme_name)
         self.set_theme_dirty(False)
         self.theme_loaded_from_file = True
         self.enable_delete_theme_button(True)
@@ -367,9 +674,10 @@ class AlienFXApp(Gtk.Application):
             self.enable_action_edit_controls(False)
         
     def on_activate(self, data=None):
-        self.builder = Gtk.Builder()
-        self.builder.add_from_file(pkg_resources.resource_filename(
+        builder = Gtk.Builder()
+        builder.add_from_file(pkg_resources.resource_filename(
             "alienfx.ui.gtkui", "glade/ui.glade"))
+        self.builder = builder
         
         self.zone_list_view = self.builder.get_object("zone_list_view")
         self.zone_list_view.get_selection().set_mode(Gtk.SelectionMode.SINGLE)
@@ -377,9 +685,14 @@ class AlienFXApp(Gtk.Application):
             "button-press-event", self.zone_item_selected)
         self.action_cell_renderer = AlienFXActionCellRenderer(
             treeview=self.zone_list_view, max_colour_val=0xf)
-        col_colour = Gtk.TreeViewColumn(
+        self.actions_column = Gtk.TreeViewColumn(
             "Actions", self.action_cell_renderer, actions=1)
-        self.zone_list_view.append_column(col_colour)
+        self.actions_column.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
+        self.zone_list_view.append_column(self.actions_column)
+        self.zone_name_column = self.builder.get_object("treeviewcolumn1")
+        self.zone_name_column.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
+        self.zone_name_renderer = self.builder.get_object("cellrenderertext1")
+        self.zone_list_view.set_fixed_height_mode(True)
         
         self.open_theme_list_view = self.builder.get_object("open_theme_list_view")
         self.open_theme_list_view.get_selection().set_mode(Gtk.SelectionMode.SINGLE)
@@ -404,29 +717,70 @@ class AlienFXApp(Gtk.Application):
         self.builder.get_object("colour_palette2").add(self.palette2)
         self.palette2.set_sensitive(False)
         
+        toolbar = self.builder.get_object("toolbar")
+        live_preview_button = Gtk.ToggleToolButton()
+        live_preview_button.set_icon_name("media-playback-start")
+        live_preview_button.set_label("Live Preview")
+        live_preview_button.set_tooltip_text(
+            "Show edited colours on the computer as they are made")
+        live_preview_button.connect("toggled", self.on_live_preview_toggled)
+        toolbar.insert(live_preview_button, -1)
+        
+        accel_group = Gtk.AccelGroup()
+        self.undo_button = Gtk.ToolButton()
+        self.undo_button.set_icon_name("edit-undo")
+        self.undo_button.set_label("Undo")
+        self.undo_button.set_tooltip_text("Undo the last edit")
+        self.undo_button.connect("clicked", self.on_undo_clicked)
+        self.undo_button.add_accelerator("clicked", accel_group, 
+            Gdk.KEY_z, Gdk.ModifierType.CONTROL_MASK, Gtk.AccelFlags.VISIBLE)
+        self.undo_button.set_sensitive(False)
+        toolbar.insert(self.undo_button, -1)
+        self.redo_button = Gtk.ToolButton()
+        self.redo_button.set_icon_name("edit-redo")
+        self.redo_button.set_label("Redo")
+        self.redo_button.set_tooltip_text("Redo the last undone edit")
+        self.redo_button.connect("clicked", self.on_redo_clicked)
+        self.redo_button.add_accelerator("clicked", accel_group, 
+            Gdk.KEY_z, 
+            Gdk.ModifierType.CONTROL_MASK | Gdk.ModifierType.SHIFT_MASK, 
+            Gtk.AccelFlags.VISIBLE)
+        self.redo_button.set_sensitive(False)
+        toolbar.insert(self.redo_button, -1)
+        
+        status_box = self.builder.get_object("box3")
+        self.apply_cancel_button = Gtk.Button.new_with_label("Cancel")
+        self.apply_cancel_button.connect("clicked", self.on_apply_cancel_clicked)
+        self.apply_cancel_button.set_no_show_all(True)
+        status_box.pack_end(self.apply_cancel_button, False, False, 0)
+        self.apply_progress_bar = Gtk.ProgressBar()
+        self.apply_progress_bar.set_show_text(True)
+        self.apply_progress_bar.set_valign(Gtk.Align.CENTER)
+        self.apply_progress_bar.set_no_show_all(True)
+        status_box.pack_end(self.apply_progress_bar, False, False, 0)
+        
         self.builder.connect_signals(self)
         main_window = self.builder.get_object("main_window")
         main_window.set_icon_from_file(pkg_resources.resource_filename(
             "alienfx", "data/icons/hicolor/scalable/apps/alienfx.svg"))
+        main_window.set_title("Alien FX")
+        main_window.add_accel_group(accel_group)
         main_window.show_all()
         self.add_window(main_window)
         
-        if self.controller is None:
-            Gtk.MessageDialog(
-                main_window, Gtk.DialogFlags.MODAL, 
-                Gtk.MessageType.ERROR, 
-                Gtk.ButtonsType.CLOSE, 
-                "No supported Alien FX controller found!").run()
-            quit()
-            
-        self.themefile = AlienFXThemeFile(self.controller)
-        last_theme_loaded = self.themefile.load_last_theme()
-        if last_theme_loaded:
-            self.load_theme("Current Theme")
-        else:
-            self.load_theme("New Theme")
-        self.theme_loaded_from_file = False
-        self.enable_delete_theme_button(False)
+        # Show the "detecting controller" state until probing is done.
+        self.builder.get_object("toolbar").set_sensitive(False)
+        self.builder.get_object("buttonbox1").set_sensitive(False)
+        self.zone_list_view.set_sensitive(False)
+        self.properties_frame.set_sensitive(False)
+        statusbar = self.builder.get_object("statusbar")
+        self.probe_context_id = statusbar.get_context_id("Probe")
+        statusbar.push(self.probe_context_id, "Detecting controller...")
+        spinner = self.builder.get_object("spinner")
+        spinner.show()
+        spinner.start()
+        if self.probe_done:
+            self.on_controller_probed(self.controller)
         
     def on_main_window_delete_event(self, widget, event):
         if self.theme_edited:
@@ -461,23 +815,36 @@ class AlienFXApp(Gtk.Application):
         model = self.zone_list_view.get_model()
         actions = model[treeiter][1]
         action = actions.actions[action_index]
-        self.themefile.set_action_type(action, self.action_type)
-        old_colours = self.themefile.get_action_colours(action)
+        # The theme is not changed in place; the edited action is replaced
+        # by a new one through the undo history.
+        old_colours = list(self.themefile.get_action_colours(action))
         if (self.action_type in [
                 self.themefile.KW_ACTION_TYPE_FIXED, 
                 self.themefile.KW_ACTION_TYPE_BLINK]):
             if len(old_colours) != 1:
-                old_colours = old_colours[0:0]
+                old_colours = old_colours[0:1]
         if self.action_type == self.themefile.KW_ACTION_TYPE_MORPH:
             if len(old_colours) != 2:
                 old_colours.append([0, 0, 0])
-        if sender.get_parent() == self.palette1:
-            old_colours[0] = colour
+        # The first palette edits the first colour of the action, and the
+        # second palette the second colour of a morph action.
         if sender.get_parent() == self.palette2:
-            old_colours[1] = colour
-        self.themefile.set_action_colours(action, old_colours)
-        model[treeiter][1] = actions
+            edited_index = 1
+        else:
+            edited_index = 0
+        old_colours[edited_index] = colour
+        (state, zone) = self.get_state_zone_at_iter(model, treeiter)
+        new_action = self.themefile.make_zone_action(
+            self.action_type, old_colours)
+        self.history.set_action(state, zone, action_index, new_action)
+        self.update_zone_row(state, zone)
+        self.update_undo_buttons()
         self.set_theme_dirty(True)
+        if self.live_preview:
+            # Show the colour of the palette being edited, as stored in the
+            # edited action.
+            self.queue_preview(zone, self.themefile.get_action_colours(
+                new_action)[edited_index])
                     
     def enable_action_edit_controls(self, enable):
         self.builder.get_object("toolbutton_add").set_sensitive(enable)
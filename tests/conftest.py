@@ -0,0 +1,49 @@
+#
+# conftest.py
+#
+# Copyright (C) 2013-2014 Ashwin Menon <ashwin.menon@gmail.com>
+# Copyright (C) 2015-2024 Track Master Steve <trackmastersteve@gmail.com>
+#
+# Alienfx is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# Alienfx is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with alienfx.    If not, write to:
+# 	The Free Software Foundation, Inc.,
+# 	51 Franklin Street, Fifth Floor
+# 	Boston, MA  02110-1301, USA.
+#
+
+""" Fixtures shared by the tests."""
+
+import pytest
+
+import alienfx.core.prober
+from alienfx.core.controller import AlienFXController
+
+
+@pytest.fixture
+def controller(monkeypatch):
+    """ A controller that records the packets it sends instead of talking
+    to a USB device."""
+    controller = [
+        c for c in AlienFXController.supported_controllers
+        if c.name == "Alienware M17xR3"][0]
+    controller.sent = []
+    for name in ["_ping", "_reset", "_wait_controller_ready"]:
+        monkeypatch.setattr(controller, name, lambda *args: None)
+    monkeypatch.setattr(
+        controller, "_send_cmds",
+        lambda cmds: controller.sent.extend(bytes(bytearray(c)) for c in cmds))
+    monkeypatch.setattr(controller._driver, "acquire", lambda: None)
+    monkeypatch.setattr(controller._driver, "release", lambda: None)
+    return controller
@@ -0,0 +1,70 @@
+#
+# test_controller.py
+#
+# Copyright (C) 2013-2014 Ashwin Menon <ashwin.menon@gmail.com>
+# Copyright (C) 2015-2024 Track Master Steve <trackmastersteve@gmail.com>
+#
+# Alienfx is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# Alienfx is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with alienfx.    If not, write to:
+# 	The Free Software Foundation, Inc.,
+# 	51 Franklin Street, Fifth Floor
+# 	Boston, MA  02110-1301, USA.
+#
+
+""" Tests of AlienFXController."""
+
+import json
+
+from alienfx.core.themefile import AlienFXThemeFile
+
+
+def _fixed(zones, colour):
+    return {"zones": zones, "loop": [{"type": "fixed", "colours": [colour]}]}
+
+
+def test_streaming_sends_the_packets_of_set_theme(controller, tmp_path):
+    # No Boot state, and the states are not in state map order.
+    theme = {
+        "Battery Critical": [_fixed(["Power Button"], [15, 0, 0])],
+        "speed": 300,
+        "AC Sleep": [_fixed(["Power Button", "HDD LEDs"], [0, 0, 8])],
+        "AC Charged": [{"zones": ["Power Button"], "loop": [
+            {"type": "morph", "colours": [[0, 15, 0], [0, 0, 15]]}]}]
+    }
+    with open(str(tmp_path / "unordered.json"), "w") as tfile:
+        json.dump(theme, tfile)
+
+    themefile = AlienFXThemeFile(controller, str(tmp_path))
+    assert controller.set_theme_streaming(themefile, "unordered")
+    streamed = controller.sent
+
+    controller.sent = []
+    themefile = AlienFXThemeFile(controller, str(tmp_path))
+    themefile.load("unordered")
+    assert controller.set_theme(themefile)
+    assert streamed == controller.sent
+
+
+def test_streaming_rejects_invalid_theme_before_sending(controller, tmp_path):
+    theme = {
+        "Boot": [_fixed(["Left Keyboard"], [1, 2, 3])],
+        "AC Sleep": [_fixed(["Power Button"], [99, 0, 0])]
+    }
+    with open(str(tmp_path / "invalid.json"), "w") as tfile:
+        json.dump(theme, tfile)
+
+    themefile = AlienFXThemeFile(controller, str(tmp_path))
+    assert not controller.set_theme_streaming(themefile, "invalid")
+    assert controller.sent == []
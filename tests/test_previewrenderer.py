@@ -0,0 +1,74 @@
+#
+# test_previewrenderer.py
+#
+# Copyright (C) 2013-2014 Ashwin Menon <ashwin.menon@gmail.com>
+# Copyright (C) 2015-2024 Track Master Steve <trackmastersteve@gmail.com>
+#
+# Alienfx is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# Alienfx is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with alienfx.    If not, write to:
+# 	The Free Software Foundation, Inc.,
+# 	51 Franklin Street, Fifth Floor
+# 	Boston, MA  02110-1301, USA.
+#
+
+""" Tests of AlienFXPreviewRenderer."""
+
+import os.path
+
+import pytest
+
+import alienfx
+import alienfx.core.prober
+from alienfx.core.controller import AlienFXController
+from alienfx.core.previewrenderer import AlienFXPreviewRenderer
+from alienfx.core.themefile import AlienFXThemeFile
+
+
+def _get_controller(name):
+    return [
+        c for c in AlienFXController.supported_controllers
+        if c.name == name][0]
+
+
+@pytest.mark.parametrize("action_type", ["blink", "morph"])
+@pytest.mark.parametrize("name", ["Alienware M17xR3", "Alienware 17R4"])
+def test_fastest_actions_render_distinct_frames(name, action_type, tmp_path):
+    controller = _get_controller(name)
+    themefile = AlienFXThemeFile(controller, str(tmp_path))
+    themefile.theme = {
+        "speed": 1,
+        "Boot": [{"zones": list(controller.zone_map), "loop": [
+            {"type": action_type, "colours": [[15, 0, 0], [0, 0, 15]]}]}]
+    }
+    renderer = AlienFXPreviewRenderer(themefile)
+    frames_dir = tmp_path / "frames"
+    num_frames = renderer.render_frames(str(frames_dir))
+    frames = set(
+        (frames_dir / "frame_{:04d}.png".format(frame)).read_bytes()
+        for frame in range(num_frames))
+    assert len(frames) > 1
+
+
+def test_bundled_hot_pursuit_renders_distinct_frames(tmp_path):
+    controller = _get_controller("Alienware 17R4")
+    themefile = AlienFXThemeFile(controller, os.path.join(
+        os.path.dirname(alienfx.__file__), "data", "themes"))
+    themefile.load("17r4_HotPursuit")
+    renderer = AlienFXPreviewRenderer(themefile)
+    num_frames = renderer.render_frames(str(tmp_path))
+    frames = set(
+        (tmp_path / "frame_{:04d}.png".format(frame)).read_bytes()
+        for frame in range(num_frames))
+    assert len(frames) > 1
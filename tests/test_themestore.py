@@ -0,0 +1,62 @@
+#
+# test_themestore.py
+#
+# Copyright (C) 2013-2014 Ashwin Menon <ashwin.menon@gmail.com>
+# Copyright (C) 2015-2024 Track Master Steve <trackmastersteve@gmail.com>
+#
+# Alienfx is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# Alienfx is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with alienfx.    If not, write to:
+# 	The Free Software Foundation, Inc.,
+# 	51 Franklin Street, Fifth Floor
+# 	Boston, MA  02110-1301, USA.
+#
+
+""" Tests of AlienFXThemeStore."""
+
+from alienfx.core.themefile import AlienFXThemeFile
+from alienfx.core.themestore import AlienFXThemeStore
+
+
+def _theme(colour):
+    return {"Boot": [{"zones": ["Power Button"], "loop": [
+        {"type": "fixed", "colours": [colour]}]}]}
+
+
+def test_invalid_themes_are_not_stored(controller, tmp_path):
+    path = str(tmp_path / "themes.store")
+    stored = AlienFXThemeStore.write(path, [
+        ("valid", _theme([15, 0, 0])),
+        ("invalid", _theme([99, 0, 0]))], [controller])
+    assert stored == ["valid"]
+    assert AlienFXThemeStore(path).get_names() == ["valid"]
+
+
+def test_apply_sends_compiled_packets_without_decoding(
+        controller, tmp_path, monkeypatch):
+    path = str(tmp_path / "themes.store")
+    AlienFXThemeStore.write(path, [("red", _theme([15, 0, 0]))], [controller])
+    themefile = AlienFXThemeFile(controller, str(tmp_path))
+    themefile.theme = _theme([15, 0, 0])
+    assert controller.set_theme(themefile)
+    expected = controller.sent
+
+    controller.sent = []
+    store = AlienFXThemeStore(path)
+    def get_theme(name):
+        raise AssertionError("theme decoded")
+    monkeypatch.setattr(store, "get_theme", get_theme)
+    assert store.apply("red", controller, AlienFXThemeFile(
+        controller, str(tmp_path)))
+    assert controller.sent == expected